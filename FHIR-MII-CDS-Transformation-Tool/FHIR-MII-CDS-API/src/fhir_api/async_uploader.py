@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from fhir_api.bundle_uploader import (
+    BundleEntry,
+    EntryOutcome,
+    build_bundle,
+    bundle_outcomes,
+    send_with_retry,
+    serialize_resource,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncUploadPipeline:
+    """
+    Uploads resources concurrently while the caller keeps transforming.
+
+    Submitted resources are put into a bounded asyncio queue which is drained by
+    `workers` concurrent upload coroutines running on an event loop in a background
+    thread. If the queue is full, submit() blocks until a worker has taken a resource,
+    so the memory used by pending uploads stays bounded (back-pressure). The blocking
+    HTTP requests of the workers run in a thread pool with one keep-alive session per
+    thread.
+
+    With bundle_size > 1 a worker sends all resources waiting in the queue (up to
+    bundle_size) as one transaction or batch bundle, otherwise every resource is sent
+    with a separate PUT (with ID) or POST (without ID).
+
+    Args:
+        base_url (str): The base URL of the FHIR server.
+        workers (int): The maximum number of requests in flight.
+        queue_size (int): The maximum number of resources waiting for upload.
+        bundle_size (int): The maximum number of resources per request.
+        bundle_type (str): "transaction" or "batch", used if bundle_size > 1.
+        retry_count (int): The number of retries of a request.
+        backoff_factor (float): The wait before the n-th retry is backoff_factor * 2 ** (n - 1) seconds.
+        timeout (float): The timeout of a single request in seconds.
+        on_outcome (Callable[[EntryOutcome], None]): Called for the outcome of every resource,
+            from the thread of the event loop.
+    """
+
+    def __init__(
+            self,
+            base_url,
+            workers=8,
+            queue_size=1000,
+            bundle_size=1,
+            bundle_type="transaction",
+            retry_count=10,
+            backoff_factor=1.0,
+            timeout=300.0,
+            on_outcome: Optional[Callable[[EntryOutcome], None]] = None,
+    ):
+        if bundle_type not in ("transaction", "batch"):
+            raise ValueError(f"Unsupported bundle type: {bundle_type}")
+        self.base_url = base_url.rstrip("/")
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.bundle_size = max(1, bundle_size)
+        self.bundle_type = bundle_type
+        self.retry_count = retry_count
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.on_outcome = on_outcome
+        self.succeeded = 0
+        self.failed = 0
+
+        self._sessions = threading.local()
+        self._all_sessions = []
+        self._sessions_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="fhir-upload",
+        )
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever,
+            name="fhir-upload-loop",
+            daemon=True,
+        )
+        self._thread.start()
+        self._queue = None
+        self._tasks = []
+        self._run(self._start())
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def submit(self, resource, resource_type, resource_id=None):
+        """
+        Queues a resource for upload, blocking while the queue is full.
+
+        Args:
+            resource: The resource as fhir.resources model, dict, JSON string or JSON bytes.
+            resource_type (str): The type of the resource.
+            resource_id (str): The ID of the resource. Resources with ID are PUT, others are POSTed.
+        """
+        if self._closed:
+            raise RuntimeError("The upload pipeline is closed")
+        entry = BundleEntry(resource_type, resource_id, serialize_resource(resource))
+        self._run(self._queue.put(entry))
+
+    def join(self):
+        """
+        Blocks until all queued resources are uploaded.
+        """
+        self._run(self._queue.join())
+
+    def close(self):
+        """
+        Uploads all queued resources and stops the workers and the event loop.
+        """
+        if self._closed:
+            return
+        self.join()
+        self._closed = True
+        self._run(self._stop())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown()
+        for session in self._all_sessions:
+            session.close()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            entries = [await self._queue.get()]
+            while len(entries) < self.bundle_size and not self._queue.empty():
+                entries.append(self._queue.get_nowait())
+            try:
+                outcomes = await loop.run_in_executor(self._executor, self._send, entries)
+            except Exception as error:
+                logger.exception("Upload failed unexpectedly.")
+                outcomes = [
+                    EntryOutcome(entry.resource_type, entry.resource_id, f"error: {error}")
+                    for entry in entries
+                ]
+            for outcome in outcomes:
+                self._record(outcome)
+            for _ in entries:
+                self._queue.task_done()
+
+    def _record(self, outcome):
+        if outcome.success:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+            logger.error(
+                f"Failed to upload {outcome.resource_type}/{outcome.resource_id or ''}. "
+                f"Status: {outcome.status}, Outcome: {outcome.outcome}"
+            )
+        if self.on_outcome:
+            self.on_outcome(outcome)
+
+    def _session(self):
+        session = getattr(self._sessions, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"Content-Type": "application/fhir+json"})
+            self._sessions.session = session
+            with self._sessions_lock:
+                self._all_sessions.append(session)
+        return session
+
+    def _send(self, entries):
+        """
+        Sends the entries as bundle or, if it is a single entry and bundling is disabled,
+        as a single PUT or POST. Runs in a thread of the executor.
+
+        Returns:
+            list[EntryOutcome]: The outcome of every entry.
+        """
+        if self.bundle_size > 1:
+            method, url = "POST", self.base_url
+            body = build_bundle(entries, self.base_url, self.bundle_type)
+        else:
+            entry = entries[0]
+            if entry.resource_id:
+                method, url = "PUT", f"{self.base_url}/{entry.resource_type}/{entry.resource_id}"
+            else:
+                method, url = "POST", f"{self.base_url}/{entry.resource_type}"
+            body = entry.body
+
+        response, status = send_with_retry(
+            self._session(),
+            method,
+            url,
+            body,
+            retry_count=self.retry_count,
+            backoff_factor=self.backoff_factor,
+            timeout=self.timeout,
+        )
+        if response is not None and self.bundle_size > 1:
+            return bundle_outcomes(entries, response)
+        return [
+            EntryOutcome(
+                entry.resource_type,
+                entry.resource_id,
+                status,
+                location=response.headers.get("Location") if response is not None else None,
+            )
+            for entry in entries
+        ]
@@ -0,0 +1,392 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Status codes for which a bundle is sent again
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+@dataclass
+class EntryOutcome:
+    """
+    Outcome of a single bundle entry as reported by the FHIR server.
+
+    Attributes:
+        resource_type (str): The type of the resource.
+        resource_id (str): The ID of the resource, None if it was created with POST.
+        status (str): The HTTP status of the entry, e.g. "201 Created".
+        location (str): The location of the created or updated resource.
+        outcome (dict): The OperationOutcome returned for the entry, if any.
+    """
+    resource_type: str
+    resource_id: Optional[str]
+    status: str
+    location: Optional[str] = None
+    outcome: Optional[dict] = None
+
+    @property
+    def success(self):
+        return self.status.startswith("2")
+
+
+@dataclass
+class BundleEntry:
+    """
+    A serialized resource waiting for upload.
+    """
+    resource_type: str
+    resource_id: Optional[str]
+    body: bytes = field(repr=False)
+
+
+def serialize_resource(resource):
+    """
+    Serializes a resource to UTF-8 encoded JSON. Resources that are already serialized
+    are returned as they are.
+
+    Args:
+        resource: The resource as fhir.resources model, dict, JSON string or JSON bytes.
+
+    Returns:
+        bytes: The JSON of the resource.
+    """
+    if isinstance(resource, bytes):
+        return resource
+    if isinstance(resource, (bytearray, memoryview)):
+        return bytes(resource)
+    if isinstance(resource, str):
+        return resource.encode("utf-8")
+    if isinstance(resource, dict):
+        return dumps_json(resource)
+    return resource.json(return_bytes=True)
+
+
+def dumps_json(value):
+    """
+    Serializes a value to compact UTF-8 encoded JSON, using orjson if it is installed.
+
+    Non-ASCII characters are not escaped. NumPy scalars are serialized as their Python
+    value, other values that are not JSON serializable as their string.
+
+    Args:
+        value: The value to serialize.
+
+    Returns:
+        bytes: The JSON of the value.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        value,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=_json_default,
+    ).encode("utf-8")
+
+
+def _json_default(value):
+    if hasattr(value, "dtype") and hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+class BundleUploader:
+    """
+    Uploads resources to a FHIR server in transaction or batch bundles.
+
+    The uploader keeps a pool of keep-alive connections and collects the added resources
+    until either bundle_size resources are buffered or flush_interval seconds have passed
+    since the first buffered resource. A timer thread sends the buffered resources when
+    the interval has passed, also if no further resource is added. Bundles that fail because of connection errors or
+    server overload are sent again with exponential backoff. The uploader can be shared by
+    threads, a bundle is sent by the thread whose resource completes it.
+
+    Args:
+        base_url (str): The base URL of the FHIR server.
+        bundle_type (str): "transaction" (all or nothing) or "batch" (independent entries).
+        bundle_size (int): The maximum number of entries per bundle.
+        flush_interval (float): The maximum number of seconds a resource is buffered, 0 sends
+            every resource as soon as it is added.
+        retry_count (int): The number of retries of a bundle.
+        backoff_factor (float): The wait before the n-th retry is backoff_factor * 2 ** (n - 1) seconds.
+        pool_size (int): The number of pooled connections.
+        timeout (float): The timeout of a single request in seconds.
+        on_outcome (Callable[[EntryOutcome], None]): Called for the outcome of every entry.
+    """
+
+    def __init__(
+            self,
+            base_url,
+            bundle_type="transaction",
+            bundle_size=500,
+            flush_interval=30.0,
+            retry_count=10,
+            backoff_factor=1.0,
+            pool_size=10,
+            timeout=300.0,
+            on_outcome: Optional[Callable[[EntryOutcome], None]] = None,
+    ):
+        if bundle_type not in ("transaction", "batch"):
+            raise ValueError(f"Unsupported bundle type: {bundle_type}")
+        self.base_url = base_url.rstrip("/")
+        self.bundle_type = bundle_type
+        self.bundle_size = max(1, bundle_size)
+        self.flush_interval = flush_interval
+        self.retry_count = retry_count
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.on_outcome = on_outcome
+        self.succeeded = 0
+        self.failed = 0
+        self._entries = []
+        self._first_entry_time = None
+        self._timer = None
+        self._lock = threading.RLock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/fhir+json"})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, resource, resource_type, resource_id=None):
+        """
+        Adds a resource to the current bundle and sends the bundle if it is due.
+
+        Args:
+            resource: The resource as fhir.resources model, dict, JSON string or JSON bytes.
+            resource_type (str): The type of the resource.
+            resource_id (str): The ID of the resource. Resources with ID are PUT, others are POSTed.
+
+        Returns:
+            list[EntryOutcome]: The outcomes of the sent bundle, empty if no bundle was sent.
+        """
+        entry = BundleEntry(resource_type, resource_id, serialize_resource(resource))
+        with self._lock:
+            if not self._entries:
+                self._first_entry_time = time.monotonic()
+                self._start_timer()
+            self._entries.append(entry)
+            if (
+                len(self._entries) >= self.bundle_size
+                or time.monotonic() - self._first_entry_time >= self.flush_interval
+            ):
+                return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Sends all buffered resources.
+
+        Returns:
+            list[EntryOutcome]: The outcomes of the sent entries.
+        """
+        with self._lock:
+            outcomes = []
+            while self._entries:
+                entries = self._entries[:self.bundle_size]
+                del self._entries[:self.bundle_size]
+                outcomes.extend(self._send(entries))
+            self._first_entry_time = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for outcome in outcomes:
+                if outcome.success:
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+                    logger.error(
+                        f"Failed to upload {outcome.resource_type}/{outcome.resource_id or ''}. "
+                        f"Status: {outcome.status}, Outcome: {outcome.outcome}"
+                    )
+                if self.on_outcome:
+                    self.on_outcome(outcome)
+        return outcomes
+
+    def close(self):
+        """
+        Sends all buffered resources and closes the connection pool.
+        """
+        self.flush()
+        self.session.close()
+
+    def _start_timer(self):
+        if self.flush_interval <= 0:
+            return
+        self._timer = threading.Timer(self.flush_interval, self._flush_overdue)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_overdue(self):
+        with self._lock:
+            # The buffer was sent in the meantime, the timer belongs to a later resource
+            if self._timer is not threading.current_thread():
+                return
+            self._timer = None
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to send the buffered resources.")
+
+    def _send(self, entries):
+        """
+        Sends a single bundle, retrying on connection errors and server overload.
+
+        Returns:
+            list[EntryOutcome]: The outcome of every entry of the bundle.
+        """
+        body = build_bundle(entries, self.base_url, self.bundle_type)
+        response, status = send_with_retry(
+            self.session,
+            "POST",
+            self.base_url,
+            body,
+            retry_count=self.retry_count,
+            backoff_factor=self.backoff_factor,
+            timeout=self.timeout,
+        )
+        if response is None:
+            return [
+                EntryOutcome(entry.resource_type, entry.resource_id, status)
+                for entry in entries
+            ]
+        return bundle_outcomes(entries, response)
+
+
+def build_bundle(entries, base_url, bundle_type):
+    """
+    Builds the bundle JSON from already serialized resources.
+
+    Args:
+        entries (list[BundleEntry]): The entries of the bundle.
+        base_url (str): The base URL of the FHIR server.
+        bundle_type (str): "transaction" or "batch".
+
+    Returns:
+        bytes: The bundle JSON.
+    """
+    parts = []
+    for entry in entries:
+        if entry.resource_id:
+            url = f"{entry.resource_type}/{entry.resource_id}"
+            request = {"method": "PUT", "url": url}
+            full_url = f"{base_url}/{url}"
+        else:
+            request = {"method": "POST", "url": entry.resource_type}
+            full_url = f"urn:uuid:{uuid.uuid4()}"
+        parts.append(
+            f'{{"fullUrl":{json.dumps(full_url)},"resource":'.encode("utf-8")
+            + entry.body
+            + f',"request":{json.dumps(request)}}}'.encode("utf-8")
+        )
+    return (
+        f'{{"resourceType":"Bundle","type":{json.dumps(bundle_type)},"entry":['.encode("utf-8")
+        + b",".join(parts)
+        + b"]}"
+    )
+
+
+def send_with_retry(session, method, url, body, retry_count=10, backoff_factor=1.0, timeout=300.0):
+    """
+    Sends a request, retrying on connection errors and server overload with exponential backoff.
+
+    Args:
+        session (requests.Session): The session to send the request with.
+        method (str): The HTTP method.
+        url (str): The URL of the request.
+        body (bytes): The request body.
+        retry_count (int): The number of retries.
+        backoff_factor (float): The wait before the n-th retry is backoff_factor * 2 ** (n - 1) seconds.
+        timeout (float): The timeout of a single request in seconds.
+
+    Returns:
+        tuple[requests.Response | None, str]: The final response (None if the server could not
+        be reached) and its status.
+    """
+    attempt = 0
+    while True:
+        try:
+            response = session.request(method, url, data=body, timeout=timeout)
+            status = f"{response.status_code} {response.reason}"
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response, status
+            retry_after = response.headers.get("Retry-After")
+            logger.warning(f"Request rejected with status {status}.")
+        except (requests.ConnectionError, requests.Timeout) as error:
+            response = None
+            status = f"connection error: {error}"
+            retry_after = None
+            logger.error("Connection Error - the server could not be reached.")
+
+        attempt += 1
+        if attempt > retry_count:
+            logger.error("Max retries exceeded.")
+            return response, status
+        wait = backoff_factor * 2 ** (attempt - 1)
+        if retry_after and retry_after.isdigit():
+            wait = max(wait, int(retry_after))
+        logger.info(f"Retrying in {wait:.1f}s... Attempt {attempt}/{retry_count}")
+        time.sleep(wait)
+
+
+def bundle_outcomes(entries, response):
+    """
+    Maps the response of the FHIR server to a bundle to the outcomes of its entries.
+
+    Args:
+        entries (list[BundleEntry]): The entries of the sent bundle.
+        response (requests.Response): The response of the FHIR server.
+
+    Returns:
+        list[EntryOutcome]: The outcome of every entry.
+    """
+    try:
+        response_body = response.json()
+    except ValueError:
+        response_body = None
+
+    if response.status_code != 200 or not isinstance(response_body, dict):
+        status = f"{response.status_code} {response.reason}"
+        return [
+            EntryOutcome(entry.resource_type, entry.resource_id, status, outcome=response_body)
+            for entry in entries
+        ]
+
+    response_entries = response_body.get("entry", [])
+    outcomes = []
+    for index, entry in enumerate(entries):
+        entry_response = (
+            response_entries[index].get("response", {})
+            if index < len(response_entries) else {}
+        )
+        outcomes.append(
+            EntryOutcome(
+                entry.resource_type,
+                entry.resource_id,
+                entry_response.get("status", "unknown"),
+                location=entry_response.get("location"),
+                outcome=entry_response.get("outcome"),
+            )
+        )
+    return outcomes
@@ -5,6 +5,8 @@ import json
 import logging
 import os
 
+from fhir_api.bundle_uploader import serialize_resource
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -99,39 +101,65 @@ class FHIRClient:
         else:
             logger.error(f"Failed to retrieve the resource. Status code: {response.status_code}")
 
+def ndjson_path(resource_type, output_folder="output"):
+    """
+    Returns the path of the NDJSON file the resources of a type are appended to.
+
+    Args:
+        resource_type (str): The type of the resources.
+        output_folder (str): The folder of the NDJSON files.
+    """
+    return os.path.join(output_folder, f"{resource_type}_resources.ndjson")
+
+
 def create_update_resource(
-        resource, resource_type, resource_id, base_url="http://localhost:8080/fhir", ndjson=True, retry_count=10, no_fhir_server=False
+        resource, resource_type, resource_id, base_url="http://localhost:8080/fhir", ndjson=True, retry_count=10, no_fhir_server=False,
+        pipeline=None, ndjson_file=None, writer=None
 ):
     """
     Creates or updates a resource with a specific ID on the FHIR server.
 
     Args:
         ndjson (bool): Whether to append the resource in NDJSON format to a file.
-        resource (dict): The resource to create or update.
+        resource: The resource to create or update, as fhir.resources model, dict or JSON string.
         resource_type (str): The type of the resource.
         resource_id (str): The ID of the resource.
         base_url (str): The base URL of the FHIR server.
         retry_count (int): The number of retries in case of connection errors.
+        pipeline (AsyncUploadPipeline): If given, the resource is queued for concurrent upload
+            and the function returns without waiting for the FHIR server.
+        ndjson_file (str): The NDJSON file the resource is appended to, defaults to
+            ndjson_path(resource_type).
+        writer (NDJSONWriterPool): If given, the resource is appended through the open handle
+            of the pool instead of opening the NDJSON file.
     """
 
     headers = {"Content-Type": "application/fhir+json"}
     attempt = 0
+    body = serialize_resource(resource)
     if ndjson:
         # Append the resource JSON to a ndjson file
-        os.makedirs("output", exist_ok=True)
-        with open(os.path.join("output", f"{resource_type}_resources.ndjson"), "a") as file:
-            file.write(resource.json() + "\n")
+        ndjson_file = ndjson_file or ndjson_path(resource_type)
+        if writer is not None:
+            writer.write(ndjson_file, body)
+        else:
+            os.makedirs(os.path.dirname(ndjson_file) or ".", exist_ok=True)
+            with open(ndjson_file, "ab") as file:
+                file.write(body + b"\n")
         logger.debug("Resource appended to NDJSON file")
     if no_fhir_server:
         return
+    if pipeline is not None:
+        pipeline.submit(body, resource_type, resource_id)
+        return
     while attempt < retry_count:
         try:
             if resource_id:
                 url = f"{base_url}/{resource_type}/{resource_id}"
-                response = requests.put(url, data=resource.json(), headers=headers)
+                response = requests.put(url, data=body, headers=headers)
             else:
                 url = f"{base_url}/{resource_type}"
-                response = requests.post(url, data=resource.json(), headers=headers)
+                response = requests.post(url, data=body, headers=headers)
 
             if response.status_code in [200, 201]:
                 resource_data = response.json()
@@ -150,3 +178,38 @@ def create_update_resource(
             else:
                 logger.error("Max retries exceeded.")
                 return None
+
+
+def delete_resource(resource_type, resource_id, base_url="http://localhost:8080/fhir", retry_count=10):
+    """
+    Deletes a resource with a specific ID on the FHIR server.
+
+    Args:
+        resource_type (str): The type of the resource.
+        resource_id (str): The ID of the resource.
+        base_url (str): The base URL of the FHIR server.
+        retry_count (int): The number of retries in case of connection errors.
+
+    Returns:
+        bool: Whether the resource was deleted or did not exist.
+    """
+    url = f"{base_url}/{resource_type}/{resource_id}"
+    attempt = 0
+    while attempt < retry_count:
+        try:
+            response = requests.delete(url)
+            if response.status_code in [200, 202, 204, 404, 410]:
+                logger.debug(f"Deleted resource {resource_type}/{resource_id}")
+                return True
+            logger.error(f"Failed to delete the resource. Status code: {response.status_code}, Response: {response.text}")
+            return False
+
+        except requests.ConnectionError:
+            logger.error("Connection Error - the server could not be reached.")
+            attempt += 1
+            if attempt < retry_count:
+                time.sleep(2)  # Wait before retrying
+                logger.info(f"Retrying... Attempt {attempt}/{retry_count}")
+            else:
+                logger.error("Max retries exceeded.")
+    return False
@@ -0,0 +1,97 @@
+import atexit
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Supported fsync policies
+FSYNC_POLICIES = ("never", "flush", "close")
+
+
+class NDJSONWriterPool:
+    """
+    Keeps one buffered append handle per NDJSON file for the lifetime of a run.
+
+    Lines are collected in the buffer of the file and written in blocks of buffer_size
+    bytes, instead of opening and closing the file for every resource. All handles are
+    flushed and closed by close(), which is also registered to run at interpreter exit.
+
+    Args:
+        buffer_size (int): The size of the write buffer per file in bytes.
+        fsync (str): When the written data is forced to disk: "never" (left to the operating
+            system), "flush" (on every explicit flush() and on close) or "close" (on close only).
+    """
+
+    def __init__(self, buffer_size=1024 * 1024, fsync="never"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unsupported fsync policy: {fsync}")
+        self.buffer_size = buffer_size
+        self.fsync = fsync
+        self._handles = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, path, line):
+        """
+        Appends a line to an NDJSON file.
+
+        Args:
+            path (str): The path of the NDJSON file.
+            line (str | bytes): The JSON of a resource, without line break.
+        """
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+        handle = self.handle(path)
+        with self._lock:
+            handle.write(line)
+            handle.write(b"\n")
+
+    def handle(self, path):
+        """
+        Returns the buffered binary append handle of a file, opening it on first use.
+
+        Args:
+            path (str): The path of the NDJSON file.
+        """
+        key = os.path.abspath(path)
+        handle = self._handles.get(key)
+        if handle is None:
+            with self._lock:
+                handle = self._handles.get(key)
+                if handle is None:
+                    os.makedirs(os.path.dirname(key), exist_ok=True)
+                    handle = open(key, "ab", buffering=self.buffer_size)
+                    self._handles[key] = handle
+        return handle
+
+    def flush(self):
+        """
+        Writes the buffered lines of all files, forcing them to disk if the fsync policy is "flush".
+        """
+        with self._lock:
+            for handle in self._handles.values():
+                self._flush_handle(handle, self.fsync == "flush")
+
+    def close(self):
+        """
+        Flushes and closes all files.
+        """
+        with self._lock:
+            for handle in self._handles.values():
+                self._flush_handle(handle, self.fsync != "never")
+                handle.close()
+            self._handles.clear()
+        atexit.unregister(self.close)
+
+    @staticmethod
+    def _flush_handle(handle, sync):
+        handle.flush()
+        if sync:
+            os.fsync(handle.fileno())
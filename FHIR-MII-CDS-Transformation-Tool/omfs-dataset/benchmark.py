@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import synthetic
+
+"""
+This module benchmarks the transformation of the synthetic OMFS data warehouse export.
+
+For every scale, the synthetic tables are generated (once, they are reused by later
+benchmarks with the same scale and seed) and transformed by dw2cds in a separate process
+with a profiling report. The benchmark reports per scale the wall time and the peak
+resident set size of the run, and per mapping the transformed rows, rows per second and
+peak resident set size from the profiling report.
+
+Unless a FHIR server is given, the resources are uploaded to a local sink that accepts
+every request, so the benchmark measures the transformation and not the FHIR server.
+
+With a baseline report of an earlier benchmark, mappings whose throughput dropped or
+whose memory grew by more than the tolerance are reported as regressions and the
+benchmark exits with status 1.
+
+Usage:
+    python benchmark.py --scales 10000 1000000 10000000 --baseline benchmark.json
+    python benchmark.py --scales 10000 -- --validation none --chunk_size 100000
+"""
+
+logger = logging.getLogger(__name__)
+
+DW2CDS = os.path.join(synthetic.TOOL_ROOT, "src", "dw2cds", "dw2cds.py")
+
+API_SOURCE = os.path.join(synthetic.TOOL_ROOT, "FHIR-MII-CDS-API", "src")
+
+PROCESSORS = os.path.join(
+    synthetic.TOOL_ROOT,
+    "omfs-dataset",
+    "config",
+    "omfs_data_processors.py",
+)
+
+SCALES = (10_000, 1_000_000, 10_000_000)
+
+
+class _SinkHandler(BaseHTTPRequestHandler):
+    """
+    Accepts every FHIR request, answering bundles with a created entry per resource.
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            resource = json.loads(body)
+        except ValueError:
+            resource = {}
+        if resource.get("resourceType") == "Bundle":
+            entries = [
+                {"response": {"status": "201 Created"}} for _ in resource.get("entry", [])
+            ]
+            self._respond(
+                200,
+                {"resourceType": "Bundle", "type": "batch-response", "entry": entries},
+            )
+        else:
+            self._respond(201, resource)
+
+    do_PUT = do_POST
+
+    def do_DELETE(self):
+        self._respond(200, {"resourceType": "OperationOutcome"})
+
+    def do_GET(self):
+        self._respond(200, {"resourceType": "CapabilityStatement"})
+
+    def _respond(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/fhir+json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_sink() -> tuple[ThreadingHTTPServer, str]:
+    """
+    Starts the local FHIR sink on a free port.
+
+    Returns:
+        tuple[ThreadingHTTPServer, str]: The server, to be shut down, and its base URL.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SinkHandler)
+    threading.Thread(target=server.serve_forever, name="fhir-sink", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/fhir"
+
+
+def prepare_data(work_dir: str, rows: int, seed: int, config_path: str) -> str:
+    """
+    Generates the synthetic tables of a scale, unless they were generated before.
+
+    Args:
+        work_dir (str): The folder of the benchmark.
+        rows (int): The scale.
+        seed (int): The seed of the synthetic tables.
+        config_path (str): The path of config.json.
+
+    Returns:
+        str: The data folder.
+    """
+    data_folder = os.path.join(work_dir, f"data-{rows}")
+    marker_path = os.path.join(data_folder, "synthetic.json")
+    marker = {"rows": rows, "seed": seed, "config": os.path.abspath(config_path)}
+    try:
+        with open(marker_path) as file:
+            if json.load(file) == marker:
+                logger.info(f"Reusing the synthetic tables of {rows} rows")
+                return data_folder
+    except (OSError, ValueError):
+        pass
+    logger.info(f"Generating the synthetic tables of {rows} rows")
+    synthetic.generate(data_folder, rows=rows, seed=seed, config_path=config_path)
+    with open(marker_path, "w") as file:
+        json.dump(marker, file)
+    return data_folder
+
+
+def run_scale(
+    work_dir: str,
+    data_folder: str,
+    rows: int,
+    config_path: str,
+    fhir_base_url: str,
+    dw2cds_args: list[str],
+) -> dict:
+    """
+    Transforms the synthetic tables of a scale in a separate dw2cds process.
+
+    Args:
+        work_dir (str): The folder of the benchmark.
+        data_folder (str): The folder of the synthetic tables.
+        rows (int): The scale.
+        config_path (str): The path of config.json.
+        fhir_base_url (str): The URL of the FHIR server.
+        dw2cds_args (list[str]): Further arguments of dw2cds.
+
+    Returns:
+        dict: The wall time and peak resident set size of the run and the profiled
+        mappings.
+
+    Raises:
+        RuntimeError: If dw2cds fails.
+    """
+    run_folder = os.path.join(work_dir, f"run-{rows}")
+    os.makedirs(run_folder, exist_ok=True)
+    profile_path = os.path.join(run_folder, "profile.json")
+    command = [
+        sys.executable,
+        DW2CDS,
+        "-c",
+        config_path,
+        "-d",
+        data_folder,
+        "-o",
+        os.path.join(run_folder, "output"),
+        "-p",
+        PROCESSORS,
+        "-f",
+        fhir_base_url,
+        "--profile_report",
+        profile_path,
+        *dw2cds_args,
+    ]
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [API_SOURCE, environment.get("PYTHONPATH")]),
+    )
+    logger.info(f"Transforming {rows} rows")
+    start = time.perf_counter()
+    with open(os.path.join(run_folder, "dw2cds.log"), "w") as log:
+        # The output files are written relative to the working directory
+        process = subprocess.Popen(
+            command,
+            cwd=run_folder,
+            env=environment,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(process.pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+            process.returncode = returncode
+            # ru_maxrss is in bytes on macOS and in KiB elsewhere
+            peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+        else:
+            returncode = process.wait()
+            peak_rss = 0
+    seconds = time.perf_counter() - start
+    if returncode != 0:
+        raise RuntimeError(
+            f"dw2cds failed with exit code {returncode}, see {run_folder}/dw2cds.log",
+        )
+    with open(profile_path) as file:
+        mappings = json.load(file)["mappings"]
+    transformed = sum(mapping["rows"] for mapping in mappings.values())
+    return {
+        "seconds": seconds,
+        "peak_rss_bytes": peak_rss,
+        "rows": transformed,
+        "rows_per_second": transformed / seconds if seconds > 0 else None,
+        "mappings": mappings,
+    }
+
+
+def find_regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compares a benchmark report with the report of an earlier benchmark.
+
+    Args:
+        report (dict): The benchmark report.
+        baseline (dict): The earlier benchmark report.
+        tolerance (float): The accepted relative drop of the throughput and growth of the
+            peak resident set size.
+
+    Returns:
+        list[str]: A description of every regression.
+    """
+    regressions = []
+    for scale, result in report["scales"].items():
+        previous = baseline.get("scales", {}).get(scale)
+        if previous is None:
+            continue
+        measurements = [(f"scale {scale}", result, previous)] + [
+            (f"scale {scale} mapping {key}", mapping, previous["mappings"][key])
+            for key, mapping in result["mappings"].items()
+            if key in previous["mappings"]
+        ]
+        for name, current, before in measurements:
+            if (
+                current.get("rows_per_second") and before.get("rows_per_second")
+                and current["rows_per_second"] < before["rows_per_second"] * (1 - tolerance)
+            ):
+                regressions.append(
+                    f"{name}: {current['rows_per_second']:.0f} rows/s, "
+                    f"was {before['rows_per_second']:.0f} rows/s",
+                )
+            if (
+                current.get("peak_rss_bytes") and before.get("peak_rss_bytes")
+                and current["peak_rss_bytes"] > before["peak_rss_bytes"] * (1 + tolerance)
+            ):
+                regressions.append(
+                    f"{name}: {_mib(current['peak_rss_bytes'])} peak RSS, "
+                    f"was {_mib(before['peak_rss_bytes'])}",
+                )
+    return regressions
+
+
+def format_report(report: dict) -> str:
+    """
+    Formats a benchmark report as a table per scale.
+    """
+    lines = []
+    for scale, result in report["scales"].items():
+        lines.append(
+            f"{scale} rows: {result['rows']} transformed in {result['seconds']:.1f}s, "
+            f"{result['rows_per_second'] or 0:.0f} rows/s, "
+            f"{_mib(result['peak_rss_bytes'])} peak RSS",
+        )
+        width = max((len(key) for key in result["mappings"]), default=0)
+        for key, mapping in result["mappings"].items():
+            lines.append(
+                f"  {key:<{width}} {mapping['rows']:>10} rows "
+                f"{mapping['rows_per_second'] or 0:>10.0f} rows/s "
+                f"{_mib(mapping.get('peak_rss_bytes', 0)):>10}",
+            )
+    return "\n".join(lines)
+
+
+def _mib(size: int) -> str:
+    return f"{size / 1024 / 1024:.0f} MiB"
+
+
+parser = argparse.ArgumentParser(
+    description="Benchmark of dw2cds on the synthetic OMFS data warehouse export, "
+    "arguments after -- are passed to dw2cds",
+)
+parser.add_argument(
+    "--scales",
+    type=int,
+    nargs="+",
+    help="Numbers of rows of the event tables of the benchmarked synthetic exports",
+    default=list(SCALES),
+)
+parser.add_argument(
+    "--work_dir",
+    type=str,
+    help="Folder of the synthetic tables, the dw2cds output and the benchmark report",
+    default=os.path.join(os.getcwd(), "benchmark"),
+)
+parser.add_argument(
+    "--seed",
+    type=int,
+    help="Seed of the synthetic tables",
+    default=0,
+)
+parser.add_argument(
+    "-c",
+    "--config_path",
+    type=str,
+    help="Path to the FHIR config file",
+    default=synthetic.DEFAULT_CONFIG,
+)
+parser.add_argument(
+    "-f",
+    "--fhir_server_url",
+    type=str,
+    help="URL of the FHIR server, a local sink accepting every upload is used if not set",
+    default=None,
+)
+parser.add_argument(
+    "--baseline",
+    type=str,
+    help="Path of the report of an earlier benchmark to detect regressions",
+    default=None,
+)
+parser.add_argument(
+    "--tolerance",
+    type=float,
+    help="Accepted relative drop of the rows per second and growth of the peak RSS compared to the baseline",
+    default=0.1,
+)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    arguments = sys.argv[1:]
+    dw2cds_args = []
+    if "--" in arguments:
+        dw2cds_args = arguments[arguments.index("--") + 1:]
+        arguments = arguments[:arguments.index("--")]
+    args = parser.parse_args(arguments)
+
+    sink = None
+    fhir_base_url = args.fhir_server_url
+    if fhir_base_url is None:
+        sink, fhir_base_url = start_sink()
+    work_dir = os.path.abspath(args.work_dir)
+    report = {"dw2cds_args": dw2cds_args, "scales": {}}
+    try:
+        for rows in args.scales:
+            data_folder = prepare_data(work_dir, rows, args.seed, args.config_path)
+            report["scales"][str(rows)] = run_scale(
+                work_dir,
+                data_folder,
+                rows,
+                os.path.abspath(args.config_path),
+                fhir_base_url,
+                dw2cds_args,
+            )
+    finally:
+        if sink is not None:
+            sink.shutdown()
+
+    report_path = os.path.join(work_dir, "benchmark.json")
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=2)
+    print(format_report(report))
+    print(f"Wrote the benchmark report to {report_path}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
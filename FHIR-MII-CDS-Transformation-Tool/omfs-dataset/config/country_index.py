@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import gettext
+import importlib.metadata
+import json
+import logging
+import os
+import re
+import threading
+
+import pycountry
+from unidecode import unidecode
+
+"""
+This module maps free text country values to ISO 3166-1 alpha-2 codes.
+
+The index holds the alpha-2 and alpha-3 codes, the English and German names of every
+country and the codes that are not ISO codes but occur in the data warehouse (e.g.
+international vehicle registration codes). It is built once from pycountry and persisted
+as JSON file, together with the results of the fuzzy searches for values that are not in
+the index, so that every distinct miss is searched only once.
+
+Codes are looked up as they are, names after removing accents, punctuation and case.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Version of the layout of the persisted index
+INDEX_FORMAT = 1
+
+# Codes that are not ISO 3166-1 codes, mapped as in the original processor
+SPECIAL_CASES = {
+    "D": "DE",
+    "CDN": "CA",
+    "EAK": "KE",
+    "UAE": "AE",
+    "XK": "LC",
+    "RCB": "CG",
+}
+
+# Result of values that are neither in the index nor found by the fuzzy search
+NOT_FOUND = "none"
+
+NAME_ATTRIBUTES = ("name", "official_name", "common_name")
+
+
+def default_index_path() -> str:
+    """
+    Returns the default path of the persisted index.
+
+    Returns:
+        str: The DW2CDS_COUNTRY_INDEX environment variable if set, else
+        dw2cds/country_index.json in the user cache folder.
+    """
+    if os.environ.get("DW2CDS_COUNTRY_INDEX"):
+        return os.environ["DW2CDS_COUNTRY_INDEX"]
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"),
+        ".cache",
+    )
+    return os.path.join(cache_home, "dw2cds", "country_index.json")
+
+
+def normalize_name(value: str) -> str:
+    """
+    Normalizes a country name for the lookup in the index.
+
+    Args:
+        value (str): The country name.
+
+    Returns:
+        str: The upper case name without accents and punctuation.
+    """
+    return " ".join(re.sub(r"[^A-Z0-9]+", " ", unidecode(value).upper()).split())
+
+
+class CountryIndex:
+    """
+    Maps country codes and names to ISO 3166-1 alpha-2 codes. The index can be used by
+    several threads.
+
+    Args:
+        path (str | os.PathLike | None): The JSON file the index is persisted in, the index
+            is not persisted if None.
+    """
+
+    def __init__(self, path: str | os.PathLike | None = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.codes: dict[str, str] = {}
+        self.names: dict[str, str] = {}
+        self.fuzzy: dict[str, str] = {}
+        if not self._load():
+            self._build()
+            self._save()
+
+    def lookup(self, country: str) -> str | None:
+        """
+        Returns the alpha-2 code of a country code or name.
+
+        Args:
+            country (str): The upper case country code or name.
+
+        Returns:
+            str | None: The alpha-2 code. Codes of two or three characters that are not in
+            the index are searched fuzzily, NOT_FOUND if the search finds nothing. None for
+            other values that are not in the index.
+        """
+        code = self.codes.get(country) or self.names.get(normalize_name(country))
+        if code is not None:
+            return code
+        if len(country) not in (2, 3):
+            return None
+        with self._lock:
+            code = self.fuzzy.get(country)
+        if code is None:
+            code = self._search_fuzzy(country)
+            with self._lock:
+                self.fuzzy[country] = code
+            self._save()
+        return code
+
+    def _search_fuzzy(self, country: str) -> str:
+        try:
+            return pycountry.countries.search_fuzzy(country)[0].alpha_2
+        except LookupError:
+            logger.error(f"Country not found: {country}")
+            return NOT_FOUND
+
+    def _build(self) -> None:
+        try:
+            german = gettext.translation(
+                "iso3166-1",
+                pycountry.LOCALES_DIR,
+                languages=["de"],
+            ).gettext
+        except OSError:
+            logger.warning("No German country names available")
+            german = None
+        for country in pycountry.countries:
+            for attribute in NAME_ATTRIBUTES:
+                name = getattr(country, attribute, None)
+                if not name:
+                    continue
+                self.names.setdefault(normalize_name(name), country.alpha_2)
+                if german is not None:
+                    self.names.setdefault(normalize_name(german(name)), country.alpha_2)
+        for country in pycountry.countries:
+            self.codes[country.alpha_3] = country.alpha_2
+        for country in pycountry.countries:
+            self.codes[country.alpha_2] = country.alpha_2
+        self.codes.update(SPECIAL_CASES)
+        logger.info(
+            f"Built the country index of {len(self.codes)} codes and {len(self.names)} names",
+        )
+
+    def _load(self) -> bool:
+        if self.path is None:
+            return False
+        try:
+            with open(self.path) as file:
+                index = json.load(file)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as error:
+            logger.warning(f"Ignoring unreadable country index {self.path}: {error}")
+            return False
+        if index.get("format") != INDEX_FORMAT or index.get("pycountry") != _pycountry_version():
+            return False
+        self.codes = index["codes"]
+        self.names = index["names"]
+        self.fuzzy = index["fuzzy"]
+        return True
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            index = {
+                "format": INDEX_FORMAT,
+                "pycountry": _pycountry_version(),
+                "codes": self.codes,
+                "names": self.names,
+                "fuzzy": dict(self.fuzzy),
+            }
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temporary_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "w") as file:
+                json.dump(index, file)
+            os.replace(temporary_path, self.path)
+        except OSError as error:
+            logger.warning(f"Could not persist the country index to {self.path}: {error}")
+
+
+def _pycountry_version() -> str:
+    try:
+        return importlib.metadata.version("pycountry")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+_DEFAULT_INDEX: CountryIndex | None = None
+_DEFAULT_INDEX_LOCK = threading.Lock()
+
+
+def default_index() -> CountryIndex:
+    """
+    Returns the country index of this process, persisted at default_index_path().
+    """
+    global _DEFAULT_INDEX
+    with _DEFAULT_INDEX_LOCK:
+        if _DEFAULT_INDEX is None:
+            _DEFAULT_INDEX = CountryIndex(default_index_path())
+        return _DEFAULT_INDEX
@@ -6,11 +6,47 @@ from datetime import timedelta
 from unidecode import unidecode
 
 
-import pycountry
+import numpy as np
+import pandas as pd
 from dateutil import parser
 from dateutil.parser import parse
 from loguru import logger
 
+# Imported from the folder of this module, which the processor registry adds to sys.path
+import country_index
+
+# Datetime strings that pandas parses exactly like dateutil.parser.isoparse
+ISO_DATETIME_PATTERN = r"\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?)?"
+
+
+def _as_text(values: pd.Series) -> pd.Series:
+    """Converts a column to strings, like str() does for every single value.
+
+    Args:
+        values: The column to convert.
+
+    Returns:
+        pd.Series: The converted column.
+    """
+    if values.dtype == object or pd.api.types.is_numeric_dtype(values.dtype):
+        return values.astype(str)
+    return values.map(str)
+
+
+def _reference_batch(resource_type: str, values: pd.Series) -> pd.Series:
+    """Batch implementation of the "<resource_type>/<id>" reference processors.
+
+    Args:
+        resource_type: The resource type of the reference.
+        values: The column holding the ids.
+
+    Returns:
+        pd.Series: The references, 'none' for missing ids.
+    """
+    text = _as_text(values)
+    references = resource_type + "/" + text.str.replace(".0", "", regex=False)
+    return references.where(text.str.lower() != "nan", "none")
+
 
 def process_join_text(*args) -> str:
     """Concatenates the input arguments into a single string.
@@ -24,6 +60,18 @@ def process_join_text(*args) -> str:
     return " ".join([str(arg) for arg in args])
 
 
+def batch_join_text(*columns: pd.Series) -> pd.Series:
+    """Batch implementation of process_join_text.
+
+    Args:
+        *columns: A variable number of columns.
+
+    Returns:
+        pd.Series: The concatenated strings.
+    """
+    return _as_text(columns[0]).str.cat([_as_text(column) for column in columns[1:]], sep=" ")
+
+
 def process_sanitize_text(text):
     """
     Removes all characters from the text that are not in the character class [ \r\n\t\S].
@@ -160,35 +208,11 @@ def process_country(*args) -> str:
         str: The country code.
 
     Note:
-        If the country is not found, the return value will be 'None'.
+        Codes and English or German names are looked up in the persisted country index,
+        unknown codes are searched fuzzily once. If the country is not found, the return
+        value will be 'none' for codes and None for other values.
     """
-    country = str(args[0]).upper()
-    try:
-        if country == "D" or country == "DE":
-            return "DE"
-        if country == "CDN":
-            return "CA"
-        if country == "EAK":
-            return "KE"
-        if country == "UAE":
-            return "AE"
-        if country == "XK":
-            return "LC"
-        if country == "RCB":
-            return "CG"
-        if len(country) == 3:
-            return pycountry.countries.get(alpha_3=country).alpha_2
-        if len(country) == 2:
-            return pycountry.countries.get(alpha_2=country).alpha_2
-    except AttributeError:
-        try:
-            return pycountry.countries.search_fuzzy(country)[0].alpha_2
-        except LookupError:
-            try:
-                return pycountry.countries.search_fuzzy(country)[0].alpha_3
-            except LookupError:
-                logger.error(f"Country not found: {country}")
-                return "none"
+    return country_index.default_index().lookup(str(args[0]).upper())
 
 
 def process_gender(*args) -> str:
@@ -227,6 +251,11 @@ def process_patient_reference(*args) -> str:
     return "Patient/" + str(args[0]).replace(".0", "")
 
 
+def batch_patient_reference(values: pd.Series) -> pd.Series:
+    """Batch implementation of process_patient_reference."""
+    return _reference_batch("Patient", values)
+
+
 def process_encounter_class(*args) -> dict:
     """Processes the encounter class argument and returns the corresponding FHIR class details.
 
@@ -355,6 +384,47 @@ def process_time_format(value: str) -> str:
             return "none"
 
 
+def batch_time_format(values: pd.Series) -> pd.Series:
+    """Batch implementation of process_time_format.
+
+    ISO 8601 values are parsed by pandas, all other values are passed to process_time_format
+    once per distinct value.
+
+    Args:
+        values: The column holding the time or datetime values.
+
+    Returns:
+        pd.Series: The converted datetime strings.
+
+    Raises:
+        ValueError: If the column contains an empty value.
+    """
+    text = _as_text(values).str.strip()
+    if (text == "").any():
+        raise ValueError("Empty string provided")
+
+    result = np.full(len(text), "none", dtype=object)
+    iso = text.str.fullmatch(ISO_DATETIME_PATTERN).to_numpy(dtype=bool)
+    parsed = pd.to_datetime(text[iso], format="ISO8601", errors="coerce")
+    valid = parsed.notna().to_numpy()
+    parsed = parsed[valid]
+    formatted = parsed.dt.strftime("%Y-%m-%dT%H:%M:%S")
+    microseconds = parsed.dt.microsecond
+    formatted = formatted.where(
+        microseconds == 0,
+        formatted + "." + microseconds.astype(str).str.zfill(6),
+    )
+    parsed_positions = np.flatnonzero(iso)[valid]
+    result[parsed_positions] = (formatted + "Z").to_numpy()
+
+    remaining = np.ones(len(text), dtype=bool)
+    remaining[parsed_positions] = False
+    unparsed = text[remaining]
+    converted = {value: process_time_format(value) for value in unparsed.unique()}
+    result[remaining] = unparsed.map(converted).to_numpy()
+    return pd.Series(result, index=text.index)
+
+
 def process_encounter_reference(*args) -> str:
     """Processes the encounter reference argument and returns the encounter ID.
 
@@ -371,6 +441,12 @@ def process_encounter_reference(*args) -> str:
         return "none"
     return "Encounter/" + str(args[0]).replace(".0", "")
 
+
+def batch_encounter_reference(values: pd.Series) -> pd.Series:
+    """Batch implementation of process_encounter_reference."""
+    return _reference_batch("Encounter", values)
+
+
 def process_surgery_reference(*args) -> str:
     """Processes the surgery reference argument and returns the surgery ID.
 
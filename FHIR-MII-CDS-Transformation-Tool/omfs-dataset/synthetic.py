@@ -0,0 +1,563 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import zlib
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+"""
+This module generates a synthetic version of the OMFS data warehouse export.
+
+Every table file of the table_loader of config.json is written with the columns read by
+the mappings and load strategies, plus filler columns where the export has more fields
+(e.g. the 30 fields of the diagnosis and procedure file). The files use the delimiter and
+encoding of their table configuration and contain the known bad lines:
+- lines of tables with a "line_repair" rule have an unescaped delimiter in the free text
+  field at merge_at,
+- lines of tables parsed with on_bad_lines "skip" or "warn" have a surplus field,
+- text fields of tables decoded with encoding_errors "replace" or "ignore" contain a byte
+  that cannot be decoded, if the encoding has one.
+
+The scale is the number of rows of the event tables (diagnoses, lab values, progress
+notes, ...). The case list has a quarter of these rows, lookup tables (users and
+examinations) have a fixed size. Rows reference cases, patients and users by ids that
+exist in the generated case list and user table, so the joins of the mappings match.
+
+The output only depends on the scale and the seed. Files are written in chunks, so the
+memory use does not depend on the scale.
+
+Usage:
+    python synthetic.py -o data --rows 1000000
+"""
+
+logger = logging.getLogger(__name__)
+
+TOOL_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_CONFIG = os.path.join(TOOL_ROOT, "omfs-dataset", "config", "config.json")
+
+DEFAULT_TABLE_CONFIG = os.path.join(
+    TOOL_ROOT,
+    "src",
+    "dw2cds",
+    "default",
+    "table_loading",
+    "default_table.json",
+)
+
+# Number of rows generated and written at once
+CHUNK_ROWS = 100_000
+
+# Share of the rows of a table that are bad lines
+BAD_LINE_RATE = 0.01
+
+FIRST_CASE = 100_000
+FIRST_PATIENT = 500_000
+
+# Range of the generated timestamps, 2010-01-01 to 2023-12-31
+FIRST_TIMESTAMP = np.datetime64("2010-01-01T00:00:00")
+TIMESTAMP_RANGE = int((np.datetime64("2024-01-01T00:00:00") - FIRST_TIMESTAMP).astype(np.int64))
+
+USERS = np.array(
+    [
+        f"{name}{separator}{initial}"
+        for name in ("MUELLER", "SCHMIDT", "WEIß", "Jörg", "KOCH", "BÄCKER", "Özdemir")
+        for separator in ("_", "-", "#", " ")
+        for initial in "ABC"
+    ],
+    dtype=object,
+)
+
+EXAMINATIONS = 200
+
+NATIONALITIES = [
+    "D", "DE", "Deutschland", "AUT", "A", "NL", "NLD", "B", "FRA", "F", "CH", "TR", "TUR",
+    "PL", "I", "CDN", "EAK", "UAE", "XK", "RCB", "Niederlande", "Türkei", "Deutchland",
+    "XX", "",
+]
+
+
+@dataclass
+class _Context:
+    rng: np.random.Generator
+    cases: int
+    offset: int = 0
+
+
+Column = tuple[str, Callable[[_Context, int], np.ndarray]]
+
+
+@dataclass(frozen=True)
+class SyntheticTable:
+    """
+    Schema of a generated table file.
+
+    Attributes:
+        columns (list[Column]): The name and value generator of every column.
+        rows (Callable[[int, int], int]): Returns the number of rows for the scale and the
+            number of cases.
+        text_column (str | None): The free text column bad lines and undecodable bytes are
+            placed in.
+    """
+    columns: list[Column]
+    rows: Callable[[int, int], int]
+    text_column: str | None = None
+
+
+def _ids(first: int = 1) -> Callable[[_Context, int], np.ndarray]:
+    return lambda context, n: np.arange(context.offset + first, context.offset + first + n)
+
+
+def _choice(values) -> Callable[[_Context, int], np.ndarray]:
+    values = np.array(values, dtype=object)
+    return lambda context, n: context.rng.choice(values, n)
+
+
+def _constant(value) -> Callable[[_Context, int], np.ndarray]:
+    return lambda context, n: np.full(n, value, dtype=object)
+
+
+def _integers(low: int, high: int) -> Callable[[_Context, int], np.ndarray]:
+    return lambda context, n: context.rng.integers(low, high, n)
+
+
+def _case(context: _Context, n: int) -> np.ndarray:
+    return FIRST_CASE + context.rng.integers(0, context.cases, n)
+
+
+def _case_ids(context: _Context, n: int) -> np.ndarray:
+    return FIRST_CASE + np.arange(context.offset, context.offset + n)
+
+
+def _patient_of_case(context: _Context, n: int) -> np.ndarray:
+    # Two consecutive cases belong to the same patient
+    return FIRST_PATIENT + np.arange(context.offset, context.offset + n) // 2
+
+
+def _patient(context: _Context, n: int) -> np.ndarray:
+    return FIRST_PATIENT + context.rng.integers(0, (context.cases + 1) // 2, n)
+
+
+def _timestamps(separator: str = " ", missing: float = 0.0):
+    def generate(context: _Context, n: int) -> np.ndarray:
+        seconds = context.rng.integers(0, TIMESTAMP_RANGE, n).astype("timedelta64[s]")
+        values = np.datetime_as_string(FIRST_TIMESTAMP + seconds, unit="s").astype(object)
+        if separator != "T":
+            values = np.char.replace(values.astype(str), "T", separator).astype(object)
+        if missing:
+            values[context.rng.random(n) < missing] = ""
+        return values
+
+    return generate
+
+
+def _birth_dates(context: _Context, n: int) -> np.ndarray:
+    days = context.rng.integers(1, 29, n)
+    months = context.rng.integers(1, 13, n)
+    years = context.rng.integers(1930, 2020, n)
+    return np.array(
+        [f"{day:02d}.{month:02d}.{year}" for day, month, year in zip(days, months, years)],
+        dtype=object,
+    )
+
+
+def _text(*words: str) -> Callable[[_Context, int], np.ndarray]:
+    return _choice(words)
+
+
+def _numbered_text(prefix: str) -> Callable[[_Context, int], np.ndarray]:
+    return lambda context, n: np.array(
+        [f"{prefix} {value}" for value in context.rng.integers(1, 10_000, n)],
+        dtype=object,
+    )
+
+
+def _events(share: float = 1.0) -> Callable[[int, int], int]:
+    return lambda rows, cases: max(int(rows * share), 1)
+
+
+def _fixed(count: int) -> Callable[[int, int], int]:
+    return lambda rows, cases: count
+
+
+def _cases(rows: int, cases: int) -> int:
+    return cases
+
+
+DIAGNOSIS_COLUMNS: list[Column] = [
+    ("DIA", _ids()),
+    ("PAT", _case),
+    ("CRUSER", _choice(USERS)),
+    ("CRD", _timestamps()),
+    ("DCAOFF", _choice(["ICD10-GM-2019", "ICD10-GM-2021", "OPS-2019", "OPS-2021", "ICPM"])),
+    ("DDCOFF", _choice(["C01.1", "K07.1", "S02.4", "5-231.0", "5-779.1", "9-984.7"])),
+    ("TEXT", _text("Diagnose", "Unterkieferfraktur", "Zahnextraktion", "Osteotomie")),
+    *((f"F{position:02d}", _constant("v")) for position in range(7, 27)),
+    ("BEM", _text("ohne Befund", "Kontrolle in 6 Wochen", "Befund unverändert")),
+    ("F28", _constant("v")),
+    ("F29", _constant("v")),
+]
+
+# Schema of every table file of the OMFS data warehouse export, by file name
+SCHEMAS: dict[str, SyntheticTable] = {
+    "Puladi_Fallliste.csv": SyntheticTable(
+        columns=[
+            ("PAT", _case_ids),
+            ("PER", _patient_of_case),
+            ("NAME", _text("Müller", "Schmidt", "Weiß", "Schäfer", "Özdemir", "Koch")),
+            ("PRENAME", _text("Anna", "Jörg", "Günther", "Zoë", "")),
+            ("CHR", _constant("X")),
+            ("Geschlecht", _choice(["M", "W", "U", "D"])),
+            ("Geburtsdatum", _birth_dates),
+            ("CITY", _text("Aachen", "Köln", "Düren", "Würselen")),
+            ("STREET", _numbered_text("Hauptstraße")),
+            ("ZIP", _choice(["52062", "50667", "52349", "52146"])),
+            ("NAT", _choice(NATIONALITIES)),
+            ("PFCITY", _text("Köln", "")),
+            ("STREET2", _numbered_text("Postfach")),
+            ("PFZIP", _choice(["50667", ""])),
+            ("PHONE", _choice(["0241-80-0", "0221-123456"])),
+            ("PHONE2", _choice(["0171-1234567", ""])),
+            ("TYP", _choice(["S", "SN", "SV", "A", "Q"])),
+            ("ADMD", _timestamps()),
+            ("DISD", _timestamps()),
+        ],
+        rows=_cases,
+    ),
+    "Pul_x9102usr.csv": SyntheticTable(
+        columns=[
+            ("USR", lambda context, n: USERS[context.offset:context.offset + n]),
+            ("GRP", _choice(["MKG", "ANÄ", "PFLEGE"])),
+            ("NAMEX", _text("Arzt", "Pflege")),
+        ],
+        rows=_fixed(len(USERS)),
+    ),
+    "Pul_Laborwerte_Medico.csv": SyntheticTable(
+        columns=[
+            ("Aufnahmenummer", _case),
+            ("Analytlang", _text("Natrium", "Kalium", "Hämoglobin", "Leukozyten", "CRP")),
+            ("Wert_txt", _choice(["140", "4.1", "13,2", "<0.5", "positiv", ""])),
+            ("Einheit", _choice(["mmol/l", "g/dl", "mg/l", "/nl"])),
+            ("Normbereich", _choice(["135-145", "3.5-5.1", "< 5", ""])),
+            ("Datum", _timestamps()),
+            ("PAT", _integers(1, 10)),
+        ],
+        rows=_events(),
+    ),
+    "Pul_x2701wfd_Verlaufsdoku.csv": SyntheticTable(
+        columns=[
+            ("WFD", _ids()),
+            ("PAT", _case),
+            ("PER", _patient),
+            ("CRUSER", _choice(USERS)),
+            ("CRD", _timestamps()),
+            ("WDS", _choice(["11", "12", "31", ""])),
+        ],
+        rows=_events(),
+    ),
+    "Pul_x2702wft_Verlaufsdoku.csv": SyntheticTable(
+        columns=[
+            ("WFD", _ids()),
+            ("TEXT", _numbered_text("Verlauf unauffällig, Wunde reizlos")),
+            ("CRUSER", _choice(USERS)),
+        ],
+        rows=_events(),
+        text_column="TEXT",
+    ),
+    "Pul_x2201anf_Anforderungen.csv": SyntheticTable(
+        columns=[
+            ("ANF", _ids()),
+            ("PAT", _case),
+            ("CRUSER", _choice(USERS)),
+            ("FRA", _timestamps()),
+            ("BEM", _text("Röntgen", "Konsil", "Labor")),
+        ],
+        rows=_events(0.5),
+        text_column="BEM",
+    ),
+    "Pul_x1492evt_Untersuchungen.csv": SyntheticTable(
+        columns=[
+            ("EVT", _ids()),
+            ("PAT", _case),
+            ("CRUSER", _choice(USERS)),
+            ("CAT", _choice(["PHYS-UNTERS", "MKG-UNTERS", "AN-UNTERS", "ZM-RAD", "OP_T"])),
+            ("EXA", _choice(["PT-EINZEL", "NEU", "OP_T", "NOTFALL", "GESPRÄCH"])),
+            ("DES", _text("Untersuchung", "Gespräch mit Angehörigen", "Röntgen")),
+            ("DATF", _timestamps(separator="T")),
+            ("DURATION", _choice(["0.5", "30", "12.5", "45"])),
+        ],
+        rows=_events(0.5),
+        text_column="DES",
+    ),
+    "Pul_x5201unt.csv": SyntheticTable(
+        columns=[
+            ("UNT", _ids()),
+            ("DES", _numbered_text("Untersuchung")),
+        ],
+        rows=_fixed(EXAMINATIONS),
+        text_column="DES",
+    ),
+    "Pul_x2202usu_Untersuchungen.csv": SyntheticTable(
+        columns=[
+            ("USU", _ids()),
+            ("UNT", _integers(1, EXAMINATIONS + 1)),
+            ("PAT", _case),
+            ("CRUSER", _choice(USERS)),
+            # Rows without start are read by USUTableDate, the others by USUTableWindow
+            ("STAD", _timestamps(missing=0.3)),
+            ("STOD", _timestamps()),
+            ("UNTD", _timestamps()),
+            ("BEM", _text("ohne Befund", "Kontrolle")),
+        ],
+        rows=_events(),
+        text_column="BEM",
+    ),
+    "Pul_OP_Operationen.csv": SyntheticTable(
+        columns=[
+            ("OP_Nr", _ids()),
+            ("Aufnahmenummer", _case),
+            ("Leistung_Nr", _choice(["5-231.0", "5-779.1", "5-770.0", "5-216.0"])),
+            ("OP_Text", _text("Osteosynthese", "Zahnentfernung", "Reposition")),
+            ("Beginn", _timestamps()),
+            ("Ende", _timestamps()),
+        ],
+        rows=_events(0.25),
+    ),
+    "Pul_OP_Zeitintervalle.csv": SyntheticTable(
+        columns=[
+            ("OP_Nr", _ids()),
+            ("Aufnahmenummer", _case),
+            ("Beginn", _timestamps()),
+            ("Ende", _timestamps()),
+        ],
+        rows=_events(0.25),
+    ),
+    "Pul_x1280dia_Diag_Pro.csv": SyntheticTable(
+        columns=DIAGNOSIS_COLUMNS,
+        rows=_events(),
+        text_column="BEM",
+    ),
+    "Pul_x1350dre_Befunde.csv": SyntheticTable(
+        columns=[
+            ("DRE", _ids()),
+            ("PAT", _case),
+            ("PER", _patient),
+            ("CRUSER", _choice(USERS)),
+            ("CRD", _timestamps()),
+            ("DOCTYP", _choice(["OPBERICHT", "ARZTBRIEF", "LABORBERICHT", "VERLEGEBRIEF", "X"])),
+            ("WDS", _choice(["11", "12"])),
+        ],
+        rows=_events(0.5),
+    ),
+    "Pul_SWL_Konservern.csv": SyntheticTable(
+        columns=[
+            ("Patientennummer", _patient),
+            ("Station_Ausgabe", _choice(["ST1", "ST2", "OP"])),
+            ("VERBRDAT", _timestamps()),
+        ],
+        rows=_events(0.05),
+    ),
+    "Pul_x1121dur_Beatmung.csv": SyntheticTable(
+        columns=[
+            ("PAT", _case),
+            ("WDS", _choice(["12", "31"])),
+            ("DATF", _timestamps()),
+            ("DATT", _timestamps()),
+        ],
+        rows=_events(0.05),
+    ),
+    "Pul_x1264lea.csv": SyntheticTable(
+        columns=[
+            ("LEA", _ids()),
+            ("PAT", _case),
+            ("CRUSER", _choice(USERS)),
+            ("CRD", _timestamps()),
+            ("LCD", _choice(["OPE", "AOP", "5-010.0", "PFL", "AWR", "ZZZ"])),
+            ("LKLT", _text("Anästhesie zur OP", "Intraoperative Maßnahmen", "ZVK Neuanlage")),
+        ],
+        rows=_events(),
+        text_column="LKLT",
+    ),
+    "Pul_x8801exa.csv": SyntheticTable(
+        columns=[
+            ("EXA", _choice(["PT-EINZEL", "NEU", "OP_T", "NOTFALL"])),
+            ("DES", _text("Einzeltherapie", "Neuaufnahme", "Notfall")),
+        ],
+        rows=_fixed(EXAMINATIONS),
+    ),
+}
+
+
+def table_files(config_path: str | os.PathLike = DEFAULT_CONFIG) -> dict[str, dict]:
+    """
+    Returns the table files of a configuration.
+
+    Args:
+        config_path (str | os.PathLike): The path of config.json.
+
+    Returns:
+        dict[str, dict]: The table configuration, completed by the default table
+        configuration, of every file name. Tables reading the same file share an entry.
+    """
+    with open(config_path) as file:
+        tables = json.load(file)["table_loader"]
+    with open(DEFAULT_TABLE_CONFIG) as file:
+        default = json.load(file)
+    files = {}
+    for table in tables.values():
+        files.setdefault(table["file_name"], {**default, **table})
+    return files
+
+
+def generate(
+    output_folder: str | os.PathLike,
+    rows: int,
+    seed: int = 0,
+    config_path: str | os.PathLike = DEFAULT_CONFIG,
+    bad_line_rate: float = BAD_LINE_RATE,
+) -> dict[str, int]:
+    """
+    Writes the synthetic table files of a configuration.
+
+    Args:
+        output_folder (str | os.PathLike): The folder the files are written to.
+        rows (int): The number of rows of the event tables.
+        seed (int): The seed of the generated values.
+        config_path (str | os.PathLike): The path of config.json.
+        bad_line_rate (float): The share of bad lines of the tables with bad lines.
+
+    Returns:
+        dict[str, int]: The number of written rows per file name.
+
+    Raises:
+        ValueError: If the configuration reads a file without synthetic schema.
+    """
+    files = table_files(config_path)
+    unknown = sorted(set(files) - set(SCHEMAS))
+    if unknown:
+        raise ValueError(f"No synthetic schema of the table files {unknown}")
+    os.makedirs(output_folder, exist_ok=True)
+    cases = max(rows // 4, 1)
+    written = {}
+    for file_name, table_config in files.items():
+        table_rows = SCHEMAS[file_name].rows(rows, cases)
+        # Every file has its own random stream, so it does not depend on the other files
+        rng = np.random.default_rng([seed, zlib.crc32(file_name.encode())])
+        _write_table(
+            os.path.join(output_folder, file_name),
+            SCHEMAS[file_name],
+            table_config,
+            _Context(rng=rng, cases=cases),
+            table_rows,
+            bad_line_rate,
+        )
+        written[file_name] = table_rows
+        logger.info(f"Wrote {table_rows} rows to {file_name}")
+    return written
+
+
+def _write_table(
+    path: str,
+    table: SyntheticTable,
+    table_config: dict,
+    context: _Context,
+    rows: int,
+    bad_line_rate: float,
+) -> None:
+    csv_options = table_config["csv"]
+    delimiter = csv_options.get("delimiter", ",")
+    encoding = csv_options.get("encoding") or "utf-8"
+    names = [name for name, _ in table.columns]
+
+    # The free text field of a bad line contains the delimiter
+    bad_column = None
+    if "line_repair" in table_config:
+        bad_column = table_config["line_repair"]["merge_at"]
+    elif csv_options.get("on_bad_lines") in ("skip", "warn") and table.text_column:
+        bad_column = names.index(table.text_column)
+    undecodable = None
+    if csv_options.get("encoding_errors") in ("replace", "ignore") and table.text_column:
+        undecodable = _undecodable_byte(encoding)
+        undecodable_column = names.index(table.text_column)
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write((delimiter.join(names) + "\n").encode(encoding))
+        for offset in range(0, rows, CHUNK_ROWS):
+            n = min(CHUNK_ROWS, rows - offset)
+            context.offset = offset
+            columns = [
+                ["" if value is None else str(value) for value in generator(context, n)]
+                for _, generator in table.columns
+            ]
+            lines = [list(fields) for fields in zip(*columns)]
+            if bad_column is not None:
+                for index in np.flatnonzero(context.rng.random(n) < bad_line_rate):
+                    lines[index][bad_column] += delimiter + "siehe Nachtrag"
+            if undecodable is not None:
+                for index in np.flatnonzero(context.rng.random(n) < bad_line_rate):
+                    lines[index][undecodable_column] += undecodable
+            text = "".join(delimiter.join(fields) + "\n" for fields in lines)
+            # Undecodable bytes are surrogates, which surrogateescape writes as raw bytes
+            file.write(text.encode(encoding, errors="surrogateescape"))
+    os.replace(temporary_path, path)
+
+
+def _undecodable_byte(encoding: str) -> str | None:
+    for byte in range(0x80, 0x100):
+        try:
+            bytes([byte]).decode(encoding)
+        except UnicodeDecodeError:
+            return bytes([byte]).decode(encoding, errors="surrogateescape")
+    return None
+
+
+parser = argparse.ArgumentParser(description="Synthetic OMFS data warehouse export")
+parser.add_argument(
+    "-o",
+    "--output_folder",
+    type=str,
+    help="Folder the synthetic table files are written to",
+    default=os.path.join(TOOL_ROOT, "omfs-dataset", "data"),
+)
+parser.add_argument(
+    "--rows",
+    type=int,
+    help="Number of rows of the event tables, the case list has a quarter of them",
+    default=10_000,
+)
+parser.add_argument(
+    "--seed",
+    type=int,
+    help="Seed of the generated values, the same seed and scale produce the same files",
+    default=0,
+)
+parser.add_argument(
+    "-c",
+    "--config_path",
+    type=str,
+    help="Path to the FHIR config file whose table files are generated",
+    default=DEFAULT_CONFIG,
+)
+parser.add_argument(
+    "--bad_line_rate",
+    type=float,
+    help="Share of bad lines and undecodable bytes in the tables that have them",
+    default=BAD_LINE_RATE,
+)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parser.parse_args()
+    generate(
+        args.output_folder,
+        rows=args.rows,
+        seed=args.seed,
+        config_path=args.config_path,
+        bad_line_rate=args.bad_line_rate,
+    )
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+
+"""
+This module records the progress of a run, so that an interrupted run can be resumed.
+
+A checkpoint is committed when a mapping is done and, in streaming mode, periodically
+after a chunk. At a checkpoint, the NDJSON files are flushed and the queued uploads are
+acknowledged by the FHIR server, so everything transformed before the checkpoint is
+both written and uploaded. The checkpoint records, per mapping, the number of committed
+chunks and whether it is done, the upload counts, and the size of every NDJSON file.
+
+A resumed run truncates the NDJSON files to their recorded size, skips the done mappings
+and the committed chunks of the interrupted mapping. Resources transformed after the last
+checkpoint are transformed again, which is idempotent for resources with id (PUT) only.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class RunCheckpoint:
+    """
+    Progress of a run, persisted in a JSON file.
+
+    Args:
+        path (str | os.PathLike): The JSON file of the checkpoint.
+        config_fingerprint (str): The fingerprint of the configuration of the run. A
+            checkpoint of another configuration cannot be resumed.
+        ndjson_files (list[str]): The NDJSON files written by the run.
+    """
+
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        config_fingerprint: str,
+        ndjson_files: list[str],
+    ):
+        self.path = path
+        self.config_fingerprint = config_fingerprint
+        self.ndjson_files = ndjson_files
+        self.mappings: dict[str, dict] = {}
+
+    def resume(self) -> bool:
+        """
+        Loads the checkpoint of an interrupted run and truncates the NDJSON files to the
+        size recorded by it.
+
+        Returns:
+            bool: Whether the run is resumed. False if there is no checkpoint, the run was
+            completed or the configuration changed, the run then starts from the beginning.
+        """
+        try:
+            with open(self.path) as file:
+                checkpoint = json.load(file)
+        except FileNotFoundError:
+            logger.info("No checkpoint found, starting from the beginning.")
+            return False
+        except (OSError, ValueError) as error:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}: {error}")
+            return False
+        if checkpoint.get("complete"):
+            logger.info("The checkpointed run was completed, starting from the beginning.")
+            return False
+        if checkpoint.get("config") != self.config_fingerprint:
+            logger.warning(
+                "The configuration changed since the checkpoint, starting from the beginning.",
+            )
+            return False
+
+        for path, size in checkpoint.get("ndjson", {}).items():
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                logger.info(f"Truncating {path} to {size} bytes")
+                with open(path, "r+b") as file:
+                    file.truncate(size)
+        self.mappings = checkpoint.get("mappings", {})
+        done = sum(progress.get("done", False) for progress in self.mappings.values())
+        logger.info(f"Resuming the run after {done} completed mappings.")
+        return True
+
+    def is_done(self, key: str) -> bool:
+        """
+        Returns whether a mapping was completed before the checkpoint.
+        """
+        return self.mappings.get(key, {}).get("done", False)
+
+    def committed_chunks(self, key: str) -> int:
+        """
+        Returns the number of chunks of a mapping that were committed before the checkpoint.
+        """
+        return self.mappings.get(key, {}).get("chunks", 0)
+
+    def commit(
+        self,
+        key: str,
+        chunks: int = 0,
+        done: bool = False,
+        succeeded: int = 0,
+        failed: int = 0,
+    ) -> None:
+        """
+        Records the progress of a mapping. The NDJSON files have to be flushed and the
+        uploads acknowledged before.
+
+        Args:
+            key (str): The key of the mapping.
+            chunks (int): The number of committed chunks.
+            done (bool): Whether the mapping is done.
+            succeeded (int): The number of uploaded resources of the run.
+            failed (int): The number of resources of the run that failed to upload.
+        """
+        self.mappings[key] = {
+            "chunks": chunks,
+            "done": done,
+            "succeeded": succeeded,
+            "failed": failed,
+        }
+        self._write(complete=False)
+
+    def finish(self) -> None:
+        """
+        Records that the run is complete, so that it is not resumed.
+        """
+        self._write(complete=True)
+
+    def _write(self, complete: bool) -> None:
+        checkpoint = {
+            "config": self.config_fingerprint,
+            "complete": complete,
+            "mappings": self.mappings,
+            "ndjson": {
+                path: os.path.getsize(path) if os.path.exists(path) else 0
+                for path in self.ndjson_files
+            },
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(checkpoint, file, indent=2)
+        os.replace(temporary_path, self.path)
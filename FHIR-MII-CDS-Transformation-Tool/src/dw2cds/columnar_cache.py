@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import glob
+import logging
+import os
+import pathlib
+from typing import Callable, Iterable
+
+import numpy as np
+import pandas as pd
+from utils.fingerprint import file_fingerprint, object_fingerprint
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pa = None
+
+"""
+This module provides an on-disk cache of loaded tables in the Arrow IPC format.
+
+A cached table is the result of Loader.load, i.e. the parsed source file after the
+filtering of its load strategy and the data quality checks. The cache key combines the
+fingerprint of the source file, the table configuration and the load strategy class, so
+a changed export, configuration or strategy results in a new cache file. Cache files
+are memory-mapped when they are read.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Changes of the cache file layout invalidate all existing cache files
+CACHE_FORMAT_VERSION = 1
+
+CACHE_FILE_EXTENSION = ".arrow"
+
+
+class ColumnarTableCache:
+    """
+    Caches loaded tables as Arrow IPC files.
+
+    Args:
+        cache_dir (str | os.PathLike): The folder of the cache files.
+        content_hash (bool): Whether source files are identified by a hash of their content
+            instead of their size and modification time.
+    """
+
+    def __init__(self, cache_dir: str | os.PathLike, content_hash: bool = False):
+        self.cache_dir = cache_dir
+        self.content_hash = content_hash
+        self.hits = 0
+        self.misses = 0
+        if pa is None:
+            logger.warning("pyarrow is not installed, the table cache is disabled.")
+        else:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return pa is not None
+
+    def load(
+        self,
+        data_path: str | os.PathLike,
+        configuration: dict,
+        strategy_class: type,
+        load: Callable[[], pd.DataFrame],
+        columns: Iterable[str] | None = None,
+    ) -> pd.DataFrame:
+        """
+        Returns the cached table or loads and caches it.
+
+        Args:
+            data_path (str | os.PathLike): The path of the source file.
+            configuration (dict): The table configuration.
+            strategy_class (type): The load strategy class.
+            load (Callable[[], pd.DataFrame]): Loads the table if it is not cached.
+            columns (Iterable[str] | None): The selected columns of the table, None if all
+                columns are loaded.
+
+        Returns:
+            pd.DataFrame: The loaded table.
+        """
+        if not self.enabled or not os.path.exists(data_path):
+            return load()
+
+        prefix = f"{pathlib.Path(data_path).stem}-{strategy_class.__name__}"
+        key = object_fingerprint(
+            {
+                "version": CACHE_FORMAT_VERSION,
+                "source": file_fingerprint(data_path, content_hash=self.content_hash),
+                "configuration": configuration,
+                "strategy": f"{strategy_class.__module__}.{strategy_class.__qualname__}",
+                "columns": sorted(columns) if columns is not None else None,
+            },
+        )
+        path = os.path.join(self.cache_dir, f"{prefix}-{key[:16]}{CACHE_FILE_EXTENSION}")
+
+        if os.path.exists(path):
+            try:
+                df = self._read(path)
+                self.hits += 1
+                logger.info(f"Loaded {data_path} from cache file {path}")
+                return df
+            except (OSError, pa.ArrowException) as error:
+                logger.warning(f"Ignoring unreadable cache file {path}: {error}")
+
+        self.misses += 1
+        df = load()
+        self._write(path, prefix, df)
+        return df
+
+    def _read(self, path: str) -> pd.DataFrame:
+        with pa.memory_map(path, "r") as source:
+            table = ipc.open_file(source).read_all()
+        df = table.to_pandas()
+        # Missing values of parsed text columns are NaN, Arrow returns them as None
+        for column in df.columns[df.dtypes == object]:
+            values = df[column]
+            if values.isna().any():
+                df[column] = values.where(values.notna(), np.nan)
+        return df
+
+    def _write(self, path: str, prefix: str, df: pd.DataFrame) -> None:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as error:
+            logger.info(f"Table of {prefix} can not be cached: {error}")
+            return
+
+        # Cache files of older versions of the same source file and strategy are stale
+        for stale_path in glob.glob(
+            os.path.join(glob.escape(self.cache_dir), f"{glob.escape(prefix)}-*{CACHE_FILE_EXTENSION}"),
+        ):
+            os.remove(stale_path)
+
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with pa.OSFile(temporary_path, "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temporary_path, path)
+        logger.debug(f"Cached table in {path}")
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import logging
+
+import pandas as pd
+
+"""
+This module converts the columns of loaded tables to compact types.
+
+The types of a table are its dtype profile, which is declared in the table configuration
+or inferred from the loaded table:
+
+    "dtype_profile": "infer"                                 (default)
+    "dtype_profile": "none"                                  (keep the parsed types)
+    "dtype_profile": {"Geschlecht": "category", "ADMD": "datetime", "PER": "Int64"}
+
+The inferred profile only contains conversions that keep the values of the table: text
+columns with few distinct values become categorical, integer columns get the smallest
+integer type. Declared profiles may use every pandas dtype and "datetime", which parses
+the column with pandas.to_datetime. Missing values stay NaN (or NaT / <NA> for declared
+types), they are never replaced by a placeholder string. The columns of a cached table
+keep their types, so a profile is only inferred when the table is actually loaded.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Text columns with at most this share of distinct values are stored as categorical
+CATEGORY_MAX_RATIO = 0.5
+
+# Tables with fewer rows are not worth converting
+MIN_ROWS = 100
+
+PROFILE_INFER = "infer"
+PROFILE_NONE = "none"
+
+
+def infer_dtype_profile(df: pd.DataFrame) -> dict[str, str]:
+    """
+    Infers the compact types of the columns of a table.
+
+    Args:
+        df (pd.DataFrame): The loaded table.
+
+    Returns:
+        dict[str, str]: The type of every column that can be stored more compactly.
+    """
+    profile = {}
+    if len(df) < MIN_ROWS:
+        return profile
+    for column, dtype in df.dtypes.items():
+        values = df[column]
+        if dtype == object:
+            if values.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(df):
+                profile[column] = "category"
+        elif pd.api.types.is_integer_dtype(dtype) and not isinstance(
+            dtype,
+            pd.api.extensions.ExtensionDtype,
+        ):
+            compact = pd.to_numeric(values, downcast="integer").dtype
+            if compact != dtype:
+                profile[column] = compact.name
+    return profile
+
+
+def apply_dtype_profile(df: pd.DataFrame, profile: dict | str | None) -> pd.DataFrame:
+    """
+    Converts the columns of a table to the types of a dtype profile.
+
+    Args:
+        df (pd.DataFrame): The loaded table, which is not modified.
+        profile (dict | str | None): The declared profile, "infer" to infer the profile
+            or "none" (or None) to keep the types.
+
+    Returns:
+        pd.DataFrame: The converted table, or the table itself if no column is converted.
+
+    Raises:
+        ValueError: If the profile is invalid.
+    """
+    if profile is None or profile == PROFILE_NONE:
+        return df
+    if profile == PROFILE_INFER:
+        profile = infer_dtype_profile(df)
+    elif not isinstance(profile, dict):
+        raise ValueError(f"Invalid dtype profile: {profile}")
+
+    conversions = {
+        column: dtype for column, dtype in profile.items()
+        if column in df.columns and str(df[column].dtype) != dtype
+    }
+    if not conversions:
+        return df
+
+    df = df.copy(deep=False)
+    for column, dtype in conversions.items():
+        if dtype == "datetime":
+            df[column] = pd.to_datetime(df[column], errors="coerce")
+        else:
+            df[column] = df[column].astype(dtype)
+    logger.debug(f"Converted columns {conversions}")
+    return df
@@ -2,13 +2,31 @@ import argparse
 import logging
 import os
 import pathlib
+import shutil
+import time
+from dataclasses import dataclass
 from typing import Union
 
+import checkpoint
+import columnar_cache
+import encoding_detection
 import fhir_config_loader
+import join_planner
 import loader
+import mapping_scheduler
 import pandas as pd
+import parallel_transform
+import processor_registry
+import profiling
+import state_store
+import table_cache
 import transformer
-from tqdm import tqdm
+import validation
+from fhir_api.async_uploader import AsyncUploadPipeline
+from fhir_api.bundle_uploader import BundleUploader
+from fhir_api.fhir_client import delete_resource, ndjson_path
+from fhir_api.ndjson_writer import FSYNC_POLICIES, NDJSONWriterPool
+from utils.fingerprint import object_fingerprint
 
 
 logger = logging.getLogger(__name__)
@@ -16,6 +34,36 @@ logging.basicConfig(level=logging.INFO)
 logging.basicConfig(filename='run.log', encoding='utf-8', level=logging.INFO)
 
 
+@dataclass
+class MappingRun:
+    """
+    State of a resource mapping while it is transformed.
+
+    Attributes:
+        index (int): The position of the mapping in the configuration.
+        mapping (dict): The resource mapping.
+        key (str): The key of the mapping in the checkpoint.
+        transformer (transformer.FHIRTransformer): The transformer of the mapping.
+        mapping_state (state_store.MappingState | None): The row state of an incremental run.
+        failed_uploads (int): The number of failed uploads of the run before the mapping.
+        resumed_chunks (int): The number of chunks committed before the checkpoint.
+        rows (int): The number of transformed rows.
+        ndjson_file (str | None): The NDJSON file of a concurrently transformed mapping,
+            which is merged into the NDJSON file of the resource type when it is done.
+        writer (NDJSONWriterPool | None): The writer of the NDJSON file of the mapping.
+    """
+    index: int
+    mapping: dict
+    key: str
+    transformer: transformer.FHIRTransformer
+    mapping_state: Union[state_store.MappingState, None] = None
+    failed_uploads: int = 0
+    resumed_chunks: int = 0
+    rows: int = 0
+    ndjson_file: Union[str, None] = None
+    writer: Union[NDJSONWriterPool, None] = None
+
+
 class dw2cds:
     def __init__(
         self,
@@ -23,53 +71,388 @@ class dw2cds:
         config_path: Union[os.PathLike, str],
         output_data_folder_path: Union[os.PathLike, str],
         processor_paths: list[Union[str, os.PathLike]],
-        fhir_base_url: str
+        fhir_base_url: str,
+        bundle_size: int = 0,
+        bundle_type: str = "transaction",
+        bundle_flush_interval: float = 30.0,
+        upload_workers: int = 0,
+        upload_queue_size: int = 1000,
+        workers: int = 1,
+        ndjson_fsync: str = "never",
+        table_cache_dir: Union[os.PathLike, str, None] = None,
+        table_cache_content_hash: bool = False,
+        chunk_size: int = 0,
+        read_all_columns: bool = False,
+        validation_mode: str = "full",
+        validation_sample_rate: float = 100,
+        incremental: bool = False,
+        emit_deletes: bool = False,
+        state_store_path: Union[os.PathLike, str, None] = None,
+        resume: bool = False,
+        checkpoint_path: Union[os.PathLike, str, None] = None,
+        checkpoint_interval: float = 300.0,
+        mapping_workers: int = 0,
+        memory_budget: int = 0,
+        profile_report_path: Union[os.PathLike, str, None] = None,
+        profile_prometheus_path: Union[os.PathLike, str, None] = None,
+        processor_cache_size: int = processor_registry.DEFAULT_CACHE_SIZE,
     ):
+        # Stage and processor latencies are only measured if a report is written
+        profiling.PROFILER.enabled = bool(profile_report_path or profile_prometheus_path)
         self.fhir_config_loader = fhir_config_loader.FHIRConfigLoader(
             config_path=config_path,
         )
         self.data_folder_path = data_folder_path
         self.output_data_folder_path = output_data_folder_path
         self.processor_paths = processor_paths
-        self.tables = {}
+        # Processors are discovered once and shared by the transformers of all mappings
+        pure_processors = tuple(self.fhir_config_loader.load_pure_processors())
+        self.processor_registry = processor_registry.shared_registry(
+            processor_paths,
+            pure_processors=pure_processors,
+            cache_size=processor_cache_size,
+        )
+        # Number of duplicate rows dropped per loaded table
+        self.duplicate_rows = {}
         self.fhir_base_url = fhir_base_url
+        self.chunk_size = chunk_size
+        self.validation = validation.ValidationSettings(
+            mode=validation_mode,
+            sample_rate=validation_sample_rate,
+        )
+        # Validated resources of the sample mode that differ from their assembled form
+        self.validation_mismatches = 0
+        self.emit_deletes = emit_deletes
+        # Rows transformed by previous incremental runs, only new and changed rows are transformed
+        self.state_store = None
+        if incremental:
+            self.state_store = state_store.StateStore(
+                state_store_path
+                or os.path.join(output_data_folder_path, "dw2cds_state.sqlite"),
+            )
+
+        self.writer = NDJSONWriterPool(fsync=ndjson_fsync)
+        if workers > 1 and mapping_workers > 1:
+            raise ValueError("Worker processes cannot be combined with concurrent mappings")
+        # The worker processes are forked before the uploaders of the main process start
+        # their threads. The main process uploads the resources of small tables.
+        self.parallel = None
+        if workers > 1:
+            self.parallel = parallel_transform.ParallelTransformer(
+                workers=workers,
+                processor_paths=processor_paths,
+                output_data_folder_path=output_data_folder_path,
+                upload_settings=parallel_transform.UploadSettings(
+                    fhir_base_url=fhir_base_url,
+                    bundle_size=bundle_size,
+                    bundle_type=bundle_type,
+                    bundle_flush_interval=bundle_flush_interval,
+                    upload_workers=upload_workers,
+                    upload_queue_size=upload_queue_size,
+                ),
+                writer=self.writer,
+                validation=self.validation,
+                pure_processors=pure_processors,
+                processor_cache_size=processor_cache_size,
+            )
+
+        self.uploader = None
+        self.pipeline = None
+        if upload_workers > 0:
+            self.pipeline = AsyncUploadPipeline(
+                base_url=fhir_base_url,
+                workers=upload_workers,
+                queue_size=upload_queue_size,
+                bundle_size=max(1, bundle_size),
+                bundle_type=bundle_type,
+            )
+        elif bundle_size > 0:
+            self.uploader = BundleUploader(
+                base_url=fhir_base_url,
+                bundle_type=bundle_type,
+                bundle_size=bundle_size,
+                flush_interval=bundle_flush_interval,
+            )
+
+        # Detected encodings are persisted with the table cache, otherwise kept for this run
+        self.encoding_cache = encoding_detection.EncodingCache(
+            os.path.join(table_cache_dir, "encodings.json") if table_cache_dir else None,
+        )
+        self.columnar_cache = None
+        if table_cache_dir:
+            self.columnar_cache = columnar_cache.ColumnarTableCache(
+                cache_dir=table_cache_dir,
+                content_hash=table_cache_content_hash,
+            )
 
         self.mappings = self.fhir_config_loader.load_mappings()
 
-        for mapping in self.mappings:
-            self.transformer = transformer.FHIRTransformer(
-                field_mappings=mapping,
-                processor_paths=processor_paths,
-                output_data_folder_path=self.output_data_folder_path
+        # Progress of the run, committed after every mapping and periodically after chunks
+        self.checkpoint = checkpoint.RunCheckpoint(
+            checkpoint_path
+            or os.path.join(output_data_folder_path, "dw2cds_checkpoint.json"),
+            config_fingerprint=object_fingerprint(
+                {"config": self.fhir_config_loader.config, "chunk_size": chunk_size},
+            ),
+            ndjson_files=list(dict.fromkeys(
+                ndjson_path(mapping.get("resourceType")) for mapping in self.mappings
+            )),
+        )
+        self.checkpoint_interval = checkpoint_interval
+        # Chunk checkpoints need the mapping to write to the NDJSON file of the resource type
+        self.chunk_checkpoints = mapping_workers <= 1
+        if resume:
+            self.checkpoint.resume()
+        table_sources = {
+            table_name: self._table_path(table_config)
+            for table_name, table_config in self.fhir_config_loader.config.get(
+                "table_loader",
+                {},
+            ).items()
+            if table_config.get("file_name")
+        }
+        self.table_cache = table_cache.TableCache(
+            mappings=self.mappings,
+            load_table=self._load_table,
+            table_sources=table_sources,
+        )
+
+        # Only the columns referenced by the mappings are parsed. Tables of the same source
+        # file parse the same columns, so the parsed file can be shared.
+        self.table_columns = None
+        if not read_all_columns:
+            required_columns = self.fhir_config_loader.load_required_columns()
+            source_columns = {}
+            for table_name, columns in required_columns.items():
+                source_columns.setdefault(table_sources.get(table_name), set()).update(columns)
+            self.table_columns = {
+                table_name: source_columns[table_sources.get(table_name)]
+                for table_name in required_columns
+            }
+
+        indices = []
+        for index in range(len(self.mappings)):
+            if self.checkpoint.is_done(self._mapping_key(index)):
+                logger.info(
+                    f"Skipping {self._mapping_key(index)}, completed before the checkpoint",
+                )
+            else:
+                indices.append(index)
+
+        if mapping_workers > 1:
+            # Independent mappings are transformed concurrently, ordered for table reuse
+            scheduler = mapping_scheduler.MappingScheduler(
+                self.mappings,
+                table_sizes={
+                    table_name: os.path.getsize(path) if os.path.exists(path) else 0
+                    for table_name, path in table_sources.items()
+                },
+                memory_budget=memory_budget,
+            )
+            logger.debug(f"Tables shared by mappings: {scheduler.shared_tables()}")
+            indices = scheduler.order(indices)
+            logger.info(f"Scheduled mapping order: {indices}")
+            scheduler.run(
+                indices,
+                transform=lambda index: self._run_mapping(index, concurrent=True),
+                finish=lambda index, run: self._finish_mapping(run),
+                workers=mapping_workers,
+                loaded_tables=self.table_cache.loaded_sizes,
+            )
+        else:
+            for index in indices:
+                self._finish_mapping(self._run_mapping(index))
+
+        if self.state_store is not None:
+            self.state_store.close()
+
+        self.table_cache.clear()
+        self.writer.close()
+        for name, statistics in self.processor_registry.cache_statistics().items():
+            logger.info(f"Cache of processor {name}: {statistics}")
+        duplicates = {name: rows for name, rows in self.duplicate_rows.items() if rows}
+        if duplicates:
+            logger.info(f"Dropped duplicate rows per table: {duplicates}")
+        if self.uploader is not None:
+            self.uploader.close()
+        if self.pipeline is not None:
+            self.pipeline.close()
+            logger.info(
+                f"Uploaded {self.pipeline.succeeded} resources, {self.pipeline.failed} failed."
+            )
+        if self.parallel is not None:
+            self.parallel.close()
+            logger.info(
+                f"Uploaded {self.parallel.succeeded} resources from worker processes, "
+                f"{self.parallel.failed} failed."
+            )
+        self.checkpoint.finish()
+        if profile_report_path:
+            profiling.PROFILER.write_json(profile_report_path)
+        if profile_prometheus_path:
+            profiling.PROFILER.write_prometheus(profile_prometheus_path)
+        if self.parallel is not None:
+            self.validation_mismatches += self.parallel.mismatches
+        if self.validation_mismatches:
+            raise ValueError(
+                f"{self.validation_mismatches} assembled resources differ from their "
+                "validated form, see the warnings of the run. Use full validation to emit "
+                "the validated resources.",
             )
-            logger.info(f"Transforming {mapping.get('resourceType')}")
+
+    def _mapping_key(self, index: int) -> str:
+        return f"{index}:{state_store.mapping_key(self.mappings[index])}"
+
+    def _run_mapping(self, index: int, concurrent: bool = False) -> MappingRun:
+        mapping = self.mappings[index]
+        key = self._mapping_key(index)
+        ndjson_file = writer = None
+        if concurrent:
+            # Written to a separate file, so the NDJSON file of the resource type only
+            # contains complete mappings
+            base, extension = os.path.splitext(ndjson_path(mapping.get("resourceType")))
+            ndjson_file = f"{base}.mapping-{index:03d}{extension}"
+            if os.path.exists(ndjson_file):
+                os.remove(ndjson_file)
+            writer = NDJSONWriterPool()
+        run = MappingRun(
+            index=index,
+            mapping=mapping,
+            key=key,
+            transformer=transformer.FHIRTransformer(
+                field_mappings=mapping,
+                processor_paths=self.processor_paths,
+                processor_registry=self.processor_registry,
+                output_data_folder_path=self.output_data_folder_path,
+                uploader=self.uploader,
+                pipeline=self.pipeline,
+                ndjson_file=ndjson_file,
+                writer=writer or self.writer,
+                validation=self.validation,
+            ),
+            resumed_chunks=self.checkpoint.committed_chunks(key),
+            ndjson_file=ndjson_file,
+            writer=writer,
+        )
+        logger.info(f"Transforming {mapping.get('resourceType')}")
+        if self.state_store is not None:
+            run.mapping_state = self.state_store.begin_mapping(mapping)
+            run.failed_uploads = self._failed_uploads()
+        start = time.perf_counter()
+        with profiling.PROFILER.memory_window() as memory:
             self.transform(
-                resource_type=mapping.get("resourceType"),
+                run,
                 used_tables=mapping.get("usedTables"),
                 join_on=mapping.get("join_on", []),
             )
+        if profiling.PROFILER.enabled:
+            profiling.PROFILER.record_mapping(
+                key,
+                run.rows,
+                time.perf_counter() - start,
+                peak_rss=memory.peak,
+            )
+        return run
 
-    def _load_tables(self, tables_to_load: list[str]):
-        loaded_tables = {}
-        for table_name in tables_to_load:
-            custom_table_config = self.fhir_config_loader.config.get(
-                "table_loader",
-            ).get(table_name)
-            if custom_table_config:
-                loaded_tables[table_name] = loader.Loader(
-                    data_path=os.path.join(
-                        self.data_folder_path,
-                        custom_table_config.get("file_name"),
-                    ),
-                    configuration=custom_table_config,
-                ).load()
-            else:
-                logger.warning(f"No configuration found for table {table_name}.")
-        return loaded_tables
+    def _finish_mapping(self, run: MappingRun):
+        self.validation_mismatches += run.transformer.sampler.mismatches
+        if run.writer is not None:
+            run.writer.close()
+            target = ndjson_path(run.mapping.get("resourceType"))
+            if os.path.exists(run.ndjson_file):
+                with open(run.ndjson_file, "rb") as part:
+                    shutil.copyfileobj(part, self.writer.handle(target))
+                os.remove(run.ndjson_file)
+        self.writer.flush()
+        if self.uploader is not None:
+            self.uploader.flush()
+            logger.info(
+                f"Uploaded {self.uploader.succeeded} resources, "
+                f"{self.uploader.failed} failed so far."
+            )
+        if run.mapping_state is not None:
+            self._commit_mapping_state(run)
+        self._commit_checkpoint(run, done=True)
+
+    def _commit_checkpoint(self, run: MappingRun, chunks: int = 0, done: bool = False):
+        self.writer.flush()
+        if self.uploader is not None:
+            self.uploader.flush()
+        if self.pipeline is not None:
+            self.pipeline.join()
+        uploads = [
+            upload for upload in (self.uploader, self.pipeline, self.parallel)
+            if upload is not None
+        ]
+        self.checkpoint.commit(
+            run.key,
+            chunks=chunks,
+            done=done,
+            succeeded=sum(upload.succeeded for upload in uploads),
+            failed=sum(upload.failed for upload in uploads),
+        )
+
+    def _failed_uploads(self) -> int:
+        if self.pipeline is not None:
+            self.pipeline.join()
+        return sum(
+            upload.failed
+            for upload in (self.uploader, self.pipeline, self.parallel)
+            if upload is not None
+        )
+
+    def _commit_mapping_state(self, run: MappingRun):
+        mapping_state = run.mapping_state
+        if self._failed_uploads() > run.failed_uploads:
+            # The rows are transformed again by the next incremental run
+            logger.warning(
+                f"Uploads of mapping {mapping_state.key} failed, its state is not recorded.",
+            )
+            return
+        deleted = mapping_state.commit()
+        if not deleted or not self.emit_deletes:
+            return
+        failed = sum(
+            not delete_resource(mapping_state.resource_type, resource_id, self.fhir_base_url)
+            for resource_id in deleted
+        )
+        logger.info(
+            f"Deleted {len(deleted) - failed} {mapping_state.resource_type} resources of "
+            f"disappeared rows, {failed} failed.",
+        )
+
+    def _table_path(self, table_config: dict) -> str:
+        return os.path.join(self.data_folder_path, table_config.get("file_name"))
+
+    def _load_table(self, table_name: str) -> Union[pd.DataFrame, None]:
+        custom_table_config = self.fhir_config_loader.config.get(
+            "table_loader",
+        ).get(table_name)
+        if not custom_table_config:
+            logger.warning(f"No configuration found for table {table_name}.")
+            return None
+        logger.info(f"Loading table {table_name}")
+        table_loader = loader.Loader(
+            data_path=self._table_path(custom_table_config),
+            configuration=custom_table_config,
+            source_cache=self.table_cache.source_cache,
+            table_cache=self.columnar_cache,
+            encoding_cache=self.encoding_cache,
+            columns=self._table_columns(table_name),
+        )
+        with profiling.PROFILER.stage("load"):
+            table = table_loader.load()
+        self.duplicate_rows[table_name] = table_loader.duplicate_rows
+        return table
+
+    def _table_columns(self, table_name: str) -> Union[set[str], None]:
+        if self.table_columns is None:
+            return None
+        return self.table_columns.get(table_name)
 
     def transform(
         self,
-        resource_type: str,
+        run: MappingRun,
         used_tables: list[str],
         join_on: list[dict[str, Union[str, dict[str, str]]]],
     ):
@@ -77,112 +460,171 @@ class dw2cds:
             logger.error("No tables defined in the config file.")
             return
 
-        self.tables = self._load_tables(used_tables)
+        streamed_table = None
+        if self.chunk_size > 0:
+            streamed_table = self._streamed_table(used_tables, join_on)
+
+        if streamed_table is None:
+            tables = self.table_cache.acquire(used_tables)
+            self._transform_joined_table(run, self._join_tables(tables, used_tables, join_on))
+        else:
+            lookup_tables = self.table_cache.acquire(
+                [table for table in used_tables if table != streamed_table],
+            )
+            last_checkpoint = time.monotonic()
+            for index, chunk in enumerate(self._iter_table_chunks(streamed_table)):
+                tables = {**lookup_tables, streamed_table: chunk}
+                if index < run.resumed_chunks:
+                    # Committed before the checkpoint, the rows are only recorded in the
+                    # state of an incremental run
+                    if run.mapping_state is not None:
+                        run.mapping_state.changed_rows(
+                            self._join_tables(tables, used_tables, join_on),
+                            run.transformer.resource_ids,
+                        )
+                    continue
+                logger.info(
+                    f"Transforming chunk {index + 1} of {streamed_table} ({len(chunk)} rows)",
+                )
+                self._transform_joined_table(
+                    run,
+                    self._join_tables(tables, used_tables, join_on),
+                )
+                if (
+                    self.chunk_checkpoints
+                    and time.monotonic() - last_checkpoint >= self.checkpoint_interval
+                ):
+                    self._commit_checkpoint(run, chunks=index + 1)
+                    last_checkpoint = time.monotonic()
+
+        # Unload the tables that are not used by a later mapping to free up memory
+        self.table_cache.release(used_tables)
 
+    def _join_tables(
+        self,
+        tables: dict[str, pd.DataFrame],
+        used_tables: list[str],
+        join_on: list[dict[str, Union[str, dict[str, str]]]],
+    ) -> pd.DataFrame:
+        with profiling.PROFILER.stage("join"):
+            return self._join(tables, used_tables, join_on)
+
+    def _join(
+        self,
+        tables: dict[str, pd.DataFrame],
+        used_tables: list[str],
+        join_on: list[dict[str, Union[str, dict[str, str]]]],
+    ) -> pd.DataFrame:
         joined_table = None
         if join_on:
-            joined_table = self._perform_joins(join_on)
+            joined_table = self._perform_joins(tables, join_on)
+            if joined_table is None:
+                logger.error("None of the join specs could be executed.")
+                joined_table = pd.DataFrame()
         else:
-            joined_table = self.tables[used_tables[0]].copy()
+            joined_table = tables[used_tables[0]].copy()
             joined_table.columns = [
                 used_tables[0] + "." + col
-                for col in self.tables[used_tables[0]].columns
+                for col in tables[used_tables[0]].columns
             ]
 
         logger.debug(f"Joined table columns: {joined_table.columns}")
-        tqdm.pandas(desc=f"Transforming {resource_type}")
-        joined_table.progress_apply(
-            self.transformer.transform,
-            axis=1,
-            args=(resource_type, self.fhir_base_url),
-        )
+        return joined_table
 
-        # Unload tables to free up memory
-        self.tables.clear()
+    def _transform_joined_table(self, run: MappingRun, joined_table: pd.DataFrame):
+        if run.mapping_state is not None:
+            joined_table = run.mapping_state.changed_rows(
+                joined_table,
+                run.transformer.resource_ids,
+            )
+            if joined_table.empty:
+                return
+        run.rows += len(joined_table)
+        if (
+            self.parallel is not None
+            and len(joined_table) >= parallel_transform.SHARD_MIN_ROWS
+        ):
+            self.parallel.transform_table(joined_table, run.mapping)
+        else:
+            run.transformer.transform_table(
+                joined_table,
+                run.mapping.get("resourceType"),
+                self.fhir_base_url,
+            )
 
-    def _perform_joins(self, join_on: list[dict[str, Union[str, dict[str, str]]]]):
-        joined_table = None
-        keys = []
-
-        # Collect all the keys that will be used for joining
-        for join_spec in join_on:
-            for table, key in join_spec.items():
-                if table != "join_type":
-                    keys.append(key)
-
-        for join_spec in join_on:
-            left_table, right_table, join_type = None, None, "inner"
-            for table, key in join_spec.items():
-                if table != "join_type":
-                    if not left_table:
-                        left_table, left_key = table, key
-                    else:
-                        right_table, right_key = table, key
-                else:
-                    join_type = key
-
-            if left_table in self.tables and right_table in self.tables:
-                left_tmp_table = self.tables[left_table].copy()
-                right_tmp_table = self.tables[right_table].copy()
-
-                left_tmp_table.columns = [
-                    left_table + "." + col if col not in keys else col
-                    for col in left_tmp_table.columns
-                ]
-                right_tmp_table.columns = [
-                    right_table + "." + col if col not in keys else col
-                    for col in right_tmp_table.columns
-                ]
-                if joined_table is None:
-                    joined_table = pd.merge(
-                        left_tmp_table,
-                        right_tmp_table,
-                        left_on=left_key,
-                        right_on=right_key,
-                        how=join_type,
-                    )
-                else:
-                    joined_table = pd.merge(
-                        joined_table,
-                        right_tmp_table,
-                        left_on=left_key,
-                        right_on=right_key,
-                        how=join_type,
-                    )
-
-                joined_table = joined_table.loc[
-                    :,
-                    ~joined_table.columns.duplicated(keep="first"),
-                ]
+    def _streamed_table(
+        self,
+        used_tables: list[str],
+        join_on: list[dict[str, Union[str, dict[str, str]]]],
+    ) -> Union[str, None]:
+        """
+        Selects the table that is read chunk-wise in streaming mode.
 
-            else:
-                if left_table not in self.tables:
-                    logger.error(f"Table {left_table} not loaded.")
-                if right_table not in self.tables:
-                    logger.error(f"Table {right_table} not loaded.")
-
-            # Iterate over the columns of the DataFrame
-            for column in joined_table.columns:
-                # Check if the column name ends with '_x' or '_y'
-                if column.endswith("_x") or column.endswith("_y"):
-                    # Extract the original column name
-                    original_column_name = column[:-2]
-
-                    # Check if both columns exist in the DataFrame
-                    if (
-                        original_column_name + "_x" in joined_table.columns
-                        and original_column_name + "_y" in joined_table.columns
-                    ):
-                        # Drop the column ending with '_y'
-                        joined_table = joined_table.drop(
-                            columns=[original_column_name + "_y"],
-                        )
+        Chunks of a table can only be joined independently if all joins are inner joins
+        and the table is merged exactly once. Of these tables, the table with the largest
+        source file is streamed.
 
-                        # Rename the column ending with '_x' to the original column name
-                        joined_table = joined_table.rename(
-                            columns={original_column_name + "_x": original_column_name},
-                        )
-        return joined_table
+        Returns:
+            str | None: The name of the streamed table, or None if the tables have to be
+            loaded completely.
+        """
+        if any(join_spec.get("join_type", "inner") != "inner" for join_spec in join_on):
+            logger.info("Not all joins are inner joins, loading the tables completely.")
+            return None
+
+        table_loader = self.fhir_config_loader.config.get("table_loader", {})
+        candidates = used_tables[:1]
+        if join_on:
+            # Tables as merged by _perform_joins: both tables of the first join and the
+            # right table of every further join
+            merged_tables = []
+            for index, join_spec in enumerate(join_on):
+                tables = [table for table in join_spec if table != "join_type"]
+                merged_tables.extend(tables[:2] if index == 0 else tables[1:2])
+            candidates = [
+                table for table in dict.fromkeys(merged_tables)
+                if merged_tables.count(table) == 1
+            ]
+        sizes = {}
+        for table_name in candidates:
+            table_config = table_loader.get(table_name)
+            if table_config and os.path.exists(self._table_path(table_config)):
+                sizes[table_name] = os.path.getsize(self._table_path(table_config))
+        if not sizes:
+            return None
+        return max(sizes, key=sizes.get)
+
+    def _iter_table_chunks(self, table_name: str):
+        table = self.table_cache.get(table_name)
+        if table is not None:
+            # The table is already loaded for another mapping
+            for start in range(0, len(table), self.chunk_size):
+                yield table.iloc[start:start + self.chunk_size]
+            return
+
+        table_config = self.fhir_config_loader.config.get("table_loader").get(table_name)
+        logger.info(f"Streaming table {table_name} in chunks of {self.chunk_size} rows")
+        table_loader = loader.Loader(
+            data_path=self._table_path(table_config),
+            configuration=table_config,
+            encoding_cache=self.encoding_cache,
+            columns=self._table_columns(table_name),
+        )
+        chunks = table_loader.iter_chunks(self.chunk_size)
+        while True:
+            with profiling.PROFILER.stage("load"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+        self.duplicate_rows[table_name] = table_loader.duplicate_rows
+
+    def _perform_joins(
+        self,
+        tables: dict[str, pd.DataFrame],
+        join_on: list[dict[str, Union[str, dict[str, str]]]],
+    ):
+        return join_planner.JoinPlan(tables, join_on).execute()
 
 
 # Argument parsing for command line execution
@@ -236,13 +678,183 @@ parser.add_argument(
     help="URL of the FHIR server",
     default="http://host.docker.internal:8080/fhir",
 )
+parser.add_argument(
+    "--bundle_size",
+    type=int,
+    help="Number of resources uploaded per FHIR bundle, 0 uploads every resource with a separate request",
+    default=0,
+)
+parser.add_argument(
+    "--bundle_type",
+    type=str,
+    help="Type of the uploaded FHIR bundles",
+    choices=["transaction", "batch"],
+    default="transaction",
+)
+parser.add_argument(
+    "--bundle_flush_interval",
+    type=float,
+    help="Maximum number of seconds a resource is buffered before its bundle is uploaded",
+    default=30.0,
+)
+parser.add_argument(
+    "--upload_workers",
+    type=int,
+    help="Number of concurrent upload requests, 0 uploads synchronously during the transformation",
+    default=0,
+)
+parser.add_argument(
+    "--upload_queue_size",
+    type=int,
+    help="Maximum number of transformed resources waiting for a concurrent upload",
+    default=1000,
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    help="Number of worker processes transforming a table in parallel, 1 transforms in the main process",
+    default=1,
+)
+parser.add_argument(
+    "--ndjson_fsync",
+    type=str,
+    help="When the NDJSON output is forced to disk: never, after every mapping (flush) or at the end (close)",
+    choices=FSYNC_POLICIES,
+    default="never",
+)
+parser.add_argument(
+    "--table_cache_dir",
+    type=str,
+    help="Folder of the on-disk cache of loaded tables and detected encodings, no cache is used if not set",
+    default=None,
+)
+parser.add_argument(
+    "--table_cache_content_hash",
+    action="store_true",
+    help="Detect changed source files by a hash of their content instead of size and modification time",
+)
+parser.add_argument(
+    "--chunk_size",
+    type=int,
+    help="Number of rows of the largest table of a mapping that are loaded, joined and transformed at once, 0 loads the tables completely",
+    default=0,
+)
+parser.add_argument(
+    "--read_all_columns",
+    action="store_true",
+    help="Parse all columns of the source files instead of the columns referenced by the mappings",
+)
+parser.add_argument(
+    "--validation",
+    type=str,
+    choices=validation.VALIDATION_MODES,
+    help="Validate every resource (full), a sample of the resources (sample) or none of them (none). Unvalidated resources are emitted as assembled by the mapping",
+    default="full",
+)
+parser.add_argument(
+    "--validation_sample_rate",
+    type=float,
+    help="In sample mode, validate every Nth resource for N >= 1, or the given share of randomly selected resources for values below 1. Validated resources that differ from their assembled form are logged, the run fails at its end if there are any",
+    default=100,
+)
+parser.add_argument(
+    "--incremental",
+    action="store_true",
+    help="Transform only the rows that are new or changed since the last incremental run, as recorded in the state store",
+)
+parser.add_argument(
+    "--emit_deletes",
+    action="store_true",
+    help="With --incremental, delete the resources of rows that disappeared since the last incremental run from the FHIR server",
+)
+parser.add_argument(
+    "--state_store",
+    type=str,
+    help="Path of the SQLite state store of incremental runs, defaults to dw2cds_state.sqlite in the output data folder",
+    default=None,
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="Resume an interrupted run from its checkpoint, skipping the completed mappings and chunks",
+)
+parser.add_argument(
+    "--checkpoint_path",
+    type=str,
+    help="Path of the checkpoint of the run, defaults to dw2cds_checkpoint.json in the output data folder",
+    default=None,
+)
+parser.add_argument(
+    "--checkpoint_interval",
+    type=float,
+    help="Minimum number of seconds between two checkpoints within a mapping in streaming mode",
+    default=300.0,
+)
+parser.add_argument(
+    "--mapping_workers",
+    type=int,
+    help="Number of resource mappings transformed concurrently by threads in the order of the mapping scheduler, 0 or 1 transforms the mappings one after another in configured order. The threads overlap the loading, writing and uploading of mappings, but the transformation holds the GIL, use --workers to transform on several CPUs",
+    default=0,
+)
+parser.add_argument(
+    "--memory_budget",
+    type=int,
+    help="Maximum size of the loaded tables in MiB when mappings are transformed concurrently, 0 for no limit",
+    default=0,
+)
+parser.add_argument(
+    "--processor_cache_size",
+    type=int,
+    help="Maximum number of cached results per pure processor, 0 disables the caches",
+    default=processor_registry.DEFAULT_CACHE_SIZE,
+)
+parser.add_argument(
+    "--profile_report",
+    type=str,
+    help="Path of a JSON report of the call counts and latencies per stage and processor and the rows per second and peak memory per mapping, profiling is disabled if neither report is set",
+    default=None,
+)
+parser.add_argument(
+    "--profile_prometheus",
+    type=str,
+    help="Path of the profiling report in the Prometheus text format",
+    default=None,
+)
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    if args.emit_deletes and not args.incremental:
+        parser.error("--emit_deletes requires --incremental")
+    if args.workers > 1 and args.mapping_workers > 1:
+        parser.error("--workers and --mapping_workers cannot both be greater than 1")
     dw2cds = dw2cds(
         data_folder_path=args.data_folder_path,
         config_path=args.config_path,
         output_data_folder_path=args.output_data_folder,
         processor_paths=args.processor_paths,
-        fhir_base_url=args.fhir_server_url
+        fhir_base_url=args.fhir_server_url,
+        bundle_size=args.bundle_size,
+        bundle_type=args.bundle_type,
+        bundle_flush_interval=args.bundle_flush_interval,
+        upload_workers=args.upload_workers,
+        upload_queue_size=args.upload_queue_size,
+        workers=args.workers,
+        ndjson_fsync=args.ndjson_fsync,
+        table_cache_dir=args.table_cache_dir,
+        table_cache_content_hash=args.table_cache_content_hash,
+        chunk_size=args.chunk_size,
+        read_all_columns=args.read_all_columns,
+        validation_mode=args.validation,
+        validation_sample_rate=args.validation_sample_rate,
+        incremental=args.incremental,
+        emit_deletes=args.emit_deletes,
+        state_store_path=args.state_store,
+        resume=args.resume,
+        checkpoint_path=args.checkpoint_path,
+        checkpoint_interval=args.checkpoint_interval,
+        mapping_workers=args.mapping_workers,
+        memory_budget=args.memory_budget * 1024 * 1024,
+        profile_report_path=args.profile_report,
+        profile_prometheus_path=args.profile_prometheus,
+        processor_cache_size=args.processor_cache_size,
     )
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import copy
+import json
+import logging
+import os
+import re
+import threading
+
+from chardet.universaldetector import UniversalDetector
+from utils.fingerprint import file_fingerprint
+
+"""
+This module detects the encoding of source files that have no configured encoding.
+
+The detector is fed with a bounded sample from the start of the file. If the result for
+the sample has a low confidence, the detector is fed with further samples, until the
+result is confident or the same for two consecutive samples, or MAX_SAMPLES samples were
+fed. A sample of plain ASCII does not tell anything about the rest of the file: the rest
+is scanned for the first non-ASCII byte (with bytes.isascii, without the detector), and
+the detector continues with the sample starting there. A file without such a byte is
+ASCII. Detected encodings are cached per file fingerprint.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Number of bytes fed to the detector before its result is checked
+SAMPLE_SIZE = 256 * 1024
+
+# Number of bytes read at once
+BLOCK_SIZE = 64 * 1024
+
+# Number of bytes read at once when scanning for non-ASCII bytes
+SCAN_BLOCK_SIZE = 1024 * 1024
+
+# Maximum number of samples fed to the detector
+MAX_SAMPLES = 16
+
+_NON_ASCII = re.compile(rb"[\x80-\xff]")
+
+# Minimum confidence of a result for the sample
+MIN_CONFIDENCE = 0.9
+
+
+class EncodingCache:
+    """
+    Detected encodings by file fingerprint.
+
+    Args:
+        path (str | os.PathLike | None): The JSON file the encodings are persisted in. If
+            None, the encodings are only kept for the lifetime of the cache.
+    """
+
+    def __init__(self, path: str | os.PathLike | None = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self._entries = json.load(file)
+            except (OSError, ValueError) as error:
+                logger.warning(f"Ignoring unreadable encoding cache {path}: {error}")
+
+    def get(self, file_path: str | os.PathLike) -> str | None:
+        """
+        Returns the encoding of a file, or None if the file changed or was never detected.
+
+        Args:
+            file_path (str | os.PathLike): The path of the file.
+        """
+        entry = self._entries.get(os.path.abspath(file_path))
+        if entry and entry.get("fingerprint") == file_fingerprint(file_path):
+            return entry.get("encoding")
+        return None
+
+    def put(self, file_path: str | os.PathLike, encoding: str) -> None:
+        """
+        Caches the encoding of a file and persists the cache.
+
+        Args:
+            file_path (str | os.PathLike): The path of the file.
+            encoding (str): The detected encoding.
+        """
+        with self._lock:
+            self._entries[os.path.abspath(file_path)] = {
+                "fingerprint": file_fingerprint(file_path),
+                "encoding": encoding,
+            }
+            if self.path is None:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temporary_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary_path, "w") as file:
+                json.dump(self._entries, file, indent=2, sort_keys=True)
+            os.replace(temporary_path, self.path)
+
+
+def detect_encoding(
+    file_path: str | os.PathLike,
+    cache: EncodingCache | None = None,
+    sample_size: int = SAMPLE_SIZE,
+) -> str | None:
+    """
+    Detects the encoding of a file.
+
+    Args:
+        file_path (str | os.PathLike): The path of the file.
+        cache (EncodingCache | None): The cache of detected encodings.
+        sample_size (int): The number of bytes fed to the detector before its result is checked.
+
+    Returns:
+        str | None: The detected encoding, or None if it could not be detected.
+    """
+    if cache is not None:
+        encoding = cache.get(file_path)
+        if encoding is not None:
+            logger.debug(f"Using cached encoding {encoding} of {file_path}")
+            return encoding
+
+    detector = UniversalDetector()
+    with open(file_path, "rb") as file:
+        read, ascii_only = _feed(detector, file, sample_size)
+        samples = 1
+        # Ambiguous samples are extended sample by sample until the result is clear or
+        # stays the same for two samples
+        previous_encoding = None
+        while read == sample_size and not detector.done and samples < MAX_SAMPLES:
+            if ascii_only:
+                logger.debug(f"Sample of {file_path} is ASCII, scanning for non-ASCII bytes")
+                if not _seek_non_ascii(file):
+                    break
+                ascii_only = False
+            else:
+                encoding, confidence = _current_result(detector)
+                if confidence >= MIN_CONFIDENCE or encoding == previous_encoding:
+                    break
+                logger.debug(f"Encoding of the sample of {file_path} is ambiguous, reading further")
+                previous_encoding = encoding
+            read, _ = _feed(detector, file, sample_size)
+            samples += 1
+    result = detector.close()
+
+    encoding = result.get("encoding")
+    logger.info(
+        f"Detected encoding {encoding} of {file_path} "
+        f"(confidence {result.get('confidence', 0):.2f})",
+    )
+    if cache is not None and encoding is not None:
+        cache.put(file_path, encoding)
+    return encoding
+
+
+def _feed(detector: UniversalDetector, file, size: int) -> tuple[int, bool]:
+    read = 0
+    ascii_only = True
+    while not detector.done and read < size:
+        block = file.read(min(BLOCK_SIZE, size - read))
+        if not block:
+            break
+        detector.feed(block)
+        read += len(block)
+        ascii_only = ascii_only and block.isascii()
+    return read, ascii_only
+
+
+def _seek_non_ascii(file) -> bool:
+    # Moves the file position to the first non-ASCII byte, False if there is none
+    while True:
+        position = file.tell()
+        block = file.read(SCAN_BLOCK_SIZE)
+        if not block:
+            return False
+        if not block.isascii():
+            file.seek(position + _NON_ASCII.search(block).start())
+            return True
+
+
+def _current_result(detector: UniversalDetector) -> tuple[str, float]:
+    # close() finalizes the detector, the result so far is taken from a copy
+    result = copy.deepcopy(detector).close()
+    return (result.get("encoding") or "").lower(), result.get("confidence") or 0
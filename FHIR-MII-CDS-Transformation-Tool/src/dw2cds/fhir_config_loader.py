@@ -89,6 +89,49 @@ class FHIRConfigLoader:
                         processors[value.strip("$")] = []
         return processors
 
+    def load_required_columns(self) -> dict[str, set[str]]:
+        """
+        Determine the columns of every table that are referenced by the resource mappings.
+
+        A reference "%Table.column%" requires the column of its table. Join keys and
+        references without a table name are column names of the joined table, which may
+        come from any table of the mapping, so they are required in every used table.
+
+        Returns:
+            dict[str, set[str]]: The referenced columns by table name, tables that are not
+            used by any mapping are missing.
+        """
+        required_columns = {}
+        mappings = self.config.get("resourceMappings", []) if self.config else []
+        for mapping in mappings:
+            used_tables = mapping.get("usedTables") or []
+            unqualified = set()
+            for join_spec in mapping.get("join_on") or []:
+                unqualified.update(
+                    key for table, key in join_spec.items() if table != "join_type"
+                )
+            for table in used_tables:
+                required_columns.setdefault(table, set())
+
+            for reference in _column_references(mapping.get("fields", {})):
+                table, _, column = reference.partition(".")
+                if column and table in used_tables:
+                    required_columns[table].add(column)
+                else:
+                    unqualified.add(reference)
+            for table in used_tables:
+                required_columns[table].update(unqualified)
+        return required_columns
+
+    def load_pure_processors(self) -> list[str]:
+        """
+        Load the names of the processors declared as pure in the configuration.
+
+        Returns:
+            list[str]: The "pure_processors" of the configuration.
+        """
+        return list(self.config.get("pure_processors", [])) if self.config else []
+
     def _load_config(self) -> dict:
         """
         Load the configuration from the file.
@@ -118,6 +161,33 @@ class FHIRConfigLoader:
         return self.config.get("table_loader").keys()
 
 
+def _column_references(value, list_item: bool = False) -> set[str]:
+    """
+    Collect the column references of a mapping value.
+
+    Field values reference a column as "%column%", items of lists are column references
+    with or without the enclosing "%" (except processor references).
+
+    Args:
+        value: The mapping value, a string or nested lists and dicts.
+        list_item (bool): Whether the value is an item of a list.
+
+    Returns:
+        set[str]: The referenced column names without the enclosing "%".
+    """
+    if isinstance(value, str):
+        if value.startswith("$") and value.endswith("$"):
+            return set()
+        if list_item or (len(value) > 1 and value.startswith("%") and value.endswith("%")):
+            return {value.strip("%")}
+        return set()
+    if isinstance(value, dict):
+        return set().union(*(_column_references(item) for item in value.values()))
+    if isinstance(value, list):
+        return set().union(*(_column_references(item, list_item=True) for item in value))
+    return set()
+
+
 if __name__ == "__main__":
     mapping_path = os.path.join(
         os.getcwd(),
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+"""
+This module joins the tables of a resource mapping as configured by its join_on specs.
+
+The joins are planned on row positions instead of the tables themselves: every join
+step only merges the integer-encoded join keys and maps the row positions of the
+already joined tables, and the columns of the joined table are materialized once at the
+end. Column name collisions are resolved before any merge: the table that comes first in
+the join specs keeps the column, as if the later columns were merged and dropped. Inner
+joins are executed in the order of their estimated result size, other join types in the
+configured order. The joined table has the rows and columns in the order of the
+configured joins, whatever order the joins were executed in.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class JoinStep:
+    """
+    A table that is merged into the joined table.
+
+    Attributes:
+        table_name (str): The name of the merged table.
+        left_key (str): The key column of the joined table.
+        right_key (str): The key column of the merged table.
+        join_type (str): The pandas merge type.
+        rank (int): The position of the step in the join specs.
+    """
+    table_name: str
+    left_key: str
+    right_key: str
+    join_type: str
+    rank: int
+
+
+class JoinPlan:
+    """
+    Plan of the joins of a resource mapping.
+
+    The first table of the first join spec is the base table. Every join spec merges
+    its second table into the joined table, using its first key as the key of the joined
+    table.
+
+    Args:
+        tables (dict[str, pd.DataFrame]): The loaded tables by name.
+        join_on (list[dict]): The join specs of the resource mapping.
+    """
+
+    def __init__(
+        self,
+        tables: dict[str, pd.DataFrame],
+        join_on: list[dict[str, Union[str, dict[str, str]]]],
+    ):
+        self.tables = tables
+        self.base_table = None
+        self.steps: list[JoinStep] = []
+        # Key columns keep their name, all other columns are prefixed with the table name
+        self.keys = {
+            key for join_spec in join_on
+            for table, key in join_spec.items() if table != "join_type"
+        }
+
+        for join_spec in join_on:
+            left_table, right_table, join_type = None, None, "inner"
+            for table, key in join_spec.items():
+                if table != "join_type":
+                    if not left_table:
+                        left_table, left_key = table, key
+                    else:
+                        right_table, right_key = table, key
+                else:
+                    join_type = key
+
+            if left_table not in tables or right_table not in tables:
+                if left_table not in tables:
+                    logger.error(f"Table {left_table} not loaded.")
+                if right_table not in tables:
+                    logger.error(f"Table {right_table} not loaded.")
+                continue
+            if self.base_table is None:
+                self.base_table = left_table
+            self.steps.append(
+                JoinStep(right_table, left_key, right_key, join_type, len(self.steps) + 1),
+            )
+
+        # The first table (by rank) with a column name owns the column
+        self.owners: dict[str, tuple[int, str]] = {}
+        for rank, table_name in enumerate(self.table_names):
+            for column in tables[table_name].columns:
+                self.owners.setdefault(self.column_name(table_name, column), (rank, column))
+
+    @property
+    def table_names(self) -> list[str]:
+        """
+        The names of the joined tables by rank, a table joined to itself occurs twice.
+        """
+        if self.base_table is None:
+            return []
+        return [self.base_table] + [step.table_name for step in self.steps]
+
+    def column_name(self, table_name: str, column: str) -> str:
+        """
+        Returns the name of a column in the joined table.
+
+        Args:
+            table_name (str): The name of the table of the column.
+            column (str): The name of the column in its table.
+        """
+        return column if column in self.keys else f"{table_name}.{column}"
+
+    def execute(self) -> pd.DataFrame | None:
+        """
+        Joins the tables.
+
+        Returns:
+            pd.DataFrame | None: The joined table, or None if no join spec could be executed.
+
+        Raises:
+            KeyError: If the key of the joined table of a join step is not a joined column.
+            ValueError: If the keys of a join step have incompatible types, as pd.merge.
+        """
+        if self.base_table is None:
+            return None
+
+        # Row positions of every merged table (by rank) in the joined table, -1 if missing
+        positions = {0: np.arange(len(self.tables[self.base_table]))}
+        # Key columns of outer and right joins that are filled with the merged key
+        coalesced: dict[str, list[tuple[int, str]]] = {}
+        steps = self._ordered_steps()
+        for step in steps:
+            left_values = self._column_values(step.left_key, positions, coalesced)
+            right_values = self.tables[step.table_name][step.right_key]
+            if step.join_type == "outer":
+                # Outer joins are sorted by their keys, so the keys are merged as they are
+                left_on, right_on = left_values.to_numpy(), right_values.to_numpy()
+            else:
+                _check_key_types(step, left_values, right_values)
+                codes, _ = pd.factorize(
+                    pd.concat([left_values, right_values], ignore_index=True),
+                    use_na_sentinel=False,
+                )
+                left_on, right_on = codes[:len(left_values)], codes[len(left_values):]
+
+            merged = pd.merge(
+                pd.DataFrame({"left": np.arange(len(left_values))}),
+                pd.DataFrame({"right": np.arange(len(right_values))}),
+                left_on=left_on,
+                right_on=right_on,
+                how=step.join_type,
+            )
+            left_rows = _row_positions(merged["left"])
+            positions = {
+                rank: _take_positions(rows, left_rows) for rank, rows in positions.items()
+            }
+            positions[step.rank] = _row_positions(merged["right"])
+            if step.join_type in ("right", "outer") and step.left_key == step.right_key:
+                coalesced.setdefault(step.left_key, []).append((step.rank, step.right_key))
+
+        if steps != self.steps:
+            # Inner joins keep the order of the joined table and then of the merged table,
+            # so the rows of the configured order are sorted by their positions by rank
+            order = np.lexsort([positions[rank] for rank in sorted(positions, reverse=True)])
+            positions = {rank: rows[order] for rank, rows in positions.items()}
+
+        columns = {
+            name: self._column_values(name, positions, coalesced)
+            for rank in sorted(positions)
+            for name, (owner, _) in self.owners.items()
+            if owner == rank
+        }
+        return pd.DataFrame(columns, copy=False)
+
+    def _ordered_steps(self) -> list[JoinStep]:
+        if len(self.steps) < 2 or any(step.join_type != "inner" for step in self.steps):
+            return self.steps
+
+        # Greedy order: the step with the smallest estimated result whose key is joined
+        merged_ranks = {0}
+        rows = len(self.tables[self.base_table])
+        remaining = list(self.steps)
+        ordered = []
+        while remaining:
+            candidates = [
+                step for step in remaining
+                if self.owners.get(step.left_key, (None,))[0] in merged_ranks
+            ]
+            if not candidates:
+                # Let execute() report the missing key
+                return ordered + remaining
+            estimates = {step: self._estimate_rows(step, rows) for step in candidates}
+            step = min(candidates, key=lambda candidate: (estimates[candidate], candidate.rank))
+            ordered.append(step)
+            remaining.remove(step)
+            merged_ranks.add(step.rank)
+            rows = estimates[step]
+        if ordered != self.steps:
+            logger.debug(f"Join order: {[step.table_name for step in ordered]}")
+        return ordered
+
+    def _estimate_rows(self, step: JoinStep, rows: float) -> float:
+        owner, column = self.owners[step.left_key]
+        left_keys = self.tables[self.table_names[owner]][column]
+        right_keys = self.tables[step.table_name][step.right_key]
+        distinct = max(left_keys.nunique(dropna=False), right_keys.nunique(dropna=False), 1)
+        return rows * len(right_keys) / distinct
+
+    def _column_values(
+        self,
+        name: str,
+        positions: dict[int, np.ndarray],
+        coalesced: dict[str, list[tuple[int, str]]],
+    ) -> pd.Series:
+        if name not in self.owners or self.owners[name][0] not in positions:
+            raise KeyError(f"Column {name} is not a column of the joined tables.")
+        owner, column = self.owners[name]
+        values = _take(self.tables[self.table_names[owner]][column], positions[owner])
+        for rank, right_column in coalesced.get(name, []):
+            missing = positions[owner] < 0
+            if missing.any():
+                right_values = _take(self.tables[self.table_names[rank]][right_column], positions[rank])
+                values = values.where(~missing, right_values)
+        return values
+
+
+def _check_key_types(step: JoinStep, left_values: pd.Series, right_values: pd.Series) -> None:
+    # Keys of incompatible types (e.g. numbers and text) would not match any row once they
+    # are factorized together, pd.merge raises for them instead. Its check is run on the
+    # distinct keys, which have the same types as the key columns.
+    try:
+        pd.merge(
+            left_values.drop_duplicates().to_frame("key"),
+            right_values.drop_duplicates().to_frame("key"),
+            on="key",
+        )
+    except ValueError as error:
+        raise ValueError(
+            f"Cannot join {step.table_name} on {step.left_key} = {step.right_key}: {error}",
+        ) from error
+
+
+def _row_positions(rows: pd.Series) -> np.ndarray:
+    # Rows without a match are NaN in the merge result
+    return rows.fillna(-1).to_numpy(dtype=np.int64)
+
+
+def _take_positions(positions: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    taken = positions[rows]
+    taken[rows < 0] = -1
+    return taken
+
+
+def _take(values: pd.Series, rows: np.ndarray) -> pd.Series:
+    array = (
+        values.array if isinstance(values.dtype, pd.api.extensions.ExtensionDtype)
+        else values.to_numpy()
+    )
+    taken = pd.api.extensions.take(array, rows, allow_fill=bool((rows < 0).any()))
+    return pd.Series(taken, name=values.name, copy=False)
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import io
+import logging
+import os
+from dataclasses import dataclass
+
+"""
+This module repairs known bad lines of delimited source files before they are parsed.
+
+Some data warehouse exports contain free text fields with unescaped delimiters, so the
+affected lines have more fields than the header. The repair is a streaming byte-level
+pre-pass: the file is read block-wise, lines with too many fields are repaired by
+joining and quoting the surplus fields at a configured position, and the repaired stream
+is passed to the fast C parser of pandas (which must not be configured with QUOTE_NONE).
+
+The repair rule is declared in the table configuration:
+
+    "line_repair": {"merge_at": 27, "expected_fields": 30}
+
+merge_at is the (0-based) position of the field that contains the delimiter,
+expected_fields defaults to the number of fields of the header line.
+
+Unlike the join_bad_line callbacks of the python engine, which dropped the field before
+the merged ones (field 26 of the diagnosis and procedure tables) and shifted the
+following fields one column to the left, the repair keeps every field in its column.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Number of bytes read from the source file at once
+BLOCK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class LineRepairRule:
+    """
+    Repairs lines with more fields than expected by joining the surplus fields.
+
+    Attributes:
+        merge_at (int): The position of the field that contains unescaped delimiters.
+        expected_fields (int | None): The number of fields of a valid line, None to use the
+            number of fields of the header line.
+    """
+    merge_at: int
+    expected_fields: int | None = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> LineRepairRule:
+        """
+        Creates the rule from the "line_repair" entry of a table configuration.
+
+        Args:
+            config (dict): The "line_repair" entry.
+
+        Returns:
+            LineRepairRule: The rule.
+
+        Raises:
+            ValueError: If the entry is invalid.
+        """
+        if not isinstance(config, dict) or not isinstance(config.get("merge_at"), int):
+            raise ValueError(f"Invalid line_repair configuration: {config}")
+        return cls(
+            merge_at=config["merge_at"],
+            expected_fields=config.get("expected_fields"),
+        )
+
+    def repair(self, line: bytes, delimiter: bytes, expected_fields: int) -> bytes:
+        """
+        Repairs a single line (without line break).
+
+        Args:
+            line (bytes): The line.
+            delimiter (bytes): The field delimiter.
+            expected_fields (int): The number of fields of a valid line.
+
+        Returns:
+            bytes: The repaired line, or the line itself if it has no surplus fields.
+        """
+        fields = line.split(delimiter)
+        surplus = len(fields) - expected_fields
+        if surplus <= 0 or self.merge_at + surplus >= len(fields):
+            return line
+        end = self.merge_at + surplus + 1
+        merged = delimiter.join(fields[self.merge_at:end])
+        # The joined field is quoted, so the parser does not split it again
+        fields[self.merge_at:end] = [b'"' + merged.replace(b'"', b'""') + b'"']
+        return delimiter.join(fields)
+
+
+class RepairedLineStream(io.RawIOBase):
+    """
+    Binary stream of a delimited file with repaired lines.
+
+    The delimiter must be a single character of an ASCII compatible encoding. Quoted
+    fields are not taken into account when counting the fields of a line.
+
+    Args:
+        path (str | os.PathLike): The path of the source file.
+        rule (LineRepairRule): The repair rule.
+        delimiter (str): The field delimiter.
+    """
+
+    def __init__(self, path: str | os.PathLike, rule: LineRepairRule, delimiter: str):
+        super().__init__()
+        self.path = path
+        self.rule = rule
+        self.delimiter = delimiter.encode("ascii")
+        self.repaired_lines = 0
+        self._file = open(path, "rb")
+        self._expected_fields = rule.expected_fields
+        self._buffer = memoryview(b"")
+        self._blocks = self._repaired_blocks()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._buffer = memoryview(block)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+            if self.repaired_lines:
+                logger.info(f"Repaired {self.repaired_lines} lines of {self.path}")
+        super().close()
+
+    def _repaired_blocks(self):
+        while True:
+            block = self._file.read(BLOCK_SIZE)
+            if not block:
+                return
+            # Complete the last line of the block
+            if not block.endswith(b"\n"):
+                block += self._file.readline()
+
+            lines = block.split(b"\n")
+            if self._expected_fields is None:
+                self._expected_fields = lines[0].count(self.delimiter) + 1
+            delimiters = self._expected_fields - 1
+            if all(line.count(self.delimiter) <= delimiters for line in lines):
+                yield block
+                continue
+
+            for index, line in enumerate(lines):
+                if line.count(self.delimiter) > delimiters:
+                    lines[index] = self.rule.repair(line, self.delimiter, self._expected_fields)
+                    self.repaired_lines += 1
+            yield b"\n".join(lines)
+
+
+def open_repaired(
+    path: str | os.PathLike,
+    rule_config: dict,
+    delimiter: str,
+) -> io.BufferedReader:
+    """
+    Opens a delimited file as buffered binary stream with repaired lines.
+
+    Args:
+        path (str | os.PathLike): The path of the source file.
+        rule_config (dict): The "line_repair" entry of the table configuration.
+        delimiter (str): The field delimiter.
+
+    Returns:
+        io.BufferedReader: The repaired stream, which has to be closed by the caller.
+    """
+    return io.BufferedReader(
+        RepairedLineStream(path, LineRepairRule.from_config(rule_config), delimiter),
+        buffer_size=BLOCK_SIZE,
+    )
@@ -36,28 +36,57 @@ class LoadDiag(BaseDataLoadStrategy):
         self.filter_value_starts_with = "ICD"
         self._df = None
 
-    def load_csv(self) -> pd.DataFrame:
+    def read_options(self) -> dict:
         """
-        Load the CSV file and return it as a pandas DataFrame.
+        Returns the options passed to pandas.read_csv.
 
         Returns:
-            pd.DataFrame: The loaded CSV data as a pandas DataFrame.
+            dict: The read options, repairing bad lines with join_bad_line if the table
+            configuration has no "line_repair" rule.
         """
         encoding: str = self._configuration["csv"].get("encoding")
         delimiter: str = self._configuration["csv"]["delimiter"]
         engine: str = self._configuration["csv"]["engine"]
+        if "line_repair" in self._configuration:
+            # Bad lines are repaired before parsing, any engine can be used
+            return dict(
+                encoding=encoding,
+                delimiter=delimiter,
+                engine=engine,
+                encoding_errors="replace",
+            )
         assert (
             engine == "python"
         ), "The engine must be set to 'python' for the on_bad_lines parameter to work"
 
-        self._df: pd.DataFrame = pd.read_csv(
-            filepath_or_buffer=self._file_path,
+        return dict(
             encoding=encoding,
             delimiter=delimiter,
             engine=engine,
             on_bad_lines=self.join_bad_line,
             encoding_errors="replace",
         )
+
+    def required_columns(self) -> set[str]:
+        """
+        Returns the column the rows are filtered on.
+
+        Returns:
+            set[str]: The column names.
+        """
+        return {self.filter_column_name}
+
+    def postprocess(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Keep the rows of the configured code system.
+
+        Args:
+            df (pd.DataFrame): The parsed CSV data.
+
+        Returns:
+            pd.DataFrame: The filtered data.
+        """
+        self._df = df
         return self.filter(self.filter_column_name, self.filter_value_starts_with)
 
     def filter(self, columnname, value_startswith):
@@ -158,8 +187,10 @@ class USUTableWindow(BaseDataLoadStrategy):
             configuration=configuration,
         )
 
-    def load_csv(self) -> pd.DataFrame:
-        df = super().load_csv()
+    def required_columns(self) -> set[str]:
+        return {'STAD', 'STOD'}
+
+    def postprocess(self, df: pd.DataFrame) -> pd.DataFrame:
         mask = df['STAD'].notna() & df['STOD'].notna()
         return df[mask]
 
@@ -174,7 +205,9 @@ class USUTableDate(BaseDataLoadStrategy):
             configuration=configuration,
         )
 
-    def load_csv(self) -> pd.DataFrame:
-        df = super().load_csv()
+    def required_columns(self) -> set[str]:
+        return {'STAD', 'STOD'}
+
+    def postprocess(self, df: pd.DataFrame) -> pd.DataFrame:
         mask = df['STAD'].notna() & df['STOD'].notna()
         return df[~mask]
\ No newline at end of file
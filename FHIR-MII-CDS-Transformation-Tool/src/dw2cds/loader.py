@@ -1,14 +1,24 @@
 from __future__ import annotations
 
+import contextlib
 import importlib
 import json
 import logging
 import os
 import pathlib
 from abc import ABC, abstractmethod
-import chardet
+from typing import Iterator
 
+import numpy as np
 import pandas as pd
+from dtype_profile import apply_dtype_profile
+from encoding_detection import detect_encoding
+from line_repair import open_repaired
+from utils.fingerprint import FingerprintSet, row_fingerprints
+
+# Maximum number of rows the column types are inferred from before a file is parsed
+# chunk-wise, if the chunks are larger, the types are inferred from the first chunk
+TYPE_SAMPLE_ROWS = 100_000
 
 
 class IDataLoadStrategy(ABC):
@@ -34,8 +44,23 @@ class BaseDataLoadStrategy(IDataLoadStrategy):
     This class provides a common interface for loading data from different file formats.
     Subclasses must implement the `load_csv` and `load_json` methods to load data from CSV and JSON files, respectively.
     The `load` method can be used to automatically determine the file format and delegate the loading to the appropriate method.
+
+    Attributes:
+        source_cache (SourceCache | None): If set, parsed files are shared with other strategies
+            reading the same file with the same options.
+        encoding_cache (EncodingCache | None): If set, detected encodings are cached by file
+            fingerprint.
+        columns (frozenset[str] | None): If set, only these columns and the required_columns()
+            of the strategy are parsed, or selected after parsing for tables with bad line
+            handling.
+        duplicate_rows (int): The number of duplicate rows dropped by the last load.
     """
 
+    source_cache = None
+    encoding_cache = None
+    columns = None
+    duplicate_rows = 0
+
     def __init__(
         self,
         file_path: str | os.PathLike,
@@ -68,12 +93,151 @@ class BaseDataLoadStrategy(IDataLoadStrategy):
         Returns:
             pd.DataFrame: A pandas DataFrame containing the data from the CSV file.
         """
-        if "encoding" not in self._configuration["csv"]:
-            with open(self._file_path, "rb") as f:
-                encoding = chardet.detect(f.read())["encoding"]
-            return pd.read_csv(self._file_path, **self._configuration["csv"], encoding=encoding)
+        read_options = self._projected(self.read_options())
+        return self.postprocess(self._selected(self._read_csv(**read_options), read_options))
+
+    def read_options(self) -> dict:
+        """
+        Returns the options passed to pandas.read_csv.
+
+        Returns:
+            dict: The read options, by default the "csv" configuration with the detected
+            encoding if no encoding is configured.
+        """
+        options = dict(self._configuration["csv"])
+        if "encoding" not in options:
+            options["encoding"] = detect_encoding(self._file_path, self.encoding_cache)
+        return options
+
+    def required_columns(self) -> set[str]:
+        """
+        Returns the columns the strategy needs in addition to the selected columns, e.g.
+        the columns postprocess() filters on.
+
+        Returns:
+            set[str]: The column names.
+        """
+        return set()
+
+    def postprocess(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Filters or transforms the parsed CSV data. Called for the whole file or for every
+        chunk of it, so it must only depend on the rows it is given.
+
+        Args:
+            df (pd.DataFrame): The parsed CSV data, which must not be modified.
+
+        Returns:
+            pd.DataFrame: The processed data.
+        """
+        return df
+
+    def _projected(self, read_options: dict) -> dict:
+        """
+        Adds the column selection to the read options, unless all columns are selected,
+        the read options already select columns or the columns are selected after parsing.
+
+        Args:
+            read_options (dict): The options passed to pandas.read_csv.
+
+        Returns:
+            dict: The read options with the column selection.
+        """
+        if self.columns is None or "usecols" in read_options:
+            return read_options
+        if self._handles_bad_lines(read_options):
+            return read_options
+        return {**read_options, "usecols": self._column_selection()}
+
+    def _selected(self, df: pd.DataFrame, read_options: dict) -> pd.DataFrame:
+        """
+        Selects the columns of a table that was parsed without column selection because it
+        handles bad lines.
+
+        Args:
+            df (pd.DataFrame): The parsed CSV data or a chunk of it, which is not modified.
+            read_options (dict): The options df was parsed with.
+
+        Returns:
+            pd.DataFrame: The selected columns of df.
+        """
+        if self.columns is None or "usecols" in read_options:
+            return df
+        selection = self._column_selection()
+        return df[[column for column in df.columns if column in selection]]
+
+    def _handles_bad_lines(self, read_options: dict) -> bool:
+        """
+        Returns whether the table handles bad lines, by on_bad_lines or a "line_repair" rule.
+
+        pandas.read_csv does not detect lines with too many fields if usecols is set, it
+        keeps them with shifted fields instead of raising, skipping or repairing them. So
+        these tables are parsed completely and their columns are selected afterwards.
+
+        Args:
+            read_options (dict): The options passed to pandas.read_csv.
+
+        Returns:
+            bool: Whether the table handles bad lines.
+        """
+        return "on_bad_lines" in read_options or "line_repair" in self._configuration
+
+    def _column_selection(self) -> ColumnSelection:
+        return ColumnSelection(self.columns | self.required_columns())
+
+    def _read_csv(self, **read_options) -> pd.DataFrame:
+        """
+        Parse the CSV file, reusing the parsed file of the source cache if available.
+
+        The returned DataFrame may be shared with other strategies and must not be modified.
+
+        Args:
+            **read_options: The options passed to pandas.read_csv.
+
+        Returns:
+            pd.DataFrame: The parsed CSV file.
+        """
+        if self.source_cache is None:
+            with self._csv_source(read_options) as source:
+                return pd.read_csv(source, **read_options)
+
+        key = tuple(
+            sorted(
+                (name, getattr(value, "__qualname__", None) or repr(value))
+                for name, value in read_options.items()
+            )
+        ) + (("line_repair", repr(self._configuration.get("line_repair"))),)
+        df = self.source_cache.get(self._file_path, key)
+        if df is None:
+            with self._csv_source(read_options) as source:
+                df = pd.read_csv(source, **read_options)
+            self.source_cache.put(self._file_path, key, df)
         else:
-            return pd.read_csv(self._file_path, **self._configuration["csv"])
+            logging.debug(f"Reusing parsed file {self._file_path}")
+        return df
+
+    @contextlib.contextmanager
+    def _csv_source(self, read_options: dict):
+        """
+        Opens the CSV file for pandas.read_csv, repairing bad lines if the table configuration
+        has a "line_repair" rule.
+
+        Args:
+            read_options (dict): The options passed to pandas.read_csv.
+
+        Yields:
+            str | io.BufferedReader: The path of the file or the repaired stream.
+        """
+        rule = self._configuration.get("line_repair")
+        if rule is None:
+            yield self._file_path
+            return
+        delimiter = read_options.get("delimiter") or read_options.get("sep") or ","
+        stream = open_repaired(self._file_path, rule, delimiter)
+        try:
+            yield stream
+        finally:
+            stream.close()
 
     def load_json(self) -> pd.DataFrame:
         """
@@ -88,15 +252,16 @@ class BaseDataLoadStrategy(IDataLoadStrategy):
         """
         Load data from a file and perform data quality checks.
 
+        A warning is logged if the data contains NaN values. Duplicate rows are logged and
+        dropped, their number is kept in duplicate_rows.
+
         Returns:
             pd.DataFrame: The loaded data as a pandas DataFrame.
 
         Raises:
             ValueError: If the file extension is not supported.
-            ValueError: If the DataFrame contains NaN values.
             ValueError: If the data type is not set for every attribute.
             ValueError: If the DataFrame is empty.
-            ValueError: If the DataFrame contains duplicate rows.
         """
         file_extension = pathlib.Path(self._file_path).suffix.lower()
         if file_extension == ".csv":
@@ -110,22 +275,205 @@ class BaseDataLoadStrategy(IDataLoadStrategy):
         if df.isnull().values.any():
             logging.warning("DataFrame contains NaN values")
 
-        # Check if data type is set for every attribute
-        if df.dtypes.isnull().any():
-            df.fillna(value="none", inplace=True)
+        # Convert the columns to compact types, missing values stay NaN
+        df = apply_dtype_profile(df, self._configuration.get("dtype_profile"))
 
         # Check for data completeness
         if df.empty:
             raise ValueError("DataFrame is empty")
 
         # Check for data integrity
-        if df.duplicated().any():
-            logging.warning("DataFrame contains duplicate rows. Dropping duplicates...")
-            # Remove duplicate rows in-place
-            df.drop_duplicates(inplace=True)
+        duplicated = _duplicated_rows(df)
+        self.duplicate_rows = int(duplicated.sum())
+        if self.duplicate_rows:
+            logging.warning(
+                f"DataFrame contains {self.duplicate_rows} duplicate rows. Dropping duplicates...",
+            )
+            # Remove duplicate rows, the loaded frame may be shared through the source cache
+            df = df[~duplicated]
 
         return df
 
+    def iter_chunks(self, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """
+        Load a CSV file chunk-wise and perform the data quality checks of load() on the chunks.
+
+        Duplicate rows within a chunk are dropped like in load(). Across chunks, they are
+        dropped by their 64-bit row hash alone, as the rows of previous chunks are not kept.
+        The hashes of the distinct rows read so far are kept in a FingerprintSet, so the
+        memory of the duplicate detection grows by 8 bytes per distinct row.
+
+        Args:
+            chunk_size (int): The number of CSV rows parsed per chunk.
+
+        Yields:
+            pd.DataFrame: The processed chunks, without empty chunks.
+
+        Raises:
+            ValueError: If the file is not a CSV file.
+            ValueError: If the file contains no rows.
+        """
+        file_extension = pathlib.Path(self._file_path).suffix.lower()
+        if file_extension != ".csv":
+            raise ValueError(f"Chunk-wise loading is not supported for {file_extension} files")
+
+        read_options = self._projected(self.read_options())
+        # Integer columns of the sample, typed like the first chunk that needs a wider type
+        widened = None
+        if "dtype" not in read_options:
+            read_options["dtype"], integer_columns = self._sample_dtypes(chunk_size, read_options)
+            widened = dict.fromkeys(integer_columns)
+
+        dtype_profile = self._configuration.get("dtype_profile")
+        seen_rows = FingerprintSet()
+        rows = 0
+        self.duplicate_rows = 0
+        nan_warned = False
+        with self._csv_source(read_options) as source, pd.read_csv(
+            source,
+            chunksize=chunk_size,
+            **read_options,
+        ) as reader:
+            for chunk in reader:
+                if widened:
+                    chunk = self._widened(chunk, widened)
+                chunk = self.postprocess(self._selected(chunk, read_options))
+                if isinstance(dtype_profile, dict):
+                    # Profiles are only inferred for whole tables, the chunks would differ
+                    chunk = apply_dtype_profile(chunk, dtype_profile)
+
+                if not nan_warned and chunk.isnull().values.any():
+                    logging.warning("DataFrame contains NaN values")
+                    nan_warned = True
+
+                row_hashes = row_fingerprints(chunk)
+                duplicated = (
+                    _duplicated_rows(chunk, row_hashes)
+                    | seen_rows.contains(row_hashes.to_numpy())
+                )
+                if duplicated.any():
+                    if not self.duplicate_rows:
+                        logging.warning("DataFrame contains duplicate rows. Dropping duplicates...")
+                    self.duplicate_rows += int(duplicated.sum())
+                    chunk = chunk[~duplicated]
+                seen_rows.add(row_hashes.to_numpy()[~duplicated])
+
+                rows += len(chunk)
+                if len(chunk):
+                    yield chunk
+
+        if self.duplicate_rows:
+            logging.warning(f"Dropped {self.duplicate_rows} duplicate rows")
+        if rows == 0:
+            raise ValueError("DataFrame is empty")
+
+    def _sample_dtypes(self, chunk_size: int, read_options: dict) -> tuple[dict, list[str]]:
+        """
+        Infer the column types of a chunk-wise parsed file from its first rows.
+
+        pandas infers the types of every chunk separately, e.g. a text column is parsed as
+        numbers in a chunk that contains only digits. Text and float columns of the sample
+        are therefore parsed with this type in every chunk. Integer columns are inferred
+        per chunk and widened by _widened(), as a later chunk may have missing values or
+        text in them.
+
+        Args:
+            chunk_size (int): The number of CSV rows parsed per chunk.
+            read_options (dict): The options passed to pandas.read_csv.
+
+        Returns:
+            tuple[dict, list[str]]: The types of the text and float columns, and the names
+            of the integer columns.
+        """
+        with self._csv_source(read_options) as source:
+            sample = pd.read_csv(
+                source,
+                nrows=max(chunk_size, TYPE_SAMPLE_ROWS),
+                **read_options,
+            )
+        dtypes = {}
+        integer_columns = []
+        for column, dtype in sample.dtypes.items():
+            if dtype.kind == "f":
+                dtypes[column] = "float64"
+            elif dtype.kind == "O":
+                dtypes[column] = str
+            elif dtype.kind in "iu":
+                integer_columns.append(column)
+        return dtypes, integer_columns
+
+    def _widened(self, chunk: pd.DataFrame, widened: dict) -> pd.DataFrame:
+        """
+        Converts the integer columns of the type sample to the widest type they had in a
+        chunk so far: float64 once a chunk has missing values in them, text once a chunk
+        has text in them. The chunks before keep their narrower type.
+
+        Args:
+            chunk (pd.DataFrame): The parsed chunk, which is not modified.
+            widened (dict): The widened type of every integer column, None while the column
+                has integers only. Updated with the types of the chunk.
+
+        Returns:
+            pd.DataFrame: The chunk with widened columns.
+        """
+        converted = {}
+        for column, target in widened.items():
+            if column not in chunk.columns:
+                continue
+            values = chunk[column]
+            kind = values.dtype.kind
+            if kind == "O" and target != str:
+                target = str
+            elif kind == "f" and target is None:
+                target = "float64"
+            if target is None:
+                continue
+            if target != widened[column]:
+                logging.info(
+                    f"Column {column} of {self._file_path} is widened to "
+                    f"{'text' if target is str else target}, set its dtype in the csv "
+                    "configuration to parse the previous chunks alike",
+                )
+                widened[column] = target
+            if target == "float64" and kind != "f":
+                converted[column] = values.astype("float64")
+            elif target is str and kind != "O":
+                converted[column] = values.astype(str).where(values.notna(), values)
+        return chunk.assign(**converted) if converted else chunk
+
+
+def _duplicated_rows(df: pd.DataFrame, fingerprints: pd.Series | None = None) -> np.ndarray:
+    """
+    Marks the rows that are equal to a previous row.
+
+    Rows are compared by their 64-bit hash first. Only the rows whose hash occurs more
+    than once are compared by value, so rows with colliding hashes are not dropped.
+
+    Args:
+        df (pd.DataFrame): The table.
+        fingerprints (pd.Series | None): The row_fingerprints of df, if already computed.
+
+    Returns:
+        np.ndarray: A boolean mask, True for the duplicates.
+    """
+    if fingerprints is None:
+        fingerprints = row_fingerprints(df)
+    candidates = fingerprints.duplicated(keep=False).to_numpy()
+    duplicated = np.zeros(len(df), dtype=bool)
+    if candidates.any():
+        duplicated[candidates] = df[candidates].duplicated().to_numpy()
+    return duplicated
+
+
+class ColumnSelection(frozenset):
+    """
+    Column selection passed as usecols to pandas.read_csv. Selected columns that the file
+    does not have are ignored.
+    """
+
+    def __call__(self, column: str) -> bool:
+        return column in self
+
 
 class Configuration:
     """
@@ -191,6 +539,10 @@ class Loader:
         _strategy (IDataLoadStrategy): The data loading strategy.
         _configuration (dict): The configuration data.
         _data_path (str | os.PathLike): The path to the data file.
+        _source_cache (SourceCache | None): The cache of parsed files passed to the strategy.
+        _table_cache (ColumnarTableCache | None): The on-disk cache of loaded tables.
+        _encoding_cache (EncodingCache | None): The cache of detected encodings.
+        _columns (frozenset[str] | None): The columns that are parsed, None to parse all columns.
 
     Methods:
         load() -> pd.DataFrame: Loads the data using the set strategy.
@@ -201,6 +553,10 @@ class Loader:
         self,
         data_path: str | os.PathLike,
         configuration: dict,
+        source_cache=None,
+        table_cache=None,
+        encoding_cache=None,
+        columns=None,
     ) -> None:
         """
         Initializes the Loader class.
@@ -208,9 +564,18 @@ class Loader:
         Args:
             data_path (str | os.PathLike): The path to the data file.
             configuration (dict): The configuration data.
+            source_cache (SourceCache | None): Shares parsed files between the strategies of a run.
+            table_cache (ColumnarTableCache | None): Caches the loaded table on disk across runs.
+            encoding_cache (EncodingCache | None): Caches detected encodings by file fingerprint.
+            columns (Iterable[str] | None): The columns that are parsed in addition to the
+                columns required by the strategy, None to parse all columns.
         """
         self._data_path: str | os.PathLike = data_path
         self._configuration = Configuration.get_configuration(configuration)
+        self._source_cache = source_cache
+        self._table_cache = table_cache
+        self._encoding_cache = encoding_cache
+        self._columns = frozenset(columns) if columns is not None else None
         self._strategy: IDataLoadStrategy = self.select_strategy()
 
     def load(self) -> pd.DataFrame:
@@ -225,8 +590,43 @@ class Loader:
         """
         if self._strategy is None:
             raise ValueError("Strategy not set")
+        if self._table_cache is not None:
+            return self._table_cache.load(
+                data_path=self._data_path,
+                configuration=self._configuration,
+                strategy_class=type(self._strategy),
+                load=self._strategy.load,
+                columns=self._columns,
+            )
         return self._strategy.load()
 
+    @property
+    def duplicate_rows(self) -> int:
+        """
+        The number of duplicate rows dropped by the last load, 0 if the table was loaded
+        from the table cache.
+        """
+        return getattr(self._strategy, "duplicate_rows", 0)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """
+        Loads the data chunk-wise using the set strategy. The on-disk table cache is not used.
+
+        Args:
+            chunk_size (int): The number of rows parsed per chunk.
+
+        Yields:
+            pd.DataFrame: The loaded chunks.
+
+        Raises:
+            ValueError: If the strategy is not set or does not support chunk-wise loading.
+        """
+        if self._strategy is None:
+            raise ValueError("Strategy not set")
+        if not isinstance(self._strategy, BaseDataLoadStrategy):
+            raise ValueError("Strategy does not support chunk-wise loading")
+        return self._strategy.iter_chunks(chunk_size)
+
     def select_strategy(self) -> IDataLoadStrategy:
         """
         Selects and returns a data loading strategy based on the configuration file.
@@ -252,10 +652,14 @@ class Loader:
         else:
             strategy_class = BaseDataLoadStrategy
 
-        return strategy_class(
+        strategy = strategy_class(
             file_path=self._data_path,
             configuration=self._configuration,
         )
+        strategy.source_cache = self._source_cache
+        strategy.encoding_cache = self._encoding_cache
+        strategy.columns = self._columns
+        return strategy
 
 
 class LoadCaseList(BaseDataLoadStrategy):
@@ -279,28 +683,30 @@ class LoadCaseList(BaseDataLoadStrategy):
             configuration=configuration,
         )
 
-    def load_csv(self) -> pd.DataFrame:
+    def read_options(self) -> dict:
         """
-        Load the CSV file and return it as a pandas DataFrame.
+        Returns the options passed to pandas.read_csv.
 
         Returns:
-            pd.DataFrame: The loaded CSV data as a pandas DataFrame.
+            dict: The read options, repairing bad lines with join_bad_line if the table
+            configuration has no "line_repair" rule.
         """
         encoding: str = self._configuration["csv"]["encoding"]
         delimiter: str = self._configuration["csv"]["delimiter"]
         engine: str = self._configuration["csv"]["engine"]
+        if "line_repair" in self._configuration:
+            # Bad lines are repaired before parsing, any engine can be used
+            return dict(encoding=encoding, delimiter=delimiter, engine=engine)
         assert (
             engine == "python"
         ), "The engine must be set to 'python' for the on_bad_lines parameter to work"
 
-        df: pd.DataFrame = pd.read_csv(
-            filepath_or_buffer=self._file_path,
+        return dict(
             encoding=encoding,
             delimiter=delimiter,
             engine=engine,
             on_bad_lines=self.join_bad_line,
         )
-        return df
 
     def join_bad_line(self, line):
         """
@@ -0,0 +1,515 @@
+from __future__ import annotations
+
+import copy
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Iterator
+
+import numpy as np
+import pandas as pd
+from processor_registry import ProcessorRegistry
+from profiling import PROFILER
+
+"""
+This module compiles the field mappings of a resource mapping into an execution plan.
+
+The plan is built once per mapping. Every leaf of the plan (column reference or
+processor call) is evaluated column-wise over the whole joined table, and the
+resources are then assembled row by row from the evaluated columns.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Marker for keys that are omitted from the assembled resource
+MISSING = object()
+
+_EMPTY_VALUES = ("none", "nan")
+
+# Number of rows passed to a batch processor per call
+BATCH_CHUNK_SIZE = 100_000
+
+
+def _is_processor_reference(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith("$") and value.endswith("$")
+
+
+def _is_column_reference(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith("%") and value.endswith("%")
+
+
+class PlanNode(ABC):
+    """
+    Node of a compiled mapping plan.
+    """
+
+    @abstractmethod
+    def leaves(self) -> Iterator[LeafNode]:
+        """
+        Yields all leaves below (and including) this node.
+        """
+
+    @abstractmethod
+    def build(self, columns: list[list], row: int) -> Any:
+        """
+        Assembles the value of this node for a single row.
+
+        Args:
+            columns (list[list]): The evaluated leaf columns, indexed by leaf slot.
+            row (int): The position of the row in the evaluated table.
+
+        Returns:
+            Any: The assembled value or MISSING if the value is omitted.
+        """
+
+
+class LeafNode(PlanNode):
+    """
+    Node that is evaluated column-wise over the whole table.
+    """
+
+    slot: int = -1
+
+    def leaves(self) -> Iterator[LeafNode]:
+        yield self
+
+    def build(self, columns: list[list], row: int) -> Any:
+        return columns[self.slot][row]
+
+    @abstractmethod
+    def evaluate(self, table: pd.DataFrame) -> list:
+        """
+        Evaluates the leaf for every row of the table.
+
+        Args:
+            table (pd.DataFrame): The joined table.
+
+        Returns:
+            list: One value per row of the table.
+        """
+
+
+class ConstantNode(PlanNode):
+    """
+    A constant value of the mapping, e.g. "status": "final".
+    """
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def leaves(self) -> Iterator[LeafNode]:
+        return iter(())
+
+    def build(self, columns: list[list], row: int) -> Any:
+        return self.value
+
+
+class ColumnNode(LeafNode):
+    """
+    A reference to a column of the joined table.
+
+    Args:
+        column (str): The name of the column.
+        reference (str): The reference as written in the mapping, used for error messages.
+        list_item (bool): Whether the reference is an item of a list. List items are converted
+            to strings and never omitted, field values are omitted if they are "none" or "nan".
+    """
+
+    def __init__(self, column: str, reference: str, list_item: bool = False):
+        self.column = column
+        self.reference = reference
+        self.list_item = list_item
+
+    def evaluate(self, table: pd.DataFrame) -> list:
+        if self.column not in table.columns:
+            if self.list_item:
+                raise KeyError(f"Missing column: {self.reference}")
+            logger.error(f"Invalid field mapping: {self.reference}")
+            raise ValueError(f"Invalid field mapping: {self.reference}")
+        series = table[self.column]
+        if self.list_item:
+            return [str(value) for value in series.tolist()]
+        empty = series.astype(str).str.lower().isin(_EMPTY_VALUES).tolist()
+        return [
+            MISSING if is_empty else value
+            for value, is_empty in zip(series.tolist(), empty)
+        ]
+
+
+class ProcessorNode(LeafNode):
+    """
+    A call of a registered processor with column references as arguments.
+
+    Args:
+        name (str): The name of the processor.
+        processor (Callable): The processor function.
+        arg_columns (list[str]): The columns passed to the processor, in order.
+        omit_empty (bool): Whether "none" and "nan" results are omitted.
+        batch (Callable | None): The batch implementation of the processor, if any.
+        pure (bool): Whether the processor is pure, i.e. returns equal results for equal
+            arguments.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        processor: Callable,
+        arg_columns: list[str],
+        omit_empty: bool,
+        batch: Callable | None = None,
+        pure: bool = False,
+    ):
+        self.name = name
+        self.processor = processor
+        self.arg_columns = arg_columns
+        self.omit_empty = omit_empty
+        self.batch = batch
+        self.pure = pure
+
+    def evaluate(self, table: pd.DataFrame) -> list:
+        results = self.call(table)
+        if self.omit_empty:
+            return [
+                MISSING if (isinstance(result, str) and result in _EMPTY_VALUES) else result
+                for result in results
+            ]
+        return results
+
+    def call(self, table: pd.DataFrame) -> list:
+        """
+        Calls the processor for every row of the table.
+
+        The batch implementation is called once per chunk of BATCH_CHUNK_SIZE rows if the
+        processor has one. A pure processor is called once per distinct combination of
+        arguments, the scalar processor is called once per row otherwise.
+
+        Args:
+            table (pd.DataFrame): The joined table.
+
+        Returns:
+            list: The processor results, one per row.
+        """
+        if self.batch is not None and self.arg_columns:
+            return self.call_batch(table)
+        if self.pure and self.arg_columns and len(table):
+            return self.call_distinct(table)
+        if self.arg_columns:
+            rows = zip(*(table[column].tolist() for column in self.arg_columns))
+        else:
+            rows = (() for _ in range(len(table)))
+        if not PROFILER.enabled:
+            return [self.processor(*row_args) for row_args in rows]
+
+        results = []
+        latencies = []
+        for row_args in rows:
+            start = time.perf_counter()
+            results.append(self.processor(*row_args))
+            latencies.append(time.perf_counter() - start)
+        PROFILER.record_many("processor", self.name, latencies)
+        return results
+
+    def call_distinct(self, table: pd.DataFrame) -> list:
+        """
+        Calls the pure processor once per distinct combination of arguments and maps the
+        results back to the rows.
+
+        The argument columns are factorized and their codes combined. Rows with a missing
+        argument (None, NaN, NA) are passed to the processor one by one, as they would be
+        merged by the factorization although the processor can tell them apart.
+
+        Args:
+            table (pd.DataFrame): The joined table.
+
+        Returns:
+            list: The processor results, one per row.
+        """
+        rows = len(table)
+        combined = np.zeros(rows, dtype=np.int64)
+        valid = np.ones(rows, dtype=bool)
+        factorized = []
+        for column in self.arg_columns:
+            codes, uniques = pd.factorize(table[column])
+            factorized.append((codes, uniques.tolist()))
+            valid &= codes >= 0
+            # Re-factorizing keeps the combined codes below the number of rows
+            combined, _ = pd.factorize(combined * (len(uniques) + 1) + codes + 1)
+
+        valid_rows = np.flatnonzero(valid)
+        distinct, first = np.unique(combined[valid_rows], return_index=True)
+        distinct_args = [
+            tuple(uniques[codes[row]] for codes, uniques in factorized)
+            for row in valid_rows[first].tolist()
+        ]
+        if PROFILER.enabled:
+            distinct_results = []
+            latencies = []
+            for args in distinct_args:
+                start = time.perf_counter()
+                distinct_results.append(self.processor(*args))
+                latencies.append(time.perf_counter() - start)
+            PROFILER.record_many("processor", self.name, latencies)
+        else:
+            distinct_results = [self.processor(*args) for args in distinct_args]
+
+        results = [None] * rows
+        positions = np.searchsorted(distinct, combined[valid_rows]).tolist()
+        for row, position in zip(valid_rows.tolist(), positions):
+            result = distinct_results[position]
+            # Every row gets its own copy of a mutable result
+            results[row] = copy.deepcopy(result) if isinstance(result, (dict, list)) else result
+        missing_rows = np.flatnonzero(~valid).tolist()
+        if missing_rows:
+            columns = [table[column].tolist() for column in self.arg_columns]
+            for row in missing_rows:
+                results[row] = self.processor(*(column[row] for column in columns))
+        return results
+
+    def call_batch(self, table: pd.DataFrame) -> list:
+        """
+        Calls the batch implementation of the processor chunk-wise.
+
+        Args:
+            table (pd.DataFrame): The joined table.
+
+        Returns:
+            list: The processor results, one per row.
+
+        Raises:
+            ValueError: If the batch implementation does not return one result per row.
+        """
+        # Batch processors get text columns as object columns, also if they are categorical
+        columns = [
+            table[column].astype(object)
+            if isinstance(table[column].dtype, pd.CategoricalDtype) else table[column]
+            for column in self.arg_columns
+        ]
+        results = []
+        for start in range(0, len(table), BATCH_CHUNK_SIZE):
+            chunk = [column.iloc[start:start + BATCH_CHUNK_SIZE] for column in columns]
+            with PROFILER.stage(self.name, category="processor"):
+                chunk_results = self.batch(*chunk)
+            if len(chunk_results) != len(chunk[0]):
+                raise ValueError(
+                    f"Batch processor {self.name} returned {len(chunk_results)} results "
+                    f"for {len(chunk[0])} rows",
+                )
+            results.extend(chunk_results.tolist())
+        return results
+
+
+class NestedProcessorNode(PlanNode):
+    """
+    A processor call that is nested in a list, e.g. "coding": [["%a%", "$p$"]].
+    """
+
+    def __init__(self, key: str, node: ProcessorNode):
+        self.key = key
+        self.node = node
+
+    def leaves(self) -> Iterator[LeafNode]:
+        yield self.node
+
+    def build(self, columns: list[list], row: int) -> Any:
+        value = self.node.build(columns, row)
+        if value is MISSING:
+            raise KeyError(self.key)
+        return value
+
+
+class DictNode(PlanNode):
+    """
+    A JSON object of the mapping.
+    """
+
+    def __init__(self, items: list[tuple[str, PlanNode]]):
+        self.items = items
+
+    def leaves(self) -> Iterator[LeafNode]:
+        for _, node in self.items:
+            yield from node.leaves()
+
+    def build(self, columns: list[list], row: int) -> dict:
+        result = {}
+        for key, node in self.items:
+            value = node.build(columns, row)
+            if value is not MISSING:
+                result[key] = value
+        return result
+
+
+class ListNode(PlanNode):
+    """
+    A JSON array of the mapping.
+    """
+
+    def __init__(self, items: list[PlanNode]):
+        self.items = items
+
+    def leaves(self) -> Iterator[LeafNode]:
+        for node in self.items:
+            yield from node.leaves()
+
+    def build(self, columns: list[list], row: int) -> list:
+        return [node.build(columns, row) for node in self.items]
+
+
+class MappingPlan:
+    """
+    Execution plan of the field mappings of a resource mapping.
+
+    Args:
+        root (DictNode): The root node of the plan.
+    """
+
+    def __init__(self, root: DictNode):
+        self.root = root
+        self.leaves: list[LeafNode] = list(root.leaves())
+        for slot, leaf in enumerate(self.leaves):
+            leaf.slot = slot
+
+    @classmethod
+    def compile(
+        cls,
+        fields: dict,
+        processor_registry: ProcessorRegistry,
+    ) -> MappingPlan:
+        """
+        Compiles the field mappings into an execution plan.
+
+        Args:
+            fields (dict): The "fields" of the resource mapping.
+            processor_registry (ProcessorRegistry): The registry holding the processors.
+
+        Returns:
+            MappingPlan: The compiled plan.
+
+        Raises:
+            ValueError: If the field mapping is invalid or references an unknown processor.
+        """
+        return cls(_PlanCompiler(processor_registry).compile_dict(fields))
+
+    def evaluate(self, table: pd.DataFrame) -> list[list]:
+        """
+        Evaluates all leaves of the plan column-wise.
+
+        Args:
+            table (pd.DataFrame): The joined table.
+
+        Returns:
+            list[list]: The evaluated leaf columns, indexed by leaf slot.
+        """
+        return [leaf.evaluate(table) for leaf in self.leaves]
+
+    def iter_resources(self, table: pd.DataFrame) -> Iterator[dict]:
+        """
+        Assembles one resource dictionary per row of the table.
+
+        Args:
+            table (pd.DataFrame): The joined table.
+
+        Yields:
+            dict: The assembled resource dictionary.
+        """
+        with PROFILER.stage("evaluate"):
+            columns = self.evaluate(table)
+        build = self.root.build
+        if not PROFILER.enabled:
+            for row in range(len(table)):
+                yield build(columns, row)
+            return
+
+        latencies = []
+        try:
+            for row in range(len(table)):
+                start = time.perf_counter()
+                resource = build(columns, row)
+                latencies.append(time.perf_counter() - start)
+                yield resource
+        finally:
+            PROFILER.record_many("stage", "assemble", latencies)
+
+
+class _PlanCompiler:
+    """
+    Translates the field mappings into plan nodes.
+
+    Strings are processor references ("$name$"), column references ("%column%") or
+    constants ("none" omits the key). Lists are processor calls if they contain a
+    processor reference (the other items are the argument columns), otherwise lists of
+    dicts, nested lists and columns, whose values are converted to strings.
+    """
+
+    def __init__(self, processor_registry: ProcessorRegistry):
+        self.processor_registry = processor_registry
+        self.processors = processor_registry.get_processors()
+
+    def compile_dict(self, mapping: dict) -> DictNode:
+        items = []
+        for key, val in mapping.items():
+            if isinstance(val, dict):
+                items.append((key, self.compile_dict(val)))
+            elif isinstance(val, list):
+                items.append((key, self.compile_list(key, val)))
+            elif isinstance(val, str):
+                node = self.compile_string(val)
+                if node is not None:
+                    items.append((key, node))
+            else:
+                raise ValueError(f"Invalid field mapping: {val}")
+        return DictNode(items)
+
+    def compile_string(self, val: str) -> PlanNode | None:
+        if _is_processor_reference(val):
+            return self.processor_node([val.strip("$")], omit_empty=False)
+        if not val.startswith("%") and not val.endswith("%"):
+            return ConstantNode(val) if val.lower() != "none" else None
+        if _is_column_reference(val):
+            return ColumnNode(val.strip("%"), val)
+        logger.error(f"Invalid field mapping: {val}")
+        raise ValueError(f"Invalid field mapping: {val}")
+
+    def compile_list(self, key: str, val: list) -> PlanNode:
+        if self.contains_processor_reference(val):
+            return self.processor_node(val, omit_empty=True)
+        items = []
+        for item in val:
+            if isinstance(item, dict):
+                items.append(self.compile_dict(item))
+            elif isinstance(item, list):
+                node = self.compile_list(key, item)
+                if isinstance(node, ProcessorNode):
+                    node = NestedProcessorNode(key, node)
+                items.append(node)
+            else:
+                items.append(ColumnNode(item.strip("%"), item, list_item=True))
+        return ListNode(items)
+
+    def contains_processor_reference(self, val: list) -> bool:
+        for item in val:
+            if _is_processor_reference(item):
+                if item.strip("$") in self.processors:
+                    return True
+                raise ValueError(f"Invalid processor reference: {item}")
+        return False
+
+    def processor_node(self, val: list, omit_empty: bool) -> ProcessorNode:
+        for item in val:
+            if isinstance(item, str) and item.strip("$") in self.processors:
+                name = item.strip("$")
+                arg_names = [i for i in val if i != item]
+                break
+        else:
+            raise ValueError("No processor reference found in list")
+        for arg in arg_names:
+            if not _is_column_reference(arg):
+                logger.error(f"Invalid argument: {arg}")
+                raise ValueError(f"Invalid argument: {arg}")
+        return ProcessorNode(
+            name=name,
+            processor=self.processors[name],
+            arg_columns=[arg.strip("%") for arg in arg_names],
+            omit_empty=omit_empty,
+            batch=self.processor_registry.get_batch_processor(name),
+            pure=self.processor_registry.is_pure(name),
+        )
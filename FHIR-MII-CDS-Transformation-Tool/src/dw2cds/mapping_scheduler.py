@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import logging
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable
+
+"""
+This module schedules the resource mappings of a run.
+
+The mappings form a graph whose edges are the tables they share. Mappings do not depend
+on the output of each other, so every order is valid. The scheduler orders the mappings
+so that the loaded tables are reused by the following mappings and can be evicted soon:
+it repeatedly picks the mapping that loads the fewest new bytes minus the bytes of the
+tables it uses for the last time.
+
+Mappings are transformed by a pool of worker threads in this order. A mapping is only
+started if the tables of the running mappings, the tables kept for later mappings and
+its own tables fit into the memory budget. If nothing is running, the next mapping is
+started even if it exceeds the budget.
+
+The threads share the loaded tables, the uploaders and the state store of the run. They
+only overlap where the GIL is released, i.e. while files are read and written and while
+uploads wait for the FHIR server. The evaluation of the mappings runs on one CPU at a
+time; parallel_transform transforms the shards of a table in worker processes instead.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class MappingScheduler:
+    """
+    Orders the resource mappings of a run and transforms them concurrently.
+
+    Args:
+        mappings (list[dict]): The resource mappings of the run.
+        table_sizes (dict[str, int]): The estimated size of every table in memory, in bytes.
+        memory_budget (int): The maximum size of the loaded tables in bytes, 0 for no limit.
+    """
+
+    def __init__(
+        self,
+        mappings: list[dict],
+        table_sizes: dict[str, int],
+        memory_budget: int = 0,
+    ):
+        self.tables = [frozenset(mapping.get("usedTables") or []) for mapping in mappings]
+        self.table_sizes = table_sizes
+        self.memory_budget = memory_budget
+
+    def shared_tables(self) -> dict[str, list[int]]:
+        """
+        Returns the edges of the mapping graph.
+
+        Returns:
+            dict[str, list[int]]: The indices of the mappings using every table that is
+            used by more than one mapping.
+        """
+        users: dict[str, list[int]] = {}
+        for index, tables in enumerate(self.tables):
+            for table in sorted(tables):
+                users.setdefault(table, []).append(index)
+        return {table: indices for table, indices in users.items() if len(indices) > 1}
+
+    def order(self, indices: list[int] | None = None) -> list[int]:
+        """
+        Orders mappings so that the loaded tables are reused and evicted early.
+
+        Args:
+            indices (list[int] | None): The indices of the mappings to order, all mappings
+                if None. Ties are broken by this order.
+
+        Returns:
+            list[int]: The mapping indices in scheduled order.
+        """
+        pending = list(range(len(self.tables)) if indices is None else indices)
+        remaining = Counter(table for index in pending for table in self.tables[index])
+        loaded: set[str] = set()
+        order = []
+
+        def cost(index: int) -> int:
+            tables = self.tables[index]
+            new = sum(self._size(table) for table in tables - loaded)
+            freed = sum(self._size(table) for table in tables if remaining[table] == 1)
+            return new - freed
+
+        while pending:
+            index = min(pending, key=cost)
+            pending.remove(index)
+            order.append(index)
+            loaded |= self.tables[index]
+            remaining.subtract(self.tables[index])
+            loaded = {table for table in loaded if remaining[table] > 0}
+        return order
+
+    def run(
+        self,
+        indices: list[int],
+        transform: Callable[[int], Any],
+        finish: Callable[[int, Any], None],
+        workers: int,
+        loaded_tables: Callable[[], dict[str, int]] | None = None,
+    ) -> None:
+        """
+        Transforms mappings in worker threads, in scheduled order and within the budget.
+
+        Args:
+            indices (list[int]): The indices of the mappings in scheduled order.
+            transform (Callable[[int], Any]): Transforms a mapping, runs in a worker thread.
+            finish (Callable[[int, Any], None]): Called with the index and the result of
+                every transformed mapping, in the calling thread and in completion order.
+            workers (int): The maximum number of concurrently transformed mappings.
+            loaded_tables (Callable[[], dict[str, int]] | None): Returns the size of every
+                loaded table in bytes, which replaces its estimated size.
+        """
+        pending = list(indices)
+        running: dict[Future, int] = {}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mapping") as executor:
+            try:
+                while pending or running:
+                    loaded = loaded_tables() if loaded_tables is not None else {}
+                    for index in list(pending):
+                        if len(running) >= workers:
+                            break
+                        if not self._fits(index, running.values(), loaded):
+                            if running:
+                                continue
+                            logger.warning(
+                                f"The tables of mapping {index} exceed the memory budget",
+                            )
+                        pending.remove(index)
+                        running[executor.submit(transform, index)] = index
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(running.pop(future), future.result())
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+
+    def _fits(self, index: int, running, loaded: dict[str, int]) -> bool:
+        if self.memory_budget <= 0:
+            return True
+        tables = set(loaded).union(self.tables[index], *(self.tables[i] for i in running))
+        projected = sum(loaded.get(table, self._size(table)) for table in tables)
+        return projected <= self.memory_budget
+
+    def _size(self, table: str) -> int:
+        return self.table_sizes.get(table, 0)
@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+from multiprocessing.util import Finalize
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import pandas as pd
+import transformer
+from fhir_api.async_uploader import AsyncUploadPipeline
+from fhir_api.bundle_uploader import BundleUploader
+from fhir_api.fhir_client import ndjson_path
+from fhir_api.ndjson_writer import NDJSONWriterPool
+from processor_registry import DEFAULT_CACHE_SIZE, ProcessorRegistry, shared_registry
+from profiling import PROFILER
+from tqdm import tqdm
+from validation import ValidationSettings
+
+"""
+This module transforms joined tables in a pool of worker processes.
+
+The joined table is split into contiguous row chunks (shards). Every worker loads the
+processors and creates its uploader once and transforms the shards it receives with
+them. The uploads of a shard are finished before the shard is reported as done. The
+resources of a shard are written to a separate NDJSON file, the shard files are merged
+into the NDJSON file of the resource type in shard order when the table is done.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Tables with fewer rows are transformed in the main process
+SHARD_MIN_ROWS = 1_000
+
+# Number of shards per worker, more shards balance the load between the workers
+SHARDS_PER_WORKER = 4
+
+# Processor registry, upload settings and uploaders of the worker process, set by _init_worker
+_processor_registry: ProcessorRegistry | None = None
+_upload_settings: UploadSettings | None = None
+_uploader: BundleUploader | None = None
+_pipeline: AsyncUploadPipeline | None = None
+
+
+@dataclass
+class UploadSettings:
+    """
+    Upload configuration passed to the worker processes.
+
+    Attributes:
+        fhir_base_url (str): The base URL of the FHIR server.
+        bundle_size (int): Number of resources per bundle, 0 uploads every resource separately.
+        bundle_type (str): "transaction" or "batch".
+        bundle_flush_interval (float): Maximum number of seconds a resource is buffered.
+        upload_workers (int): Number of concurrent uploads per worker, 0 uploads synchronously.
+        upload_queue_size (int): Maximum number of resources waiting for a concurrent upload.
+    """
+    fhir_base_url: str
+    bundle_size: int = 0
+    bundle_type: str = "transaction"
+    bundle_flush_interval: float = 30.0
+    upload_workers: int = 0
+    upload_queue_size: int = 1000
+
+    def create_uploaders(self) -> tuple[BundleUploader | None, AsyncUploadPipeline | None]:
+        """
+        Creates the uploader of a worker process.
+
+        Returns:
+            tuple[BundleUploader | None, AsyncUploadPipeline | None]: The bundle uploader and
+            the upload pipeline, at most one of them is set.
+        """
+        if self.upload_workers > 0:
+            return None, AsyncUploadPipeline(
+                base_url=self.fhir_base_url,
+                workers=self.upload_workers,
+                queue_size=self.upload_queue_size,
+                bundle_size=max(1, self.bundle_size),
+                bundle_type=self.bundle_type,
+            )
+        if self.bundle_size > 0:
+            return BundleUploader(
+                base_url=self.fhir_base_url,
+                bundle_type=self.bundle_type,
+                bundle_size=self.bundle_size,
+                flush_interval=self.bundle_flush_interval,
+            ), None
+        return None, None
+
+
+@dataclass
+class ShardResult:
+    """
+    Result of a transformed shard.
+
+    Attributes:
+        index (int): The position of the shard in the table.
+        rows (int): The number of transformed rows.
+        succeeded (int): The number of uploaded resources.
+        failed (int): The number of resources that failed to upload.
+        mismatches (int): The number of validated resources that differ from their
+            assembled form.
+        profile (dict | None): The profiler snapshot of the shard, if profiling is enabled.
+    """
+    index: int
+    rows: int
+    succeeded: int = 0
+    failed: int = 0
+    mismatches: int = 0
+    profile: dict | None = None
+
+
+def shard_path(resource_type: str, index: int) -> str:
+    """
+    Returns the path of the NDJSON file of a shard.
+
+    Args:
+        resource_type (str): The resource type of the shard.
+        index (int): The position of the shard in the table.
+
+    Returns:
+        str: The path of the shard file.
+    """
+    base, extension = os.path.splitext(ndjson_path(resource_type))
+    return f"{base}.part-{index:05d}{extension}"
+
+
+def _init_worker(
+    processor_paths: list[str | os.PathLike],
+    pure_processors: tuple[str, ...],
+    processor_cache_size: int,
+    upload_settings: UploadSettings,
+) -> None:
+    global _processor_registry, _upload_settings, _uploader, _pipeline
+    # Forked workers inherit the registry loaded by the main process
+    _processor_registry = shared_registry(
+        processor_paths,
+        pure_processors=pure_processors,
+        cache_size=processor_cache_size,
+    )
+    _upload_settings = upload_settings
+    _uploader, _pipeline = upload_settings.create_uploaders()
+    # Worker processes do not run atexit handlers, but the finalizers of multiprocessing
+    Finalize(None, _close_uploaders, exitpriority=10)
+
+
+def _close_uploaders() -> None:
+    for upload in (_uploader, _pipeline):
+        if upload is not None:
+            upload.close()
+
+
+def _upload_counts() -> tuple[int, int]:
+    upload = _uploader or _pipeline
+    if upload is None:
+        return 0, 0
+    return upload.succeeded, upload.failed
+
+
+def _transform_shard(
+    index: int,
+    shard: pd.DataFrame,
+    mapping: dict,
+    output_data_folder_path: str,
+    validation: ValidationSettings,
+    profile: bool,
+) -> ShardResult:
+    PROFILER.enabled = profile
+    resource_type = mapping.get("resourceType")
+    ndjson_file = shard_path(resource_type, index)
+    if os.path.exists(ndjson_file):
+        os.remove(ndjson_file)
+
+    succeeded, failed = _upload_counts()
+    try:
+        with NDJSONWriterPool() as writer:
+            shard_transformer = transformer.FHIRTransformer(
+                field_mappings=mapping,
+                processor_paths=[],
+                output_data_folder_path=output_data_folder_path,
+                uploader=_uploader,
+                pipeline=_pipeline,
+                processor_registry=_processor_registry,
+                ndjson_file=ndjson_file,
+                writer=writer,
+                validation=validation,
+            )
+            shard_transformer.transform_table(
+                shard,
+                resource_type,
+                _upload_settings.fhir_base_url,
+                progress=False,
+            )
+    except BaseException:
+        # The shard is not merged, its partially written file is removed
+        if os.path.exists(ndjson_file):
+            os.remove(ndjson_file)
+        raise
+    finally:
+        # The uploaders are kept for the next shard, but the uploads of this shard are done
+        if _uploader is not None:
+            _uploader.flush()
+        if _pipeline is not None:
+            _pipeline.join()
+
+    result = ShardResult(
+        index=index,
+        rows=len(shard),
+        mismatches=shard_transformer.sampler.mismatches,
+    )
+    result.succeeded, result.failed = _upload_counts()
+    result.succeeded -= succeeded
+    result.failed -= failed
+    if profile:
+        result.profile = PROFILER.snapshot()
+        PROFILER.reset()
+    return result
+
+
+class ParallelTransformer:
+    """
+    Transforms joined tables in a pool of worker processes.
+
+    Args:
+        workers (int): The number of worker processes.
+        processor_paths (list[str | os.PathLike]): The paths of the processor modules.
+        output_data_folder_path (str): The output folder passed to the transformers.
+        upload_settings (UploadSettings): The upload configuration of the workers.
+        writer (NDJSONWriterPool): The writer the shard files are merged into.
+        validation (ValidationSettings | None): The validation settings of the workers.
+        pure_processors (tuple[str, ...]): Names of the configured pure processors.
+        processor_cache_size (int): The maximum number of cached results per pure processor
+            of every worker.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        processor_paths: list[str | os.PathLike],
+        output_data_folder_path: str,
+        upload_settings: UploadSettings,
+        writer: NDJSONWriterPool,
+        validation: ValidationSettings | None = None,
+        pure_processors: tuple[str, ...] = (),
+        processor_cache_size: int = DEFAULT_CACHE_SIZE,
+    ):
+        self.workers = workers
+        self.validation = validation or ValidationSettings()
+        self.writer = writer
+        self.output_data_folder_path = output_data_folder_path
+        self.upload_settings = upload_settings
+        self.succeeded = 0
+        self.failed = 0
+        self.mismatches = 0
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(
+                processor_paths,
+                tuple(pure_processors),
+                processor_cache_size,
+                upload_settings,
+            ),
+        )
+        # Forked workers are started by the first task. They are started now, before the
+        # main process starts threads (e.g. of its uploaders), as forking a process with
+        # running threads can deadlock the children on locks held by these threads.
+        self.executor.submit(os.getpid).result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def transform_table(self, table: pd.DataFrame, mapping: dict) -> None:
+        """
+        Transforms a joined table shard-wise in the worker processes and merges the shard
+        files into the NDJSON file of the resource type.
+
+        Args:
+            table (pd.DataFrame): The joined table.
+            mapping (dict): The resource mapping.
+        """
+        resource_type = mapping.get("resourceType")
+        bounds = self._shard_bounds(len(table))
+        futures: list[Future] = [
+            self.executor.submit(
+                _transform_shard,
+                index,
+                table.iloc[start:stop],
+                mapping,
+                self.output_data_folder_path,
+                self.validation,
+                PROFILER.enabled,
+            )
+            for index, (start, stop) in enumerate(bounds)
+        ]
+        try:
+            with tqdm(total=len(table), desc=f"Transforming {resource_type}") as progress:
+                for future in as_completed(futures):
+                    result = future.result()
+                    self.succeeded += result.succeeded
+                    self.failed += result.failed
+                    self.mismatches += result.mismatches
+                    if result.profile is not None:
+                        PROFILER.merge(result.profile)
+                    progress.update(result.rows)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+        self._merge_shards(resource_type, len(bounds))
+
+    def close(self) -> None:
+        """
+        Shuts down the worker processes.
+        """
+        self.executor.shutdown()
+
+    def _shard_bounds(self, rows: int) -> list[tuple[int, int]]:
+        shards = max(1, min(self.workers * SHARDS_PER_WORKER, rows // SHARD_MIN_ROWS))
+        size, remainder = divmod(rows, shards)
+        bounds = []
+        start = 0
+        for index in range(shards):
+            stop = start + size + (1 if index < remainder else 0)
+            bounds.append((start, stop))
+            start = stop
+        return bounds
+
+    def _merge_shards(self, resource_type: str, shards: int) -> None:
+        target = ndjson_path(resource_type)
+        merged = self.writer.handle(target)
+        for index in range(shards):
+            path = shard_path(resource_type, index)
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as shard:
+                shutil.copyfileobj(shard, merged)
+            os.remove(path)
+        logger.debug(f"Merged {shards} shards into {target}")
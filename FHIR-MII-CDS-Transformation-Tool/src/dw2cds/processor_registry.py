@@ -1,19 +1,179 @@
 from __future__ import annotations
 
+import copy
+import functools
 import importlib
 import inspect
 import logging
 import os
 import pathlib
 import sys
-from typing import Callable
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Callable, Mapping
+
+from utils.fingerprint import file_fingerprint, object_fingerprint
 
 """
 This module provides a registry to hold custom data processors.
+
+The processors of a run are discovered once: shared_registry() returns the registry of
+the processor modules loaded before in this process if the modules did not change, and
+the transformers of all mappings share it. Forked worker processes inherit the loaded
+registry, spawned worker processes load it once at their start.
+
+Processor modules need not import this module: a module function batch_<name> is
+registered as the batch implementation of the processor process_<name>, and pure
+processors can be listed in the configuration. The decorators below are an alternative
+for modules that import the registry.
+
+Pure processors, declared with the pure_processor decorator or listed in the
+"pure_processors" of the configuration, return the same result for the same arguments
+and have no side effects. The registry wraps them in a bounded least-recently-used cache
+of their results, and the mapping plan calls them once per distinct combination of
+arguments of a table instead of once per row. Cached dict and list results are copied
+for every caller, so a result is never shared between resources.
 """
 
 logger = logging.getLogger(__name__)
 
+# Registries returned by shared_registry, by the fingerprint of their processor modules
+_SHARED_REGISTRIES: dict[str, ProcessorRegistry] = {}
+# Fingerprint of the modules last loaded from the processor paths
+_SHARED_PATHS: dict[tuple[str, ...], str] = {}
+_SHARED_REGISTRIES_LOCK = threading.Lock()
+
+# Attribute of a scalar processor holding its batch implementation
+BATCH_ATTRIBUTE = "batch"
+
+# Name prefixes of the processors and of their batch implementations in a module
+PROCESSOR_PREFIX = "process_"
+BATCH_PREFIX = "batch_"
+
+# Attribute of a processor marking it as pure
+PURE_ATTRIBUTE = "pure"
+
+# Default maximum number of cached results per pure processor
+DEFAULT_CACHE_SIZE = 65_536
+
+# Cache key of NaN arguments, which are not equal to themselves
+_NAN = object()
+
+
+def batch_processor(scalar_processor: Callable) -> Callable:
+    """
+    Declares the decorated function as the batch implementation of a scalar processor.
+
+    The batch implementation is called once per column chunk with one pandas Series per
+    argument and has to return a pandas Series (or NumPy array) with one result per row,
+    equal to the results of the scalar processor. The scalar processor stays registered
+    and is used as fallback.
+
+    Args:
+        scalar_processor (Callable): The scalar processor the batch implementation belongs to.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorator(batch: Callable) -> Callable:
+        setattr(scalar_processor, BATCH_ATTRIBUTE, batch)
+        return batch
+
+    return decorator
+
+
+def pure_processor(processor: Callable) -> Callable:
+    """
+    Declares the decorated processor as pure, so that its results are cached.
+
+    A pure processor returns equal results for equal arguments and has no side effects
+    (apart from logging). Its batch implementation, if any, is not affected.
+
+    Args:
+        processor (Callable): The processor.
+
+    Returns:
+        Callable: The processor.
+    """
+    setattr(processor, PURE_ATTRIBUTE, True)
+    return processor
+
+
+class MemoizedProcessor:
+    """
+    A pure processor with a bounded least-recently-used cache of its results. It can be
+    called from several threads.
+
+    Arguments are compared by value and type, NaN arguments are equal. Calls with
+    unhashable arguments are not cached.
+
+    Args:
+        processor (Callable): The pure processor.
+        cache_size (int): The maximum number of cached results.
+    """
+
+    def __init__(self, processor: Callable, cache_size: int = DEFAULT_CACHE_SIZE):
+        # Copies the name, the signature and the batch implementation of the processor
+        functools.update_wrapper(self, processor)
+        self.processor = processor
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, *args):
+        key = tuple(_cache_key(arg) for arg in args)
+        try:
+            hash(key)
+        except TypeError:
+            with self._lock:
+                self.uncached += 1
+            return self.processor(*args)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return _copy_result(self._cache[key])
+        result = self.processor(*args)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return _copy_result(result)
+
+    def cache_info(self) -> dict[str, int]:
+        """
+        Returns the statistics of the cache.
+
+        Returns:
+            dict[str, int]: The number of hits, misses and uncached calls, and the number
+            of cached results.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "uncached": self.uncached,
+                "size": len(self._cache),
+            }
+
+
+def _cache_key(value) -> tuple:
+    if isinstance(value, float) and value != value:
+        return (_NAN, float)
+    return (value, type(value))
+
+
+def _copy_result(result):
+    if isinstance(result, (dict, list)):
+        return copy.deepcopy(result)
+    return result
+
 
 class ProcessorRegistry:
     """
@@ -28,49 +188,82 @@ class ProcessorRegistry:
             Retrieves all processors.
         get_processor_args(name: str) -> list[str] or None:
             Retrieves the arguments of a processor by name.
+        get_batch_processor(name: str) -> Callable[..., pd.Series] or None:
+            Retrieves the batch implementation of a processor by name.
+        is_pure(name: str) -> bool:
+            Returns whether a processor is pure.
+        cache_statistics() -> dict[str, dict[str, int]]:
+            Returns the cache statistics of the pure processors.
     """
 
     def __init__(
         self,
         processor_paths: list[str | os.PathLike],
+        reload: bool = False,
+        pure_processors: list[str] | tuple[str, ...] = (),
+        cache_size: int = DEFAULT_CACHE_SIZE,
     ) -> None:
         """
         Initializes the ProcessorRegistry.
 
         Args:
             processor_paths (list[str | os.PathLike]): List of paths to custom processor modules.
+            reload (bool): Whether modules imported before are imported again, e.g. because
+                they changed.
+            pure_processors (list[str] | tuple[str, ...]): Names of processors that are pure,
+                in addition to the processors declared with pure_processor.
+            cache_size (int): The maximum number of cached results per pure processor, 0
+                disables the caches.
         """
         self._processors = {}
+        self._batch_processors: dict[str, Callable] = {}
+        self._arguments: dict[str, list[str]] = {}
+        self.pure_processors = frozenset(pure_processors)
+        self.cache_size = cache_size
         logger.debug(
             f"As processors are defined {processor_paths} of type {type(processor_paths)}",
         )
-        self.load_processors(processor_paths)
+        self.load_processors(processor_paths, reload=reload)
+        unknown = sorted(self.pure_processors.difference(self._processors))
+        if unknown:
+            logger.warning(f"Configured pure processors not found: {', '.join(unknown)}")
 
-    def load_processors(self, paths: list[str | os.PathLike]) -> None:
+    def load_processors(self, paths: list[str | os.PathLike], reload: bool = False) -> None:
         """
         Loads custom processors from the specified paths.
+
+        Args:
+            paths (list[str | os.PathLike]): List of paths to custom processor modules.
+            reload (bool): Whether modules imported before are imported again.
         """
         for path in paths:
             module_path = pathlib.Path(path)
             parent_dir = str(module_path.parent.resolve())
             if parent_dir not in sys.path:
-                print(f"Adding {parent_dir} to sys.path")  # Add debugging print
+                logger.debug(f"Adding {parent_dir} to sys.path")
                 sys.path.insert(0, parent_dir)  # Use insert(0, ...) to prioritize this path
 
             module_name = module_path.stem
             try:
-                print(f"Trying to import module: {module_name}")
-                print(f"Trying to import module from: {module_path}")
-
+                logger.debug(f"Importing processor module {module_name} from {module_path}")
                 module = importlib.import_module(module_name)
+                if reload:
+                    module = importlib.reload(module)
             except ModuleNotFoundError as e:
-                print(f"Error importing module {module_name}: {e}")
+                logger.error(f"Error importing module {module_name}: {e}")
                 continue
 
-            for name, obj in inspect.getmembers(module):
-                if name.startswith("process_"):
+            registered = []
+            members = dict(inspect.getmembers(module))
+            for name, obj in members.items():
+                if name.startswith(PROCESSOR_PREFIX):
                     self.register(name, obj)
-                    print(f"Registered processor: {name}")
+                    registered.append(name)
+                    batch = members.get(BATCH_PREFIX + name[len(PROCESSOR_PREFIX):])
+                    if callable(batch):
+                        self._batch_processors[name] = batch
+            logger.info(f"Registered {len(registered)} processors of {module_path}")
+            logger.debug(f"Registered processors: {', '.join(registered)}")
 
     def register(
         self,
@@ -80,11 +273,17 @@ class ProcessorRegistry:
         """
         Registers a custom processor.
 
+        Pure processors are wrapped in a MemoizedProcessor unless the caches are disabled.
+
         Args:
             name (str): The name of the processor.
             processor (Callable[[str | int | float], str | int | float]): The processor function.
         """
         self._processors[name] = processor
+        self._batch_processors.pop(name, None)
+        if self.cache_size > 0 and self.is_pure(name):
+            self._processors[name] = MemoizedProcessor(processor, self.cache_size)
+        self._arguments.pop(name, None)
 
     def get_processor(
         self,
@@ -103,14 +302,59 @@ class ProcessorRegistry:
 
     def get_processors(
         self,
-    ) -> dict[str, Callable[[str | int | float], str | int | float]]:
+    ) -> Mapping[str, Callable[[str | int | float], str | int | float]]:
         """
         Retrieves all processors.
 
         Returns:
-            dict[str, Callable[[str | int | float], str | int | float]]: The processors.
+            Mapping[str, Callable[[str | int | float], str | int | float]]: A read-only view
+            of the processors.
+        """
+        return MappingProxyType(self._processors)
+
+    def get_batch_processor(self, name: str) -> Callable | None:
+        """
+        Retrieves the batch implementation of a processor by name.
+
+        Args:
+            name (str): The name of the processor.
+
+        Returns:
+            Callable | None: The batch implementation, or None if the processor is scalar only.
+        """
+        batch = self._batch_processors.get(name)
+        if batch is None:
+            batch = getattr(self.get_processor(name), BATCH_ATTRIBUTE, None)
+        return batch
+
+    def is_pure(self, name: str) -> bool:
+        """
+        Returns whether a processor is pure.
+
+        Args:
+            name (str): The name of the processor.
+
+        Returns:
+            bool: Whether the processor is declared or configured as pure.
         """
-        return self._processors
+        return name in self.pure_processors or getattr(
+            self.get_processor(name),
+            PURE_ATTRIBUTE,
+            False,
+        )
+
+    def cache_statistics(self) -> dict[str, dict[str, int]]:
+        """
+        Returns the cache statistics of the pure processors.
+
+        Returns:
+            dict[str, dict[str, int]]: The cache_info() of every memoized processor.
+        """
+        return {
+            name: processor.cache_info()
+            for name, processor in self._processors.items()
+            if isinstance(processor, MemoizedProcessor)
+        }
 
     def get_processor_args(self, name: str) -> list[str] or None:
         """
@@ -123,10 +367,58 @@ class ProcessorRegistry:
             list[str] or None: The arguments of the processor.
         """
         processor = self.get_processor(name)
-        if processor:
+        if processor is None:
+            return None
+        if name not in self._arguments:
             sig = inspect.signature(processor)
-            return [param.name for param in sig.parameters.values()]
-        return None
+            self._arguments[name] = [param.name for param in sig.parameters.values()]
+        return self._arguments[name]
+
+
+def shared_registry(
+    processor_paths: list[str | os.PathLike],
+    pure_processors: list[str] | tuple[str, ...] = (),
+    cache_size: int = DEFAULT_CACHE_SIZE,
+) -> ProcessorRegistry:
+    """
+    Returns the registry of processor modules, loading them only once per process.
+
+    The registry is cached by the paths and the content hashes of the modules and the
+    cache settings, so changed modules are loaded again. The returned registry is shared
+    and must not be modified.
+
+    Args:
+        processor_paths (list[str | os.PathLike]): List of paths to custom processor modules.
+        pure_processors (list[str] | tuple[str, ...]): Names of processors that are pure.
+        cache_size (int): The maximum number of cached results per pure processor.
+
+    Returns:
+        ProcessorRegistry: The registry of the processors.
+    """
+    paths = tuple(str(pathlib.Path(path).resolve()) for path in processor_paths)
+    modules = object_fingerprint(
+        [
+            (path, file_fingerprint(path, content_hash=True) if os.path.isfile(path) else None)
+            for path in paths
+        ],
+    )
+    key = object_fingerprint([modules, sorted(pure_processors), cache_size])
+    with _SHARED_REGISTRIES_LOCK:
+        registry = _SHARED_REGISTRIES.get(key)
+        if registry is None:
+            # The modules changed since they were imported by an earlier registry
+            changed = _SHARED_PATHS.get(paths, modules) != modules
+            registry = ProcessorRegistry(
+                processor_paths,
+                reload=changed,
+                pure_processors=pure_processors,
+                cache_size=cache_size,
+            )
+            _SHARED_REGISTRIES[key] = registry
+            _SHARED_PATHS[paths] = modules
+        else:
+            logger.debug(f"Reusing the loaded processors of {processor_paths}")
+    return registry
 
 
 if __name__ == "__main__":
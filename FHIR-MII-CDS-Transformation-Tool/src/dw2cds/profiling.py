@@ -0,0 +1,439 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+"""
+This module measures where the time of a run goes.
+
+The profiler keeps the call count, the cumulative and the maximum latency and a bounded
+random sample of the latencies (for percentiles) of every pipeline stage and processor,
+and the transformed rows per mapping. Worker processes send their measurements with the
+shard results, which are merged into the profiler of the main process.
+
+Stages:
+- load: reading a table or a chunk of the streamed table
+- join: joining the tables of a mapping
+- evaluate: evaluating the column references and processors of a mapping
+- assemble: building a resource dictionary from the evaluated columns
+- validate: constructing the fhir.resources model
+- serialize: serializing a resource to JSON
+- ndjson: appending a resource to its NDJSON file
+- upload: handing a resource to the FHIR server (with concurrent uploads, the time spent
+  waiting for a free place in the upload queue)
+
+The peak resident set size of a mapping is the highest RSS of the main process sampled
+while the mapping is transformed, including the memory of concurrently transformed
+mappings and excluding worker processes. Without /proc, it is the peak RSS of the
+process since its start.
+
+The profiler is disabled by default. Disabled, stage() returns a shared no-op context
+manager, and neither the processor calls nor the per-row stages (assemble, validate,
+serialize, ndjson, upload) are timed. The per-row latencies of a table are recorded
+at once with record_many.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of latencies kept per stage or processor for the percentiles
+MAX_SAMPLES = 10_000
+
+PERCENTILES = (50, 90, 99)
+
+# Seconds between two samples of the resident set size
+RSS_SAMPLE_INTERVAL = 0.05
+
+_NOT_MEASURED = nullcontext()
+
+
+class _Metric:
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: list[float] = []
+
+    def add(self, seconds: float, rng: random.Random) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            # Reservoir sampling keeps a uniform sample of all latencies
+            index = rng.randrange(self.count)
+            if index < MAX_SAMPLES:
+                self.samples[index] = seconds
+
+
+class _StageTimer:
+    __slots__ = ("profiler", "category", "name", "start")
+
+    def __init__(self, profiler: Profiler, category: str, name: str):
+        self.profiler = profiler
+        self.category = category
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.record(self.category, self.name, time.perf_counter() - self.start)
+
+
+class _MemoryWindow:
+    __slots__ = ("profiler", "peak")
+
+    def __init__(self, profiler: Profiler):
+        self.profiler = profiler
+        self.peak = 0
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self.profiler._open_window(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler._close_window(self)
+        self.peak = max(self.peak, current_rss())
+
+
+class Profiler:
+    """
+    Latencies of the pipeline stages and processors and the throughput of the mappings.
+
+    Args:
+        enabled (bool): Whether measurements are recorded.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self._metrics: dict[str, dict[str, _Metric]] = {}
+        self._mappings: dict[str, dict[str, float]] = {}
+        self._windows: set[_MemoryWindow] = set()
+        self._sampler: threading.Thread | None = None
+
+    def stage(self, name: str, category: str = "stage"):
+        """
+        Returns a context manager measuring a stage.
+
+        Args:
+            name (str): The name of the stage.
+            category (str): The category of the measurement, "stage" or "processor".
+        """
+        if not self.enabled:
+            return _NOT_MEASURED
+        return _StageTimer(self, category, name)
+
+    def memory_window(self):
+        """
+        Returns a context manager sampling the peak resident set size while it is open.
+        The context manager has the peak in bytes as attribute "peak", it is None if the
+        profiler is disabled.
+        """
+        if not self.enabled:
+            return _NOT_MEASURED
+        return _MemoryWindow(self)
+
+    def record(self, category: str, name: str, seconds: float) -> None:
+        """
+        Records the latency of a single call.
+
+        Args:
+            category (str): "stage" or "processor".
+            name (str): The name of the stage or processor.
+            seconds (float): The latency of the call.
+        """
+        with self._lock:
+            metric = self._metrics.setdefault(category, {}).get(name)
+            if metric is None:
+                metric = self._metrics[category][name] = _Metric()
+            metric.add(seconds, self._random)
+
+    def record_many(self, category: str, name: str, latencies: list[float]) -> None:
+        """
+        Records the latencies of several calls at once.
+
+        Args:
+            category (str): "stage" or "processor".
+            name (str): The name of the stage or processor.
+            latencies (list[float]): The latency of every call in seconds.
+        """
+        with self._lock:
+            metric = self._metrics.setdefault(category, {}).get(name)
+            if metric is None:
+                metric = self._metrics[category][name] = _Metric()
+            for seconds in latencies:
+                metric.add(seconds, self._random)
+
+    def record_mapping(
+        self,
+        key: str,
+        rows: int,
+        seconds: float,
+        peak_rss: int = 0,
+    ) -> None:
+        """
+        Records the transformed rows of a mapping.
+
+        Args:
+            key (str): The key of the mapping.
+            rows (int): The number of transformed rows.
+            seconds (float): The time the mapping took.
+            peak_rss (int): The peak resident set size during the mapping in bytes.
+        """
+        with self._lock:
+            mapping = self._mappings.setdefault(
+                key,
+                {"rows": 0, "seconds": 0.0, "peak_rss": 0},
+            )
+            mapping["rows"] += rows
+            mapping["seconds"] += seconds
+            mapping["peak_rss"] = max(mapping.get("peak_rss", 0), peak_rss)
+
+    def snapshot(self) -> dict:
+        """
+        Returns the recorded measurements in a form that can be sent between processes
+        and merged into another profiler.
+        """
+        with self._lock:
+            return {
+                "metrics": {
+                    category: {
+                        name: {
+                            "count": metric.count,
+                            "total": metric.total,
+                            "max": metric.max,
+                            "samples": list(metric.samples),
+                        }
+                        for name, metric in metrics.items()
+                    }
+                    for category, metrics in self._metrics.items()
+                },
+                "mappings": {key: dict(mapping) for key, mapping in self._mappings.items()},
+            }
+
+    def merge(self, snapshot: dict) -> None:
+        """
+        Adds the measurements of a snapshot, e.g. of a worker process.
+
+        Args:
+            snapshot (dict): The snapshot returned by snapshot().
+        """
+        with self._lock:
+            for category, metrics in snapshot.get("metrics", {}).items():
+                for name, other in metrics.items():
+                    metric = self._metrics.setdefault(category, {}).get(name)
+                    if metric is None:
+                        metric = self._metrics[category][name] = _Metric()
+                    metric.count += other["count"]
+                    metric.total += other["total"]
+                    metric.max = max(metric.max, other["max"])
+                    samples = metric.samples + other["samples"]
+                    if len(samples) > MAX_SAMPLES:
+                        samples = self._random.sample(samples, MAX_SAMPLES)
+                    metric.samples = samples
+        for key, mapping in snapshot.get("mappings", {}).items():
+            self.record_mapping(
+                key,
+                mapping["rows"],
+                mapping["seconds"],
+                mapping.get("peak_rss", 0),
+            )
+
+    def reset(self) -> None:
+        """
+        Removes all measurements.
+        """
+        with self._lock:
+            self._metrics.clear()
+            self._mappings.clear()
+
+    def report(self) -> dict:
+        """
+        Summarizes the measurements.
+
+        Returns:
+            dict: Per stage and processor the call count and the total, mean, maximum and
+            percentile latencies in seconds, per mapping the rows, rows per second and
+            peak resident set size.
+        """
+        snapshot = self.snapshot()
+        report = {}
+        for category, metrics in snapshot["metrics"].items():
+            report[f"{category}s"] = {
+                name: _summary(metric) for name, metric in sorted(metrics.items())
+            }
+        report["mappings"] = {
+            key: {
+                "rows": int(mapping["rows"]),
+                "seconds": mapping["seconds"],
+                "rows_per_second": (
+                    mapping["rows"] / mapping["seconds"] if mapping["seconds"] > 0 else None
+                ),
+                "peak_rss_bytes": int(mapping.get("peak_rss", 0)),
+            }
+            for key, mapping in snapshot["mappings"].items()
+        }
+        return report
+
+    def write_json(self, path: str | os.PathLike) -> None:
+        """
+        Writes the report as JSON file.
+
+        Args:
+            path (str | os.PathLike): The path of the report.
+        """
+        _makedirs(path)
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2)
+        logger.info(f"Wrote the profiling report to {path}")
+
+    def write_prometheus(self, path: str | os.PathLike) -> None:
+        """
+        Writes the report in the Prometheus text exposition format, e.g. for the textfile
+        collector of the node exporter.
+
+        Args:
+            path (str | os.PathLike): The path of the text file.
+        """
+        report = self.report()
+        lines = []
+        for category in ("stage", "processor"):
+            metrics = report.get(f"{category}s", {})
+            if not metrics:
+                continue
+            metric_name = f"dw2cds_{category}_seconds"
+            lines.append(f"# HELP {metric_name} Latency of the dw2cds {category} calls.")
+            lines.append(f"# TYPE {metric_name} summary")
+            for name, summary in metrics.items():
+                label = f'{category}="{_escape_label(name)}"'
+                for percentile in PERCENTILES:
+                    lines.append(
+                        f'{metric_name}{{{label},quantile="{percentile / 100}"}} '
+                        f"{summary[f'p{percentile}_seconds']}",
+                    )
+                lines.append(f"{metric_name}_sum{{{label}}} {summary['total_seconds']}")
+                lines.append(f"{metric_name}_count{{{label}}} {summary['count']}")
+        if report["mappings"]:
+            lines.append("# HELP dw2cds_mapping_rows_total Rows transformed per mapping.")
+            lines.append("# TYPE dw2cds_mapping_rows_total counter")
+            for key, mapping in report["mappings"].items():
+                lines.append(
+                    f'dw2cds_mapping_rows_total{{mapping="{_escape_label(key)}"}} '
+                    f"{mapping['rows']}",
+                )
+            lines.append("# HELP dw2cds_mapping_rows_per_second Throughput per mapping.")
+            lines.append("# TYPE dw2cds_mapping_rows_per_second gauge")
+            for key, mapping in report["mappings"].items():
+                if mapping["rows_per_second"] is not None:
+                    lines.append(
+                        f'dw2cds_mapping_rows_per_second{{mapping="{_escape_label(key)}"}} '
+                        f"{mapping['rows_per_second']}",
+                    )
+            lines.append(
+                "# HELP dw2cds_mapping_peak_rss_bytes Peak resident set size per mapping.",
+            )
+            lines.append("# TYPE dw2cds_mapping_peak_rss_bytes gauge")
+            for key, mapping in report["mappings"].items():
+                lines.append(
+                    f'dw2cds_mapping_peak_rss_bytes{{mapping="{_escape_label(key)}"}} '
+                    f"{mapping['peak_rss_bytes']}",
+                )
+        _makedirs(path)
+        # Written atomically, the textfile collector must not read a partial file
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, path)
+        logger.info(f"Wrote the Prometheus metrics to {path}")
+
+    def _open_window(self, window: _MemoryWindow) -> None:
+        with self._lock:
+            self._windows.add(window)
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample_rss,
+                    name="rss-sampler",
+                    daemon=True,
+                )
+                self._sampler.start()
+
+    def _close_window(self, window: _MemoryWindow) -> None:
+        with self._lock:
+            self._windows.discard(window)
+
+    def _sample_rss(self) -> None:
+        while True:
+            rss = current_rss()
+            with self._lock:
+                if not self._windows:
+                    self._sampler = None
+                    return
+                for window in self._windows:
+                    window.peak = max(window.peak, rss)
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+
+def current_rss() -> int:
+    """
+    Returns the resident set size of this process in bytes.
+
+    Returns:
+        int: The current RSS read from /proc, or the peak RSS of the process where /proc
+        is not available, 0 if neither is known.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _summary(metric: dict) -> dict:
+    count = metric["count"]
+    summary = {
+        "count": count,
+        "total_seconds": metric["total"],
+        "mean_seconds": metric["total"] / count if count else 0.0,
+        "max_seconds": metric["max"],
+    }
+    samples = np.asarray(metric["samples"]) if metric["samples"] else np.zeros(1)
+    for percentile, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+        summary[f"p{percentile}_seconds"] = float(value)
+    return summary
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _makedirs(path: str | os.PathLike) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+
+# The profiler of this process, enabled by dw2cds if a report is requested
+PROFILER = Profiler()
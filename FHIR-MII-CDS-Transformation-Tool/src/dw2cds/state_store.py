@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from utils.fingerprint import object_fingerprint, row_fingerprints
+
+"""
+This module records which rows of the joined tables were transformed, for incremental runs.
+
+The state store is a SQLite database holding, for every resource mapping, the fingerprint
+of every transformed row of its joined table and the id of the emitted resource. An
+incremental run transforms only the rows whose fingerprint is not in the store, i.e. new
+and changed rows. Rows of the store that are not in the joined table anymore have
+disappeared, their resources can be deleted unless a current row emits the same id.
+
+Mappings are identified by their resource type and used tables. If a mapping is changed,
+all of its rows are transformed again. Changes of the processor code are not detected,
+a run without --incremental is required after them.
+
+Resources without id are created by POST, so a changed row creates a new resource and
+the resource of a disappeared row cannot be deleted.
+"""
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mappings (
+    mapping TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    resource_type TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rows (
+    mapping TEXT NOT NULL,
+    fingerprint INTEGER NOT NULL,
+    resource_type TEXT NOT NULL,
+    resource_id TEXT,
+    PRIMARY KEY (mapping, fingerprint)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rows_resource ON rows (resource_type, resource_id);
+"""
+
+
+def mapping_key(mapping: dict) -> str:
+    """
+    Returns the key of a resource mapping in the state store.
+
+    Args:
+        mapping (dict): The resource mapping.
+
+    Returns:
+        str: The resource type and the used tables of the mapping.
+    """
+    return f"{mapping.get('resourceType')}:{'+'.join(mapping.get('usedTables') or [])}"
+
+
+class StateStore:
+    """
+    SQLite database of the rows transformed by previous incremental runs. The store can be
+    used by the threads of concurrently transformed mappings.
+
+    Args:
+        path (str | os.PathLike): The path of the database, created if it does not exist.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def begin_mapping(self, mapping: dict) -> MappingState:
+        """
+        Starts the incremental transformation of a resource mapping.
+
+        Args:
+            mapping (dict): The resource mapping.
+
+        Returns:
+            MappingState: The state of the mapping, which selects the rows to transform.
+        """
+        key = mapping_key(mapping)
+        fingerprint = object_fingerprint(mapping)
+        with self.lock:
+            stored = self.connection.execute(
+                "SELECT fingerprint FROM mappings WHERE mapping = ?",
+                (key,),
+            ).fetchone()
+            known = np.empty(0, dtype=np.int64)
+            if stored is None:
+                logger.info(f"No state of mapping {key}, transforming all rows.")
+            elif stored[0] != fingerprint:
+                logger.info(f"Mapping {key} has changed, transforming all rows.")
+            else:
+                known = np.fromiter(
+                    (row[0] for row in self.connection.execute(
+                        "SELECT fingerprint FROM rows WHERE mapping = ?",
+                        (key,),
+                    )),
+                    dtype=np.int64,
+                )
+        return MappingState(self, key, fingerprint, mapping.get("resourceType"), known)
+
+    def close(self) -> None:
+        """
+        Closes the database.
+        """
+        self.connection.close()
+
+
+class MappingState:
+    """
+    State of a resource mapping during an incremental run.
+
+    The joined table of the mapping, or every chunk of it, is passed through changed_rows.
+    The store is updated by commit when the mapping is done.
+
+    Args:
+        store (StateStore): The state store.
+        key (str): The key of the mapping.
+        fingerprint (str): The fingerprint of the mapping configuration.
+        resource_type (str): The resource type of the mapping.
+        known (np.ndarray): The fingerprints of the rows transformed by previous runs.
+    """
+
+    def __init__(
+        self,
+        store: StateStore,
+        key: str,
+        fingerprint: str,
+        resource_type: str,
+        known: np.ndarray,
+    ):
+        self.store = store
+        self.key = key
+        self.fingerprint = fingerprint
+        self.resource_type = resource_type
+        self.known = known
+        self.rows = 0
+        self.changed = 0
+        self._seen: list[np.ndarray] = []
+        self._emitted: dict[int, str | None] = {}
+
+    def changed_rows(
+        self,
+        table: pd.DataFrame,
+        resource_ids: Callable[[pd.DataFrame], list],
+    ) -> pd.DataFrame:
+        """
+        Selects the new and changed rows of a joined table.
+
+        Args:
+            table (pd.DataFrame): The joined table or a chunk of it.
+            resource_ids (Callable[[pd.DataFrame], list]): Returns the id of the resource
+                emitted for every row of a table, None for resources without id.
+
+        Returns:
+            pd.DataFrame: The rows that are not in the store.
+        """
+        fingerprints = row_fingerprints(table).to_numpy().view(np.int64)
+        self._seen.append(fingerprints)
+        changed = ~np.isin(fingerprints, self.known)
+        self.rows += len(table)
+        self.changed += int(changed.sum())
+        table = table[changed]
+        if not table.empty:
+            self._emitted.update(zip(fingerprints[changed].tolist(), resource_ids(table)))
+        return table
+
+    def commit(self) -> list[str]:
+        """
+        Records the rows of this run in the store.
+
+        Returns:
+            list[str]: The ids of the resources of disappeared rows that are not emitted by
+            a current row anymore.
+        """
+        seen = np.unique(np.concatenate(self._seen)) if self._seen else np.empty(0)
+        connection = self.store.connection
+        with self.store.lock, connection:
+            connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS seen (fingerprint INTEGER PRIMARY KEY)",
+            )
+            connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS stale (resource_id TEXT PRIMARY KEY)",
+            )
+            connection.execute("DELETE FROM seen")
+            connection.execute("DELETE FROM stale")
+            connection.executemany(
+                "INSERT INTO seen VALUES (?)",
+                ((fingerprint,) for fingerprint in seen.tolist()),
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO stale SELECT resource_id FROM rows "
+                "WHERE mapping = ? AND resource_id IS NOT NULL "
+                "AND fingerprint NOT IN (SELECT fingerprint FROM seen)",
+                (self.key,),
+            )
+            connection.execute(
+                "DELETE FROM rows WHERE mapping = ? "
+                "AND fingerprint NOT IN (SELECT fingerprint FROM seen)",
+                (self.key,),
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?)",
+                (
+                    (self.key, fingerprint, self.resource_type, resource_id)
+                    for fingerprint, resource_id in self._emitted.items()
+                ),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO mappings VALUES (?, ?, ?)",
+                (self.key, self.fingerprint, self.resource_type),
+            )
+            deleted = [
+                row[0] for row in connection.execute(
+                    "SELECT resource_id FROM stale WHERE resource_id NOT IN "
+                    "(SELECT resource_id FROM rows WHERE resource_type = ? "
+                    "AND resource_id IS NOT NULL)",
+                    (self.resource_type,),
+                )
+            ]
+        logger.info(
+            f"Transformed {self.changed} new or changed of {self.rows} rows of mapping "
+            f"{self.key}, {len(deleted)} resources disappeared.",
+        )
+        return deleted
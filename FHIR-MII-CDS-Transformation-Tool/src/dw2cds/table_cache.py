@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from collections import Counter
+from typing import Callable, Hashable
+
+import pandas as pd
+
+"""
+This module provides the run-scoped caches of loaded tables.
+
+Tables are loaded on first use and kept until the last resource mapping using them is
+transformed. Tables that are read from the same source file with the same read options
+(e.g. DiagTable and ProcTable) share the parsed file through the SourceCache. The caches
+can be used by concurrently transformed mappings, a table is loaded only once.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class SourceCache:
+    """
+    Cache of parsed source files, shared by the load strategies of a run.
+
+    Entries are grouped by the path of the source file, so all entries of a file can be
+    evicted at once. The cached frames must not be modified by their users.
+    """
+
+    def __init__(self):
+        self._entries: dict[str, dict[Hashable, pd.DataFrame]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str | os.PathLike, key: Hashable) -> pd.DataFrame | None:
+        """
+        Returns the parsed file, or None if it is not cached.
+
+        Args:
+            path (str | os.PathLike): The path of the source file.
+            key (Hashable): The read options the file was parsed with.
+        """
+        return self._entries.get(os.path.abspath(path), {}).get(key)
+
+    def put(self, path: str | os.PathLike, key: Hashable, df: pd.DataFrame) -> None:
+        """
+        Caches a parsed file.
+
+        Args:
+            path (str | os.PathLike): The path of the source file.
+            key (Hashable): The read options the file was parsed with.
+            df (pd.DataFrame): The parsed file.
+        """
+        with self._lock:
+            self._entries.setdefault(os.path.abspath(path), {})[key] = df
+
+    def evict(self, path: str | os.PathLike) -> None:
+        """
+        Removes all cached parses of a file.
+
+        Args:
+            path (str | os.PathLike): The path of the source file.
+        """
+        with self._lock:
+            evicted = self._entries.pop(os.path.abspath(path), None)
+        if evicted is not None:
+            logger.debug(f"Evicted source file {path}")
+
+    def clear(self) -> None:
+        """
+        Removes all cached files.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class TableCache:
+    """
+    Run-scoped cache of loaded tables with reference counting.
+
+    The reference count of a table is the number of resource mappings using it. A table
+    is loaded by the first acquire() and evicted by the release() of its last mapping.
+
+    Args:
+        mappings (list[dict]): The resource mappings of the run.
+        load_table (Callable[[str], pd.DataFrame | None]): Loads a table by name, returns
+            None if the table can not be loaded.
+        table_sources (dict[str, str]): The source file path of every table, used to evict
+            the parsed source files of the SourceCache.
+    """
+
+    def __init__(
+        self,
+        mappings: list[dict],
+        load_table: Callable[[str], pd.DataFrame | None],
+        table_sources: dict[str, str] | None = None,
+    ):
+        self.load_table = load_table
+        self.table_sources = table_sources or {}
+        self.source_cache = SourceCache()
+        self.references = Counter(
+            table
+            for mapping in mappings
+            for table in set(mapping.get("usedTables", []))
+        )
+        self._tables: dict[str, pd.DataFrame] = {}
+        self._sizes: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._load_locks: dict[str, threading.Lock] = {}
+
+    def acquire(self, table_names: list[str]) -> dict[str, pd.DataFrame]:
+        """
+        Returns the tables, loading the tables that are not cached.
+
+        The returned frames are shared and must not be modified.
+
+        Args:
+            table_names (list[str]): The names of the tables.
+
+        Returns:
+            dict[str, pd.DataFrame]: The loaded tables by name. Tables that could not be
+            loaded are missing.
+        """
+        tables = {}
+        for table_name in dict.fromkeys(table_names):
+            with self._lock:
+                load_lock = self._load_locks.setdefault(table_name, threading.Lock())
+            # Concurrent mappings wait for the table instead of loading it again
+            with load_lock:
+                table = self._tables.get(table_name)
+                if table is None:
+                    table = self.load_table(table_name)
+                    if table is None:
+                        continue
+                    with self._lock:
+                        self._tables[table_name] = table
+            tables[table_name] = table
+        return tables
+
+    def get(self, table_name: str) -> pd.DataFrame | None:
+        """
+        Returns a table if it is cached, without loading it.
+
+        Args:
+            table_name (str): The name of the table.
+
+        Returns:
+            pd.DataFrame | None: The cached table, or None if it is not cached.
+        """
+        return self._tables.get(table_name)
+
+    def release(self, table_names: list[str]) -> None:
+        """
+        Releases the tables of a transformed mapping, evicting the tables without
+        remaining references.
+
+        Args:
+            table_names (list[str]): The names of the tables.
+        """
+        for table_name in dict.fromkeys(table_names):
+            with self._lock:
+                self.references[table_name] -= 1
+                if self.references[table_name] > 0:
+                    continue
+                evicted = self._tables.pop(table_name, None)
+                self._sizes.pop(table_name, None)
+            if evicted is not None:
+                logger.debug(f"Evicted table {table_name}")
+            self._evict_source(table_name)
+
+    def loaded_sizes(self) -> dict[str, int]:
+        """
+        Returns the memory usage of the cached tables.
+
+        Returns:
+            dict[str, int]: The size of every cached table in bytes.
+        """
+        with self._lock:
+            tables = dict(self._tables)
+        sizes = {}
+        for table_name, table in tables.items():
+            size = self._sizes.get(table_name)
+            if size is None:
+                size = self._sizes[table_name] = int(table.memory_usage(deep=True).sum())
+            sizes[table_name] = size
+        return sizes
+
+    def clear(self) -> None:
+        """
+        Removes all cached tables and source files.
+        """
+        with self._lock:
+            self._tables.clear()
+            self._sizes.clear()
+        self.source_cache.clear()
+
+    def _evict_source(self, table_name: str) -> None:
+        source = self.table_sources.get(table_name)
+        if source is None:
+            return
+        still_used = any(
+            path == source and self.references[name] > 0
+            for name, path in self.table_sources.items()
+        )
+        if not still_used:
+            self.source_cache.evict(source)
@@ -1,13 +1,22 @@
 from __future__ import annotations
 
+import json
 import logging
 import os
-from typing import Any
+import time
+from collections import defaultdict
 
 import pandas as pd
 from fhir.resources import construct_fhir_element
+from fhir_api.async_uploader import AsyncUploadPipeline
+from fhir_api.bundle_uploader import BundleUploader, serialize_resource
 from fhir_api.fhir_client import create_update_resource
-from processor_registry import ProcessorRegistry
+from fhir_api.ndjson_writer import NDJSONWriterPool
+from mapping_plan import MappingPlan
+from processor_registry import ProcessorRegistry, shared_registry
+from profiling import PROFILER
+from tqdm import tqdm
+from validation import ValidationSettings, resource_json
 
 
 class FHIRTransformer:
@@ -21,6 +30,12 @@ class FHIRTransformer:
         field_mappings: dict[str, str],
         processor_paths: list[str | os.PathLike],
         output_data_folder_path: str,
+        uploader: BundleUploader | None = None,
+        pipeline: AsyncUploadPipeline | None = None,
+        processor_registry: ProcessorRegistry | None = None,
+        ndjson_file: str | None = None,
+        writer: NDJSONWriterPool | None = None,
+        validation: ValidationSettings | None = None,
     ):
         """
         Initializes a new instance of the FHIRTransformer class.
@@ -28,235 +43,178 @@ class FHIRTransformer:
         Parameters:
         - field_mappings (Dict[str, str]): A dictionary containing field mappings for transforming data.
         - processor_paths (List[Union[str, os.PathLike]]): A list of paths to processor modules.
+        - output_data_folder_path (str): The folder the NDJSON files are written to.
+        - uploader (BundleUploader | None): Uploads the resources in bundles. If None, every
+          resource is sent with a separate request.
+        - pipeline (AsyncUploadPipeline | None): Uploads the resources concurrently while the
+          transformation continues. Takes precedence over the uploader.
+        - processor_registry (ProcessorRegistry | None): Already loaded processors. If None, the
+          shared registry of processor_paths is used.
+        - ndjson_file (str | None): The NDJSON file the resources are appended to. If None, the
+          default file of the resource type is used.
+        - writer (NDJSONWriterPool | None): Keeps the NDJSON files open across resources. If
+          None, the NDJSON file is opened for every resource.
+        - validation (ValidationSettings | None): Which resources of transform_table are
+          validated. If None, every resource is validated.
 
         Returns:
         - None
         """
         self.field_mappings = field_mappings
-        self.processor_registry = ProcessorRegistry(processor_paths)
-        self.processors = self.processor_registry.get_processors()
-        self.resources = {}
+        self.processor_registry = processor_registry or shared_registry(processor_paths)
+        self.plan = MappingPlan.compile(
+            field_mappings.get("fields", {}),
+            self.processor_registry,
+        )
         self.output_data_folder_path = output_data_folder_path
-
-    def transform(self, row: pd.DataFrame, resource_type: str, fhir_base_url: str) -> None:
-        """
-        Transforms a row of data into FHIR format.
-
-        Parameters:
-        - row (pd.DataFrame): The row of data to transform.
-        - resource_type (str): The resource type for the FHIR resource.
-
-        Returns:
-        - None
-        """
-        fhir_dict = self.field_mappings.copy().get("fields", {})
-        fhir_dict = self._fill_dict(row, resource_type, fhir_dict)
-        if resource_type not in self.resources:
-            self.resources[resource_type] = []
-            code = fhir_dict.get("code")
-            if code:
-                coding = fhir_dict.get("coding")
-        res = construct_fhir_element(resource_type, fhir_dict)
-        self._save_resource(resource_type, res, fhir_base_url)
-
-    def _save_resource(self, resource_name, resource, fhir_base_url):
-        if not os.path.exists(self.output_data_folder_path):
-            os.makedirs(self.output_data_folder_path)
-        with open(
-            f"{self.output_data_folder_path}/{resource_name.lower()}.ndjson",
-            "a",
-        ) as f:
-            create_update_resource(
-                resource,
-                resource_name,
-                resource.dict().get("id"),
-                base_url=fhir_base_url,
-                ndjson=True,
-                no_fhir_server=False,
-            )
-
-    def _create_resource(self, resource_name: str, resource_data: dict) -> Any:
-        """
-        Creates a FHIR resource instance based on the resource name and data.
-
-        Parameters:
-        - resource_name (str): The name of the FHIR resource.
-        - resource_data (dict): The data for the FHIR resource.
-
-        Returns:
-        - Any: The created FHIR resource instance.
+        self.uploader = uploader
+        self.pipeline = pipeline
+        self.ndjson_file = ndjson_file
+        self.writer = writer
+        self.sampler = (validation or ValidationSettings()).create_sampler()
+        self._id_plan = None
+        # Latencies of the stages of the current table, None if the profiler is disabled
+        self._latencies = None
+        os.makedirs(self.output_data_folder_path, exist_ok=True)
+
+    def transform_table(
+        self,
+        table: pd.DataFrame,
+        resource_type: str,
+        fhir_base_url: str,
+        progress: bool = True,
+    ) -> None:
         """
+        Transforms all rows of a table into FHIR format using the compiled mapping plan.
 
-        # Create an instance of the resource class
-        resource = construct_fhir_element(resource_name.capitalize(), resource_data)
-
-        return resource
-
-    def _fill_dict(self, row: pd.Series, resource_type: str, mapping: dict) -> dict:
-        """
-        Recursively fills a dictionary with data from a row using field mappings.
+        The leaves of the plan are evaluated column-wise over the whole table, the resources
+        are then assembled from the evaluated columns.
 
         Parameters:
-        - row (pd.Series): The row of data to fill the dictionary with.
-        - resource_type (str): The resource type for the FHIR resource.
-        - mapping (dict): The field mappings dictionary.
+        - table (pd.DataFrame): The joined table to transform.
+        - resource_type (str): The resource type for the FHIR resources.
+        - fhir_base_url (str): The base URL of the FHIR server.
+        - progress (bool): Whether a progress bar is shown.
 
         Returns:
-        - dict: The filled dictionary.
+        - None
         """
-        result = {}
-        for key, val in mapping.items():
-            if isinstance(val, dict):
-                result[key] = self._fill_dict(row, resource_type, val)
-            elif isinstance(val, list) and not isinstance(val, str):
-                result = self._handle_list(key, resource_type, result, row, val)
-            elif isinstance(val, str):
-                if val.startswith("$") and val.endswith("$"):
-                    result[key] = self._replace_processor_reference(
-                        row,
-                        resource_type,
-                        [val.strip("$")],
-                    )
-                elif not val.startswith("%") and not val.endswith("%"):
-                    if val.lower() != "none":
-                        result[key] = val
-                    else:
-                        result.pop(key, None)
-                elif (
-                    val.startswith("%")
-                    and val.endswith("%")
-                    and val.strip("%") in val.strip("%") in row
-                ):
-                    if (
-                        str(row[val.strip("%")]).lower() != "none"
-                        and str(row[val.strip("%")]).lower() != "nan"
-                    ):
-                        result[key] = row[val.strip("%")]
-                    else:
-                        result.pop(key, None)
+        # The stages of the rows are recorded at once, after the table is transformed
+        self._latencies = defaultdict(list) if PROFILER.enabled else None
+        try:
+            for fhir_dict in tqdm(
+                self.plan.iter_resources(table),
+                total=len(table),
+                desc=f"Transforming {resource_type}",
+                disable=not progress,
+            ):
+                if not self.sampler.validates_next():
+                    self._save_assembled_resource(resource_type, fhir_dict, fhir_base_url)
+                    continue
+                res = self._timed("validate", construct_fhir_element, resource_type, fhir_dict)
+                if self.sampler.emits_models:
+                    self._save_resource(resource_type, res, fhir_base_url)
                 else:
-                    logging.error(f"Invalid field mapping: {val}")
-                    raise ValueError(f"Invalid field mapping: {val}")
-            else:
-                raise ValueError(f"Invalid field mapping: {val}")
-        return result
-
-    def _handle_list(self, key, resource_type, result, row, val):
-        if self._check_if_list_contains_processor_reference(val):
-            res = self._replace_processor_reference(
-                row,
-                resource_type,
-                val,
-            )
-            if res != "none" and res != "nan":
-                result[key] = res
-            else:
-                result.pop(key, None)
-        else:
-            processed_list = []
-            for item in val:
-                if (
-                    isinstance(item, str)
-                    and item.startswith("$")
-                    and item.endswith("$")
-                ):
-                    res = (
-                        self._replace_processor_reference(
-                            row,
-                            resource_type,
-                            [val],
-                        ),
-                    )
-
-                    if res != "none" and res != "nan":
-                        processed_list.append(res)
-                elif isinstance(item, dict):
-                    processed_list.append(
-                        self._fill_dict(row, resource_type, item),
-                    )
-                elif isinstance(item, list):
-                    processed_list.append(
-                        self._handle_list(key, resource_type, result, row, item)[key],
+                    self._save_assembled_resource(
+                        resource_type,
+                        fhir_dict,
+                        fhir_base_url,
+                        validated=res,
                     )
-                else:
-                    if item.strip('%') not in row and item not in row:
-                        raise KeyError(f"Missing column: {item}")
-                    processed_list.append(str(row[item.strip('%')]))
-            result[key] = processed_list
-        return result
+        finally:
+            if self._latencies is not None:
+                for stage, latencies in self._latencies.items():
+                    PROFILER.record_many("stage", stage, latencies)
+                self._latencies = None
 
-    def _check_if_list_contains_processor_reference(
-        self,
-        val: list[str | dict[str, str]],
-    ) -> bool:
+    def resource_ids(self, table: pd.DataFrame) -> list[str | None]:
         """
-        Checks if a list contains processor references.
+        Evaluates the id of the resource of every row of a table without assembling the
+        resources.
 
         Parameters:
-        - val (List[Union[str, Dict[str, str]]]): The list to check.
+        - table (pd.DataFrame): The joined table.
 
         Returns:
-        - bool: True if the list contains processor references, False otherwise.
-        """
-        for item in val:
-            if isinstance(item, str):
-                if item.startswith("$") and item.endswith("$"):
-                    if item.strip("$") in self.processors.keys():
-                        return True
-                    else:
-                        raise ValueError(
-                            f"Invalid processor reference: {item}",
-                        )
-        return False
-
-    def _get_processor_from_list(
-        self,
-        val: list[str | dict[str, str]],
-        resource_type: str,
-    ) -> tuple:
+        - list[str | None]: The resource ids, None for resources without id.
         """
-        Gets the processor and arguments from a list of processor references.
-
-        Parameters:
-        - val (List[Union[str, Dict[str, str]]]): The list of processor references.
-        - resource_type (str): The resource type for the FHIR resource.
+        if self._id_plan is None:
+            id_field = self.field_mappings.get("fields", {}).get("id")
+            self._id_plan = MappingPlan.compile(
+                {"id": id_field} if id_field is not None else {},
+                self.processor_registry,
+            )
+        return [
+            None if pd.api.types.is_scalar(resource_id) and pd.isna(resource_id)
+            else str(resource_id)
+            for resource_id in (
+                fhir_dict.get("id") for fhir_dict in self._id_plan.iter_resources(table)
+            )
+        ]
+
+    def _save_assembled_resource(self, resource_name, fhir_dict, fhir_base_url, validated=None):
+        resource_id = fhir_dict.get("id")
+        body = self._timed("serialize", resource_json, resource_name, fhir_dict)
+        if validated is not None:
+            self._check_normalized(resource_name, validated, body, resource_id)
+        self._save_resource(
+            resource_name,
+            body,
+            fhir_base_url,
+            resource_id=str(resource_id) if resource_id is not None else None,
+        )
 
-        Returns:
-        - tuple: A tuple containing the processor and the remaining list of references.
-        """
-        for item in val:
-            if isinstance(item, str):
-                if item.strip("$") in self.processors.keys():
-                    return self.processor_registry.get_processor(item.strip("$")), [
-                        i for i in val if i != item
-                    ]
-        raise ValueError("No processor reference found in list")
+    def _check_normalized(self, resource_name, resource, body, resource_id):
+        # The emitted resources must not differ from their validated serialization. Both are
+        # usually equal byte for byte, they are only parsed to ignore the order of elements.
+        validated = resource.json(return_bytes=True)
+        if validated == body or json.loads(validated) == json.loads(body):
+            return
+        self.sampler.mismatches += 1
+        logging.warning(
+            f"Assembled {resource_name} resource {resource_id} differs from its validated "
+            f"form. Validated: {validated.decode('utf-8')}, assembled: {body.decode('utf-8')}",
+        )
 
-    def _replace_processor_reference(
-        self,
-        row: pd.Series,
-        resource_type: str,
-        val: list[str | dict[str, str]],
-    ) -> Any:
-        """
-        Replaces a processor reference with the result of the processor.
+    def _save_resource(self, resource_name, resource, fhir_base_url, resource_id=None):
+        if resource_id is None and not isinstance(resource, (str, bytes)):
+            resource_id = resource.id
+        # Serialized once, the NDJSON file and the FHIR server receive the same bytes
+        body = resource
+        if not isinstance(resource, bytes):
+            body = self._timed("serialize", serialize_resource, resource)
+        self._timed(
+            "ndjson",
+            create_update_resource,
+            body,
+            resource_name,
+            resource_id,
+            ndjson=True,
+            no_fhir_server=True,
+            ndjson_file=self.ndjson_file,
+            writer=self.writer,
+        )
+        self._timed("upload", self._upload_resource, body, resource_name, resource_id, fhir_base_url)
 
-        Parameters:
-        - row (pd.Series): The row of data to pass to the processor.
-        - resource_type (str): The resource type for the FHIR resource.
-        - val (List[Union[str, Dict[str, str]]]): The list containing the processor reference.
+    def _upload_resource(self, body, resource_name, resource_id, fhir_base_url):
+        if self.uploader is not None and self.pipeline is None:
+            self.uploader.add(body, resource_name, resource_id)
+        else:
+            create_update_resource(
+                body,
+                resource_name,
+                resource_id,
+                base_url=fhir_base_url,
+                ndjson=False,
+                pipeline=self.pipeline,
+            )
 
-        Returns:
-        - Any: The result of the processor.
-        """
-        processor, arg_names = self._get_processor_from_list(
-            val,
-            resource_type,
-        )
-        for key in arg_names:
-            if not key.startswith("%") or not key.endswith("%"):
-                logging.error(f"Invalid argument: {key}")
-                raise ValueError(f"Invalid argument: {key}")
-        args = [row[key.strip("%")] for key in arg_names]
-        result = processor(*args)
-        return result
+    def _timed(self, stage, function, *args, **kwargs):
+        # Without profiler, the stages of a row are not measured at all
+        if self._latencies is None:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self._latencies[stage].append(time.perf_counter() - start)
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Size of the blocks read when hashing file contents
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_fingerprint(path: str | os.PathLike, content_hash: bool = False) -> dict:
+    """
+    Creates a fingerprint of a file that changes when the file changes.
+
+    Args:
+        path (str | os.PathLike): The path of the file.
+        content_hash (bool): Whether the content is hashed. If False, the fingerprint
+            consists of the size and the modification time only.
+
+    Returns:
+        dict: The fingerprint of the file.
+    """
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if content_hash:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        fingerprint = {"size": stat.st_size, "sha256": digest.hexdigest()}
+    return fingerprint
+
+
+def object_fingerprint(value) -> str:
+    """
+    Creates a stable hash of a JSON serializable object, e.g. a configuration.
+
+    Args:
+        value: The object to hash. Values that are not JSON serializable are hashed by their
+            string representation.
+
+    Returns:
+        str: The hex digest of the object.
+    """
+    encoded = json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def row_fingerprints(df: pd.DataFrame) -> pd.Series:
+    """
+    Creates a 64-bit fingerprint of every row of a table, computed column-wise.
+
+    Rows with the same values have the same fingerprint, independent of the index of the
+    table, of the order of its columns and of the dtypes the values were loaded with:
+    categorical columns are hashed by their values, integers as 64-bit integers and floats
+    as 64-bit floats. The fingerprints are persisted by the state store, so changing the
+    normalization makes the next incremental run transform all rows again.
+
+    Args:
+        df (pd.DataFrame): The table.
+
+    Returns:
+        pd.Series: The uint64 fingerprints, with the index of the table.
+    """
+    positions = sorted(range(df.shape[1]), key=lambda position: str(df.columns[position]))
+    normalized = pd.DataFrame(
+        {
+            index: _normalized_column(df.iloc[:, position])
+            for index, position in enumerate(positions)
+        },
+        index=df.index,
+    )
+    return pd.util.hash_pandas_object(normalized, index=False)
+
+
+def _normalized_column(column: pd.Series) -> pd.Series:
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = column.cat.categories.dtype
+        column = column.astype(object if column.hasnans else categories)
+    # Nullable extension columns keep their missing values
+    nullable = isinstance(column.dtype, pd.api.extensions.ExtensionDtype)
+    if pd.api.types.is_integer_dtype(column.dtype):
+        return column.astype("Int64" if nullable else np.int64, copy=False)
+    if pd.api.types.is_float_dtype(column.dtype):
+        return column.astype("Float64" if nullable else np.float64, copy=False)
+    return column
+
+
+class FingerprintSet:
+    """
+    Set of 64-bit row fingerprints, kept in sorted NumPy arrays.
+
+    A fingerprint takes 8 bytes, instead of about 70 bytes in a Python set. The added
+    fingerprints form sorted runs of decreasing size. A new run is merged with the
+    previous runs as long as they are not larger, so there are at most log2(n) runs and
+    every fingerprint is merged at most log2(n) times.
+    """
+
+    def __init__(self):
+        self._runs: list[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self._runs)
+
+    def contains(self, fingerprints: np.ndarray) -> np.ndarray:
+        """
+        Returns which fingerprints are in the set.
+
+        Args:
+            fingerprints (np.ndarray): The uint64 fingerprints.
+
+        Returns:
+            np.ndarray: A boolean mask, True for the fingerprints in the set.
+        """
+        found = np.zeros(len(fingerprints), dtype=bool)
+        for run in self._runs:
+            positions = np.minimum(np.searchsorted(run, fingerprints), len(run) - 1)
+            found |= run[positions] == fingerprints
+        return found
+
+    def add(self, fingerprints: np.ndarray) -> None:
+        """
+        Adds fingerprints to the set.
+
+        Args:
+            fingerprints (np.ndarray): The uint64 fingerprints, which must not be in the set yet.
+        """
+        run = np.unique(fingerprints)
+        if not len(run):
+            return
+        while self._runs and len(self._runs[-1]) <= len(run):
+            run = np.concatenate((self._runs.pop(), run))
+            run.sort(kind="mergesort")
+        self._runs.append(run)
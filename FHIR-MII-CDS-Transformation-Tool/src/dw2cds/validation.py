@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import datetime
+import functools
+import logging
+import numbers
+import random
+import typing
+from dataclasses import dataclass
+from typing import Any
+
+from fhir.resources import get_fhir_model_class
+from fhir_api.bundle_uploader import dumps_json
+
+"""
+This module decides which resources are validated with the fhir.resources models.
+
+Validation modes:
+- full: every resource is validated and emitted as serialized by its model.
+- sample: every resource is emitted as assembled by the mapping, a sample of the resources
+  is validated in addition. The sample is every Nth resource for a sample rate N >= 1, or
+  a random share of the resources for a sample rate below 1. Validated resources that
+  differ from their assembled form are logged and counted, the run fails at its end if
+  there are any.
+- none: every resource is emitted as assembled by the mapping without validation.
+
+Assembled resources are normalized like the models do it, using the element types of the
+models: numbers in string elements (e.g. id, identifier.value, postalCode) are converted
+to strings, dates and times are written in ISO format, empty elements are omitted and the
+elements are ordered like the models order them. The assembled and the validated JSON of a
+resource are therefore usually equal byte for byte.
+Constraints of the models are not checked, so the sample and none modes are meant for
+reruns of mappings that were validated before.
+"""
+
+logger = logging.getLogger(__name__)
+
+VALIDATION_MODES = ("full", "sample", "none")
+
+# Kinds of the elements of a FHIR type that are normalized
+STRING_ELEMENT = "string"
+TEMPORAL_ELEMENT = "temporal"
+COMPLEX_ELEMENT = "complex"
+
+
+@dataclass(frozen=True)
+class ValidationSettings:
+    """
+    Validation settings of a transformation, which can be passed to worker processes.
+
+    Attributes:
+        mode (str): One of VALIDATION_MODES.
+        sample_rate (float): Validate every Nth resource for N >= 1, or the given share of
+            randomly selected resources for values below 1 (sample mode only).
+        seed (int | None): The seed of the random sample.
+    """
+    mode: str = "full"
+    sample_rate: float = 100
+    seed: int | None = None
+
+    def __post_init__(self):
+        if self.mode not in VALIDATION_MODES:
+            raise ValueError(
+                f"Invalid validation mode {self.mode}, expected one of {VALIDATION_MODES}",
+            )
+        if self.sample_rate <= 0:
+            raise ValueError(f"Invalid validation sample rate {self.sample_rate}")
+
+    def create_sampler(self) -> ResourceSampler:
+        """
+        Creates the sampler deciding which resources are validated.
+        """
+        return ResourceSampler(self)
+
+
+class ResourceSampler:
+    """
+    Decides for every resource of a transformation whether it is validated.
+
+    Args:
+        settings (ValidationSettings): The validation settings.
+
+    Attributes:
+        resources (int): The number of resources seen.
+        validated (int): The number of validated resources.
+        mismatches (int): The number of validated resources that differ from their
+            assembled form, counted by the transformer.
+    """
+
+    def __init__(self, settings: ValidationSettings):
+        self.settings = settings
+        self.resources = 0
+        self.validated = 0
+        self.mismatches = 0
+        self._random = random.Random(settings.seed)
+
+    @property
+    def emits_models(self) -> bool:
+        """
+        Whether the resources are emitted as serialized by their models.
+        """
+        return self.settings.mode == "full"
+
+    def validates_next(self) -> bool:
+        """
+        Returns whether the next resource is validated.
+        """
+        self.resources += 1
+        mode, rate = self.settings.mode, self.settings.sample_rate
+        if mode == "full":
+            validate = True
+        elif mode == "none":
+            validate = False
+        elif rate >= 1:
+            validate = (self.resources - 1) % int(rate) == 0
+        else:
+            validate = self._random.random() < rate
+        self.validated += validate
+        return validate
+
+
+def resource_json(resource_type: str, fhir_dict: dict) -> bytes:
+    """
+    Serializes an assembled resource without validation.
+
+    Like the serialization of the fhir.resources models, the resource type comes first,
+    the elements are ordered like the fields of the models, None values and empty elements
+    are omitted, primitive values are normalized to the
+    JSON type of their element and non-ASCII characters are not escaped.
+
+    Args:
+        resource_type (str): The resource type.
+        fhir_dict (dict): The assembled resource.
+
+    Returns:
+        bytes: The compact UTF-8 encoded JSON of the resource.
+    """
+    return dumps_json(
+        {"resourceType": resource_type, **_normalized_element(fhir_dict, resource_type)},
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _element_kinds(type_name: str) -> dict[str, tuple[str, str | None]]:
+    """
+    Returns the kinds of the normalized elements of a FHIR type.
+
+    Args:
+        type_name (str): The name of the resource or data type, e.g. "Patient".
+
+    Returns:
+        dict[str, tuple[str, str | None]]: The kind and, for complex elements, the type
+        name of every string, date or time and complex element by its JSON name. Empty
+        for unknown types.
+    """
+    try:
+        model = get_fhir_model_class(type_name)
+    except KeyError:
+        return {}
+    kinds = {}
+    for field in model.__fields__.values():
+        field_type = field.type_
+        if typing.get_origin(field_type) is typing.Union:
+            # Items of lists of primitives are optional
+            field_type = next(
+                (arg for arg in typing.get_args(field_type) if arg is not type(None)),
+                None,
+            )
+        if not isinstance(field_type, type):
+            continue
+        if issubclass(field_type, str):
+            kinds[field.alias] = (STRING_ELEMENT, None)
+        elif issubclass(field_type, (datetime.date, datetime.time)):
+            kinds[field.alias] = (TEMPORAL_ELEMENT, None)
+        elif getattr(field_type, "__resource_type__", None):
+            kinds[field.alias] = (COMPLEX_ELEMENT, field_type.__resource_type__)
+    return kinds
+
+
+@functools.lru_cache(maxsize=None)
+def _element_positions(type_name: str) -> dict[str, int]:
+    """
+    Returns the positions of the elements of a FHIR type in the serialization of its model.
+
+    Args:
+        type_name (str): The name of the resource or data type, e.g. "Patient".
+
+    Returns:
+        dict[str, int]: The position of every element by its JSON name, the extensions of
+        a primitive element (e.g. "_family") follow the element. Empty for unknown types.
+    """
+    try:
+        model = get_fhir_model_class(type_name)
+    except KeyError:
+        return {}
+    positions = {}
+    for position, name in enumerate(model.elements_sequence()):
+        positions[name] = 2 * position
+        positions[f"_{name}"] = 2 * position + 1
+    return positions
+
+
+def _normalized_element(element: dict, type_name: str | None) -> dict:
+    kinds = _element_kinds(type_name) if type_name else {}
+    positions = _element_positions(type_name) if type_name else {}
+    keys = element.keys()
+    if positions:
+        # Unknown elements keep their order behind the elements of the model
+        keys = sorted(keys, key=lambda key: positions.get(key, len(positions)))
+    normalized = {}
+    for key in keys:
+        value = _normalized_value(element[key], kinds.get(key))
+        if value is not None:
+            normalized[key] = value
+    return normalized
+
+
+def _normalized_value(value: Any, kind: tuple[str, str | None] | None) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, list):
+        items = [_normalized_value(item, kind) for item in value]
+        return [item for item in items if item is not None] or None
+    if isinstance(value, dict):
+        type_name = kind[1] if kind is not None else None
+        if type_name == "Resource":
+            # Contained resources are typed by their resourceType
+            type_name = value.get("resourceType")
+        return _normalized_element(value, type_name) or None
+    if kind is None:
+        return value
+    if kind[0] == STRING_ELEMENT:
+        if isinstance(value, numbers.Number) and not isinstance(value, bool):
+            return str(value)
+    elif kind[0] == TEMPORAL_ELEMENT:
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, str) and "T" in value:
+            # Date times are written like the models do, e.g. "Z" as "+00:00"
+            try:
+                return datetime.datetime.fromisoformat(value).isoformat()
+            except ValueError:
+                return value
+    return value
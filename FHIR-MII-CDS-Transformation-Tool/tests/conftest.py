@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+TOOL_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# dw2cds uses flat imports of its modules and the FHIR API is not installed as package
+sys.path[:0] = [
+    os.path.join(TOOL_ROOT, "src", "dw2cds"),
+    os.path.join(TOOL_ROOT, "FHIR-MII-CDS-API", "src"),
+    os.path.dirname(os.path.abspath(__file__)),
+]
+
+from stub_fhir_server import StubFHIRServer  # noqa: E402
+
+
+@pytest.fixture
+def fhir_server():
+    """
+    A local stub FHIR server, see stub_fhir_server.StubFHIRServer.
+    """
+    server = StubFHIRServer()
+    try:
+        yield server
+    finally:
+        server.close()
@@ -0,0 +1,104 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+This module provides a local stub FHIR server for the tests of the uploaders.
+
+The stub accepts every request and answers bundles with a created entry per resource.
+The statuses of the next requests can be scripted, e.g. to make the server overloaded,
+and requests can be held until the test releases them, to keep uploads in flight.
+"""
+
+
+class StubFHIRServer:
+    """
+    Local FHIR server answering every request, running in a background thread.
+
+    Attributes:
+        base_url (str): The base URL of the server.
+        requests (list[tuple[str, str, bytes]]): The method, path and body of every
+            received request.
+        statuses (list[int]): The statuses of the next requests, 201 (200 for bundles)
+            when empty.
+        gate (threading.Event): Requests are answered once the gate is set, it is set
+            initially.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.statuses = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.received = threading.Condition()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}/fhir"
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name="stub-fhir-server",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def wait_for_requests(self, count: int, timeout: float = 5.0) -> bool:
+        """
+        Waits until the server has received at least count requests.
+
+        Returns:
+            bool: Whether the requests were received before the timeout.
+        """
+        with self.received:
+            return self.received.wait_for(lambda: len(self.requests) >= count, timeout)
+
+    def close(self):
+        """
+        Releases held requests and stops the server.
+        """
+        self.gate.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub.received:
+                    stub.requests.append((self.command, self.path, body))
+                    status = stub.statuses.pop(0) if stub.statuses else None
+                    stub.received.notify_all()
+                stub.gate.wait()
+                try:
+                    resource = json.loads(body)
+                except ValueError:
+                    resource = {}
+                if status is not None and status >= 300:
+                    self._respond(status, {"resourceType": "OperationOutcome"})
+                elif resource.get("resourceType") == "Bundle":
+                    entries = [
+                        {"response": {"status": "201 Created"}}
+                        for _ in resource.get("entry", [])
+                    ]
+                    self._respond(
+                        status or 200,
+                        {"resourceType": "Bundle", "type": "batch-response", "entry": entries},
+                    )
+                else:
+                    self._respond(status or 201, resource)
+
+            do_PUT = do_POST
+
+            def _respond(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/fhir+json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
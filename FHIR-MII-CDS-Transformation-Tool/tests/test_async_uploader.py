@@ -0,0 +1,112 @@
+import json
+import threading
+
+import pytest
+from fhir_api.async_uploader import AsyncUploadPipeline
+
+
+def _patient(index):
+    return {"resourceType": "Patient", "id": str(index)}
+
+
+def test_uploads_every_resource(fhir_server):
+    with AsyncUploadPipeline(fhir_server.base_url, workers=4, backoff_factor=0) as pipeline:
+        for index in range(20):
+            pipeline.submit(_patient(index), "Patient", str(index))
+    assert pipeline.succeeded == 20
+    assert pipeline.failed == 0
+    assert sorted(path for _, path, _ in fhir_server.requests) == sorted(
+        f"/fhir/Patient/{index}" for index in range(20)
+    )
+    assert {method for method, _, _ in fhir_server.requests} == {"PUT"}
+
+
+def test_bundles_queued_resources(fhir_server):
+    outcomes = []
+    with AsyncUploadPipeline(
+        fhir_server.base_url,
+        workers=1,
+        bundle_size=10,
+        bundle_type="batch",
+        backoff_factor=0,
+        on_outcome=outcomes.append,
+    ) as pipeline:
+        for index in range(25):
+            pipeline.submit(_patient(index), "Patient", str(index))
+    assert pipeline.succeeded == 25
+    assert len(outcomes) == 25
+    bundles = [json.loads(body) for _, _, body in fhir_server.requests]
+    assert all(bundle["resourceType"] == "Bundle" for bundle in bundles)
+    assert sum(len(bundle["entry"]) for bundle in bundles) == 25
+    assert max(len(bundle["entry"]) for bundle in bundles) <= 10
+
+
+def test_retries_overloaded_server(fhir_server):
+    fhir_server.statuses = [503, 503]
+    with AsyncUploadPipeline(
+        fhir_server.base_url,
+        workers=1,
+        retry_count=3,
+        backoff_factor=0,
+    ) as pipeline:
+        pipeline.submit(_patient(1), "Patient", "1")
+    assert pipeline.succeeded == 1
+    assert pipeline.failed == 0
+    assert len(fhir_server.requests) == 3
+
+
+def test_counts_failures_after_retries(fhir_server):
+    fhir_server.statuses = [503] * 3 + [400]
+    with AsyncUploadPipeline(
+        fhir_server.base_url,
+        workers=1,
+        retry_count=2,
+        backoff_factor=0,
+    ) as pipeline:
+        pipeline.submit(_patient(1), "Patient", "1")
+        # Client errors are not retried
+        pipeline.submit(_patient(2), "Patient", "2")
+        pipeline.submit(_patient(3), "Patient", "3")
+    assert pipeline.failed == 2
+    assert pipeline.succeeded == 1
+    assert len(fhir_server.requests) == 5
+
+
+def test_submit_blocks_while_queue_is_full(fhir_server):
+    fhir_server.gate.clear()
+    pipeline = AsyncUploadPipeline(fhir_server.base_url, workers=1, queue_size=2, backoff_factor=0)
+    try:
+        pipeline.submit(_patient(0), "Patient", "0")
+        # The worker holds the first resource in flight, two more fill the queue
+        assert fhir_server.wait_for_requests(1)
+        pipeline.submit(_patient(1), "Patient", "1")
+        pipeline.submit(_patient(2), "Patient", "2")
+        blocked = threading.Thread(target=pipeline.submit, args=(_patient(3), "Patient", "3"))
+        blocked.start()
+        blocked.join(0.5)
+        assert blocked.is_alive()
+        assert pipeline._queue.qsize() == 2
+
+        fhir_server.gate.set()
+        blocked.join(5)
+        assert not blocked.is_alive()
+    finally:
+        fhir_server.gate.set()
+        pipeline.close()
+    assert pipeline.succeeded == 4
+
+
+def test_close_drains_queue(fhir_server):
+    fhir_server.gate.clear()
+    pipeline = AsyncUploadPipeline(fhir_server.base_url, workers=2, queue_size=10, backoff_factor=0)
+    for index in range(10):
+        pipeline.submit(_patient(index), "Patient", str(index))
+    assert fhir_server.wait_for_requests(2)
+    assert pipeline.succeeded == 0
+
+    threading.Timer(0.2, fhir_server.gate.set).start()
+    pipeline.close()
+    assert pipeline.succeeded == 10
+    assert len(fhir_server.requests) == 10
+    with pytest.raises(RuntimeError):
+        pipeline.submit(_patient(10), "Patient", "10")
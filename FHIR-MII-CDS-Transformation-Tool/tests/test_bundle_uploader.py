@@ -0,0 +1,56 @@
+import json
+import time
+
+from fhir_api.bundle_uploader import BundleUploader
+
+
+def _patient(index):
+    return {"resourceType": "Patient", "id": str(index)}
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def _entries(fhir_server):
+    return [len(json.loads(body)["entry"]) for _, _, body in fhir_server.requests]
+
+
+def test_sends_full_bundles(fhir_server):
+    with BundleUploader(fhir_server.base_url, bundle_size=10, flush_interval=60) as uploader:
+        for index in range(25):
+            uploader.add(_patient(index), "Patient", str(index))
+        assert _entries(fhir_server) == [10, 10]
+    assert _entries(fhir_server) == [10, 10, 5]
+    assert uploader.succeeded == 25
+
+
+def test_sends_buffered_resources_after_flush_interval(fhir_server):
+    uploader = BundleUploader(fhir_server.base_url, bundle_size=10, flush_interval=0.2)
+    try:
+        start = time.monotonic()
+        uploader.add(_patient(1), "Patient", "1")
+        uploader.add(_patient(2), "Patient", "2")
+        # Sent by the timer, although no further resource is added
+        assert _wait_for(lambda: uploader.succeeded == 2)
+        assert time.monotonic() - start >= 0.2
+        assert _entries(fhir_server) == [2]
+
+        uploader.add(_patient(3), "Patient", "3")
+        assert fhir_server.wait_for_requests(2)
+        assert _entries(fhir_server) == [2, 1]
+    finally:
+        uploader.close()
+    assert len(fhir_server.requests) == 2
+
+
+def test_flush_cancels_timer(fhir_server):
+    uploader = BundleUploader(fhir_server.base_url, bundle_size=10, flush_interval=0.2)
+    uploader.add(_patient(1), "Patient", "1")
+    uploader.flush()
+    time.sleep(0.4)
+    uploader.close()
+    assert _entries(fhir_server) == [1]
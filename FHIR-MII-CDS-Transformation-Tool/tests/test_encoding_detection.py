@@ -0,0 +1,30 @@
+import encoding_detection
+from encoding_detection import detect_encoding
+
+ASCII_LINE = b"100031|MUELLER_A|2011-04-19 12:34:08|Unterkieferfraktur links\n"
+
+
+def _write(path, lines, tail=b""):
+    path.write_bytes(ASCII_LINE * lines + tail)
+    return path
+
+
+def test_ascii_file_is_not_fed_to_the_detector(tmp_path, monkeypatch):
+    results = []
+    monkeypatch.setattr(
+        encoding_detection,
+        "_current_result",
+        lambda detector: results.append(detector) or ("ascii", 1.0),
+    )
+    path = _write(tmp_path / "ascii.csv", 100_000)
+    assert detect_encoding(path, sample_size=64 * 1024) == "ascii"
+    assert results == []
+
+
+def test_non_ascii_bytes_after_ascii_sample(tmp_path):
+    text = "Gesichtsschädel, Oberkieferhöhle, Röntgen, Überweisung durch Ärztin\n"
+    path = _write(tmp_path / "latin1.csv", 100_000, text.encode("latin1") * 200)
+    assert detect_encoding(path, sample_size=64 * 1024).lower() in ("iso-8859-1", "windows-1252")
+
+    path = _write(tmp_path / "utf8.csv", 100_000, text.encode("utf-8") * 200)
+    assert detect_encoding(path, sample_size=64 * 1024).lower() == "utf-8"
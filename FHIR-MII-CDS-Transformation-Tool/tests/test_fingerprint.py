@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+from utils.fingerprint import FingerprintSet, row_fingerprints
+
+
+def test_fingerprint_set_matches_python_set():
+    rng = np.random.default_rng(0)
+    fingerprints = FingerprintSet()
+    expected = set()
+    for size in (0, 1, 7, 100, 3, 1000, 250):
+        # Few distinct values, so that later chunks contain fingerprints of earlier ones
+        chunk = rng.integers(0, 2_000, size=size).astype(np.uint64)
+        found = fingerprints.contains(chunk)
+        assert found.tolist() == [value in expected for value in chunk.tolist()]
+        fingerprints.add(chunk[~found])
+        expected.update(chunk.tolist())
+    assert len(fingerprints) == len(expected)
+    everything = np.arange(2_000, dtype=np.uint64)
+    assert fingerprints.contains(everything).tolist() == [
+        value in expected for value in range(2_000)
+    ]
+
+
+def test_row_fingerprints_ignore_dtypes_and_column_order():
+    table = pd.DataFrame({"ID": [1, -1, 3], "TEXT": ["a", "b", None], "VALUE": [0.5, 1.0, 2.0]})
+    loaded = pd.DataFrame({
+        "VALUE": table["VALUE"].astype(np.float32),
+        "TEXT": table["TEXT"].astype("category"),
+        "ID": table["ID"].astype(np.int8),
+    })
+    assert row_fingerprints(loaded).tolist() == row_fingerprints(table).tolist()
+    # Nullable integers and categorical integers are hashed like integers
+    assert (
+        row_fingerprints(table.astype({"ID": "Int16"})).tolist()
+        == row_fingerprints(table).tolist()
+    )
+    assert (
+        row_fingerprints(table.astype({"ID": "category"})).tolist()
+        == row_fingerprints(table).tolist()
+    )
+    # Columns are hashed in the order of their names
+    swapped = table.rename(columns={"ID": "WEIGHT"})
+    assert row_fingerprints(swapped).tolist() != row_fingerprints(table).tolist()
@@ -0,0 +1,118 @@
+import os
+
+import pandas as pd
+import pytest
+from fhir_config_loader import FHIRConfigLoader
+from join_planner import JoinPlan
+from loader import Loader
+from test_mapping_plan import CONFIG_DIR, synthetic
+
+
+def merged_joins(tables, join_on):
+    """
+    The former joins of dw2cds: the tables are merged one after another with pd.merge,
+    in the configured order.
+    """
+    joined_table = None
+    keys = [
+        key for join_spec in join_on for table, key in join_spec.items() if table != "join_type"
+    ]
+    for join_spec in join_on:
+        left_table, right_table, join_type = None, None, "inner"
+        for table, key in join_spec.items():
+            if table == "join_type":
+                join_type = key
+            elif not left_table:
+                left_table, left_key = table, key
+            else:
+                right_table, right_key = table, key
+
+        left_tmp_table = tables[left_table].copy()
+        right_tmp_table = tables[right_table].copy()
+        left_tmp_table.columns = [
+            left_table + "." + col if col not in keys else col for col in left_tmp_table.columns
+        ]
+        right_tmp_table.columns = [
+            right_table + "." + col if col not in keys else col for col in right_tmp_table.columns
+        ]
+        joined_table = pd.merge(
+            left_tmp_table if joined_table is None else joined_table,
+            right_tmp_table,
+            left_on=left_key,
+            right_on=right_key,
+            how=join_type,
+        )
+        joined_table = joined_table.loc[:, ~joined_table.columns.duplicated(keep="first")]
+
+        for column in joined_table.columns:
+            if column.endswith("_x") or column.endswith("_y"):
+                original_column_name = column[:-2]
+                if (
+                    original_column_name + "_x" in joined_table.columns
+                    and original_column_name + "_y" in joined_table.columns
+                ):
+                    joined_table = joined_table.drop(columns=[original_column_name + "_y"])
+                    joined_table = joined_table.rename(
+                        columns={original_column_name + "_x": original_column_name},
+                    )
+    return joined_table
+
+
+def _assert_same_table(joined, expected):
+    assert list(joined.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        joined.reset_index(drop=True),
+        expected.reset_index(drop=True),
+        check_dtype=False,
+        check_categorical=False,
+    )
+
+
+def test_joins_match_merged_joins_of_config(tmp_path):
+    synthetic.generate(tmp_path, rows=200)
+    config = FHIRConfigLoader(os.path.join(CONFIG_DIR, "config.json"))
+    table_loader = config.config.get("table_loader")
+    joined_mappings = 0
+    for mapping in config.load_mappings():
+        join_on = mapping.get("join_on", [])
+        if not join_on:
+            continue
+        tables = {
+            table_name: Loader(
+                data_path=os.path.join(tmp_path, table_loader[table_name]["file_name"]),
+                configuration=table_loader[table_name],
+            ).load()
+            for table_name in mapping.get("usedTables")
+        }
+        _assert_same_table(JoinPlan(tables, join_on).execute(), merged_joins(tables, join_on))
+        joined_mappings += 1
+    assert joined_mappings > 0
+
+
+def test_reordered_joins_keep_configured_order():
+    tables = {
+        "Case": pd.DataFrame({"CASE": [3, 1, 2, 1], "PAT": [30, 10, 20, 10], "TEXT": list("abcd")}),
+        # Many rows per case, joined first in the configuration
+        "Event": pd.DataFrame({"EVENT_CASE": [1, 2, 3, 1, 2, 3] * 3, "TEXT": list("uvwxyz") * 3}),
+        # Few patients, joined first by the plan, with two rows of a patient
+        "Patient": pd.DataFrame({"PATIENT": [20, 10, 10], "TEXT": ["p20", "p10", "q10"]}),
+    }
+    join_on = [
+        {"Case": "CASE", "Event": "EVENT_CASE"},
+        {"Case": "PAT", "Patient": "PATIENT"},
+    ]
+    plan = JoinPlan(tables, join_on)
+    assert [step.table_name for step in plan._ordered_steps()] == ["Patient", "Event"]
+    _assert_same_table(plan.execute(), merged_joins(tables, join_on))
+
+
+def test_incompatible_key_types_raise():
+    tables = {
+        "Case": pd.DataFrame({"CASE": [1, 2]}),
+        "Event": pd.DataFrame({"EVENT_CASE": ["1", "2"]}),
+    }
+    join_on = [{"Case": "CASE", "Event": "EVENT_CASE"}]
+    with pytest.raises(ValueError):
+        merged_joins(tables, join_on)
+    with pytest.raises(ValueError, match="Cannot join Event"):
+        JoinPlan(tables, join_on).execute()
@@ -0,0 +1,50 @@
+import pandas as pd
+from line_repair import LineRepairRule, open_repaired
+
+# Layout of Pul_x1280dia_Diag_Pro.csv, the free text field at position 27 may contain "|"
+DIAG_COLUMNS = [
+    "DIA", "PAT", "CRUSER", "CRD", "DCAOFF", "DDCOFF", "TEXT",
+    *(f"F{position:02d}" for position in range(7, 27)),
+    "BEM", "F28", "F29",
+]
+
+DIAG_FIELDS = [
+    "17", "100031", "MUELLER_A", "2011-04-19 12:34:08", "ICD10-GM-2019", "S02.4",
+    "Unterkieferfraktur",
+    *(f"v{position}" for position in range(7, 27)),
+    "Kontrolle | in 6 Wochen", "w28", "w29",
+]
+
+BAD_LINE = "|".join(DIAG_FIELDS).encode("latin1")
+
+
+def test_merges_surplus_fields_at_configured_position():
+    rule = LineRepairRule.from_config({"merge_at": 27})
+    repaired = rule.repair(BAD_LINE, b"|", len(DIAG_COLUMNS))
+    assert repaired.split(b"|")[:27] == BAD_LINE.split(b"|")[:27]
+    assert repaired.endswith(b'|"Kontrolle | in 6 Wochen"|w28|w29')
+
+
+def test_keeps_valid_lines():
+    rule = LineRepairRule(merge_at=27)
+    line = b"|".join([b"x"] * len(DIAG_COLUMNS))
+    assert rule.repair(line, b"|", len(DIAG_COLUMNS)) is line
+
+
+def test_parses_repaired_diag_line(tmp_path):
+    valid = [*DIAG_FIELDS[:27], "ohne Befund", "w28", "w29"]
+    path = tmp_path / "Pul_x1280dia_Diag_Pro.csv"
+    path.write_bytes(
+        b"\n".join([
+            "|".join(DIAG_COLUMNS).encode("latin1"),
+            "|".join(valid).encode("latin1"),
+            BAD_LINE,
+        ]) + b"\n"
+    )
+    with open_repaired(path, {"merge_at": 27}, "|") as stream:
+        table = pd.read_csv(stream, delimiter="|", engine="c", encoding="latin1", dtype=str)
+    assert list(table.columns) == DIAG_COLUMNS
+    assert table.iloc[0].tolist() == valid
+    # Every field keeps its column, unlike the legacy join_bad_line, which dropped F26
+    expected = [*DIAG_FIELDS[:27], "Kontrolle | in 6 Wochen", "w28", "w29"]
+    assert table.iloc[1].tolist() == expected
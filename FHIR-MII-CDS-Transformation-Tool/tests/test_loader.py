@@ -0,0 +1,102 @@
+import loader
+import pandas as pd
+import pytest
+from loader import BaseDataLoadStrategy
+
+ROWS = [
+    "1|x1|10|y1",
+    # The second field contains an unescaped delimiter
+    "2|x|2|20|y2",
+    "3|x3|30|y3",
+]
+
+
+def _strategy(tmp_path, csv, **table_config):
+    path = tmp_path / "table.csv"
+    path.write_text("\n".join(["ID|TEXT|VALUE|OTHER", *ROWS]) + "\n", encoding="latin1")
+    strategy = BaseDataLoadStrategy(
+        file_path=str(path),
+        configuration={"file_name": path.name, "csv": csv, **table_config},
+    )
+    strategy.columns = frozenset({"ID", "VALUE"})
+    return strategy
+
+
+@pytest.mark.filterwarnings("ignore::pandas.errors.ParserWarning")
+@pytest.mark.parametrize("engine", ["c", "python"])
+@pytest.mark.parametrize("on_bad_lines", ["skip", "warn"])
+def test_projection_skips_bad_lines(tmp_path, engine, on_bad_lines):
+    strategy = _strategy(
+        tmp_path,
+        {"delimiter": "|", "encoding": "latin1", "engine": engine, "on_bad_lines": on_bad_lines},
+    )
+    df = strategy.load_csv()
+    assert list(df.columns) == ["ID", "VALUE"]
+    assert df.to_dict("list") == {"ID": [1, 3], "VALUE": [10, 30]}
+
+    chunks = pd.concat(list(strategy.iter_chunks(chunk_size=2)))
+    assert chunks.to_dict("list") == {"ID": [1, 3], "VALUE": [10, 30]}
+
+
+def test_projection_raises_on_bad_lines(tmp_path):
+    strategy = _strategy(
+        tmp_path,
+        {"delimiter": "|", "encoding": "latin1", "engine": "c", "on_bad_lines": "error"},
+    )
+    with pytest.raises(pd.errors.ParserError):
+        strategy.load_csv()
+
+
+def test_projection_repairs_bad_lines(tmp_path):
+    strategy = _strategy(
+        tmp_path,
+        {"delimiter": "|", "encoding": "latin1", "engine": "c"},
+        line_repair={"merge_at": 1},
+    )
+    df = strategy.load_csv()
+    assert list(df.columns) == ["ID", "VALUE"]
+    assert df.to_dict("list") == {"ID": [1, 2, 3], "VALUE": [10, 20, 30]}
+
+
+def test_chunks_are_typed_by_sample_and_widened(tmp_path, monkeypatch):
+    monkeypatch.setattr(loader, "TYPE_SAMPLE_ROWS", 2)
+    path = tmp_path / "table.csv"
+    rows = ["1|a|1.5", "2|b|2.5", "3|007|3", "|c|4", "x|d|5"]
+    path.write_text("\n".join(["ID|TEXT|VALUE", *rows]) + "\n")
+    strategy = BaseDataLoadStrategy(
+        file_path=str(path),
+        configuration={"file_name": path.name, "csv": {"delimiter": "|", "encoding": "utf-8"}},
+    )
+    chunks = list(strategy.iter_chunks(chunk_size=2))
+    # Text and float columns of the sample keep their type in every chunk
+    assert [chunk["TEXT"].tolist() for chunk in chunks] == [["a", "b"], ["007", "c"], ["d"]]
+    assert all(chunk["VALUE"].dtype == "float64" for chunk in chunks)
+    # Integer columns are widened by the first chunk with missing values or text
+    assert chunks[0]["ID"].tolist() == [1, 2]
+    assert chunks[1]["ID"].dtype == "float64"
+    assert chunks[1]["ID"].tolist()[0] == 3.0
+    assert chunks[2]["ID"].tolist() == ["x"]
+
+
+def test_chunks_drop_duplicates_across_chunks(tmp_path):
+    path = tmp_path / "table.csv"
+    rows = ["1|a", "2|b", "1|a", "3|c", "2|b", "3|c", "4|d"]
+    path.write_text("\n".join(["ID|TEXT", *rows]) + "\n")
+    strategy = BaseDataLoadStrategy(
+        file_path=str(path),
+        configuration={"file_name": path.name, "csv": {"delimiter": "|", "encoding": "utf-8"}},
+    )
+    chunks = pd.concat(list(strategy.iter_chunks(chunk_size=2)))
+    assert chunks["ID"].tolist() == [1, 2, 3, 4]
+    assert strategy.duplicate_rows == 3
+
+
+def test_colliding_row_hashes_are_compared_by_value(monkeypatch):
+    df = pd.DataFrame({"ID": [1, 2, 1, 3], "TEXT": ["a", "b", "a", "c"]})
+    # Every row has the same hash, only the third row is a duplicate
+    monkeypatch.setattr(
+        loader,
+        "row_fingerprints",
+        lambda table: pd.Series(0, index=table.index, dtype="uint64"),
+    )
+    assert loader._duplicated_rows(df).tolist() == [False, False, True, False]
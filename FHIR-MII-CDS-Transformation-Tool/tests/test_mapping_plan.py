@@ -0,0 +1,134 @@
+import json
+import os
+import sys
+
+import pytest
+from fhir.resources import construct_fhir_element
+from fhir_config_loader import FHIRConfigLoader
+from join_planner import JoinPlan
+from loader import Loader
+from mapping_plan import MappingPlan
+from processor_registry import ProcessorRegistry
+
+TOOL_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(TOOL_ROOT, "omfs-dataset", "config")
+
+sys.path.insert(0, os.path.join(TOOL_ROOT, "omfs-dataset"))
+
+import synthetic  # noqa: E402
+
+# Rows of the synthetic event tables, every mapping yields some resources
+ROWS = 120
+
+
+class RowWiseMapping:
+    """
+    The field mapping rules of the former row-by-row transformation, applied to the rows
+    of the joined table as passed by DataFrame.apply(axis=1).
+    """
+
+    def __init__(self, processors):
+        self.processors = processors
+
+    def fill_dict(self, row, mapping):
+        result = {}
+        for key, val in mapping.items():
+            if isinstance(val, dict):
+                result[key] = self.fill_dict(row, val)
+            elif isinstance(val, list):
+                result = self.handle_list(key, result, row, val)
+            elif isinstance(val, str):
+                if val.startswith("$") and val.endswith("$"):
+                    result[key] = self.call([val.strip("$")], row)
+                elif not val.startswith("%") and not val.endswith("%"):
+                    if val.lower() != "none":
+                        result[key] = val
+                    else:
+                        result.pop(key, None)
+                elif val.startswith("%") and val.endswith("%") and val.strip("%") in row:
+                    if str(row[val.strip("%")]).lower() not in ("none", "nan"):
+                        result[key] = row[val.strip("%")]
+                    else:
+                        result.pop(key, None)
+                else:
+                    raise ValueError(f"Invalid field mapping: {val}")
+            else:
+                raise ValueError(f"Invalid field mapping: {val}")
+        return result
+
+    def handle_list(self, key, result, row, val):
+        if any(isinstance(item, str) and item.strip("$") in self.processors for item in val):
+            res = self.call(val, row)
+            if res != "none" and res != "nan":
+                result[key] = res
+            else:
+                result.pop(key, None)
+            return result
+        processed_list = []
+        for item in val:
+            if isinstance(item, dict):
+                processed_list.append(self.fill_dict(row, item))
+            elif isinstance(item, list):
+                processed_list.append(self.handle_list(key, result, row, item)[key])
+            else:
+                processed_list.append(str(row[item.strip("%")]))
+        result[key] = processed_list
+        return result
+
+    def call(self, val, row):
+        name = next(item.strip("$") for item in val if item.strip("$") in self.processors)
+        args = [row[item.strip("%")] for item in val if item.strip("$") != name]
+        return self.processors[name](*args)
+
+
+@pytest.fixture(scope="module")
+def omfs(tmp_path_factory):
+    data_folder = tmp_path_factory.mktemp("data")
+    synthetic.generate(data_folder, rows=ROWS)
+    config = FHIRConfigLoader(os.path.join(CONFIG_DIR, "config.json"))
+    registry = ProcessorRegistry(
+        [os.path.join(CONFIG_DIR, "omfs_data_processors.py")],
+        pure_processors=config.load_pure_processors(),
+    )
+    return config, registry, str(data_folder)
+
+
+def _joined_table(config, data_folder, mapping):
+    table_loader = config.config.get("table_loader")
+    tables = {
+        table_name: Loader(
+            data_path=os.path.join(data_folder, table_loader[table_name]["file_name"]),
+            configuration=table_loader[table_name],
+        ).load()
+        for table_name in mapping.get("usedTables")
+    }
+    join_on = mapping.get("join_on", [])
+    if join_on:
+        return JoinPlan(tables, join_on).execute()
+    table_name = mapping.get("usedTables")[0]
+    table = tables[table_name].copy()
+    table.columns = [f"{table_name}.{column}" for column in table.columns]
+    return table
+
+
+def _validated(resource_type, fhir_dict):
+    return json.loads(construct_fhir_element(resource_type, fhir_dict).json())
+
+
+def test_plan_matches_row_wise_mapping(omfs, tmp_path, monkeypatch):
+    monkeypatch.setenv("DW2CDS_COUNTRY_INDEX", str(tmp_path / "country_index.json"))
+    config, registry, data_folder = omfs
+    row_wise = RowWiseMapping(registry.get_processors())
+    for mapping in config.load_mappings():
+        resource_type = mapping.get("resourceType")
+        fields = mapping.get("fields", {})
+        table = _joined_table(config, data_folder, mapping)
+        assert len(table) > 0, resource_type
+
+        plan = MappingPlan.compile(fields, registry)
+        expected = table.apply(row_wise.fill_dict, axis=1, args=(fields,))
+        for index, fhir_dict in enumerate(plan.iter_resources(table)):
+            assert _validated(resource_type, fhir_dict) == _validated(
+                resource_type,
+                expected.iloc[index],
+            ), f"{resource_type} row {index}"
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+from mapping_scheduler import MappingScheduler
+
+MAPPINGS = [
+    {"resourceType": "Patient", "usedTables": ["Patient"]},
+    {"resourceType": "Observation", "usedTables": ["Lab", "Case"]},
+    {"resourceType": "Encounter", "usedTables": ["Case"]},
+    {"resourceType": "Condition", "usedTables": ["Patient", "Diagnosis"]},
+]
+SIZES = {"Patient": 10, "Lab": 100, "Case": 20, "Diagnosis": 30}
+
+
+def test_shared_tables():
+    scheduler = MappingScheduler(MAPPINGS, SIZES)
+    assert scheduler.shared_tables() == {"Case": [1, 2], "Patient": [0, 3]}
+
+
+def test_order_reuses_loaded_tables():
+    scheduler = MappingScheduler(MAPPINGS, SIZES)
+    # The mappings sharing a table follow each other, Patient is evicted before Lab is loaded
+    assert scheduler.order() == [0, 3, 1, 2]
+    # Ties are broken by the given order
+    assert scheduler.order([2, 1]) == [2, 1]
+
+
+def test_run_limits_concurrent_mappings():
+    scheduler = MappingScheduler(MAPPINGS, SIZES)
+    running, peak, finished = set(), [0], []
+    lock = threading.Lock()
+    main_thread = threading.current_thread()
+
+    def transform(index):
+        with lock:
+            running.add(index)
+            peak[0] = max(peak[0], len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(index)
+        return index * 10
+
+    def finish(index, result):
+        # Results are finished in the calling thread
+        assert threading.current_thread() is main_thread
+        finished.append((index, result))
+
+    scheduler.run([0, 3, 2, 1], transform, finish, workers=2)
+    assert peak[0] == 2
+    assert sorted(finished) == [(0, 0), (1, 10), (2, 20), (3, 30)]
+
+
+def test_run_keeps_loaded_tables_within_memory_budget():
+    scheduler = MappingScheduler(MAPPINGS, SIZES, memory_budget=120)
+    running, overlaps = set(), []
+    lock = threading.Lock()
+
+    def transform(index):
+        with lock:
+            running.add(index)
+            overlaps.append(frozenset(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(index)
+
+    scheduler.run([0, 1, 2, 3], transform, lambda index, result: None, workers=4)
+    # Observation uses 120 bytes, it does not run with another mapping
+    assert all(len(overlap) == 1 for overlap in overlaps if 1 in overlap)
+    assert max(len(overlap) for overlap in overlaps) > 1
+
+
+def test_run_raises_errors_of_mappings():
+    scheduler = MappingScheduler(MAPPINGS, SIZES)
+
+    def transform(index):
+        if index == 2:
+            raise ValueError("mapping failed")
+
+    with pytest.raises(ValueError, match="mapping failed"):
+        scheduler.run([0, 1, 2, 3], transform, lambda index, result: None, workers=1)
@@ -0,0 +1,45 @@
+import textwrap
+
+from processor_registry import ProcessorRegistry
+
+PROCESSORS = '''
+def process_upper(value):
+    return str(value).upper()
+
+
+def batch_upper(values):
+    return values.astype(str).str.upper()
+
+
+def process_lower(value):
+    return str(value).lower()
+
+
+def batch_unrelated(values):
+    return values
+'''
+
+
+def _registry(tmp_path, source=PROCESSORS, **kwargs):
+    # Every test imports its own module, the registry imports modules by name
+    path = tmp_path / f"processors_{tmp_path.name}.py"
+    path.write_text(textwrap.dedent(source))
+    return ProcessorRegistry([str(path)], **kwargs)
+
+
+def test_batch_implementations_are_found_by_name(tmp_path):
+    registry = _registry(tmp_path)
+    assert sorted(registry.get_processors()) == ["process_lower", "process_upper"]
+    assert registry.get_batch_processor("process_upper").__name__ == "batch_upper"
+    assert registry.get_batch_processor("process_lower") is None
+
+
+def test_configured_pure_processors_are_memoized(tmp_path):
+    registry = _registry(tmp_path, pure_processors=["process_upper", "process_missing"])
+    assert registry.is_pure("process_upper")
+    assert not registry.is_pure("process_lower")
+    assert registry.get_processor("process_upper")("a") == "A"
+    assert registry.get_processor("process_upper")("a") == "A"
+    assert registry.cache_statistics()["process_upper"]["hits"] == 1
+    # The batch implementation of a memoized processor is kept
+    assert registry.get_batch_processor("process_upper").__name__ == "batch_upper"
@@ -0,0 +1,65 @@
+import pandas as pd
+from state_store import StateStore
+
+MAPPING = {"resourceType": "Patient", "usedTables": ["Patient"], "fields": {"id": "%ID%"}}
+
+
+def _resource_ids(table):
+    return [str(resource_id) for resource_id in table["ID"]]
+
+
+def _run(store, table, mapping=MAPPING):
+    state = store.begin_mapping(mapping)
+    changed = state.changed_rows(table, _resource_ids)
+    return changed, state.commit()
+
+
+def test_incremental_runs_select_new_and_changed_rows(tmp_path):
+    with StateStore(tmp_path / "state.sqlite") as store:
+        first = pd.DataFrame({"ID": [1, 2, 3], "NAME": ["a", "b", "c"]})
+        changed, deleted = _run(store, first)
+        assert changed["ID"].tolist() == [1, 2, 3]
+        assert deleted == []
+
+        # Row 2 is changed, row 3 disappears and row 4 is new
+        second = pd.DataFrame({"ID": [1, 2, 4], "NAME": ["a", "B", "d"]})
+        changed, deleted = _run(store, second)
+        assert changed["ID"].tolist() == [2, 4]
+        assert deleted == ["3"]
+
+        changed, deleted = _run(store, second)
+        assert changed.empty
+        assert deleted == []
+
+
+def test_reloaded_dtypes_do_not_change_rows(tmp_path):
+    table = pd.DataFrame({"ID": [1, 2], "NAME": ["a", "b"]})
+    with StateStore(tmp_path / "state.sqlite") as store:
+        _run(store, table)
+        reloaded = pd.DataFrame({
+            "NAME": table["NAME"].astype("category"),
+            "ID": table["ID"].astype("int8"),
+        })
+        changed, deleted = _run(store, reloaded)
+        assert changed.empty
+        assert deleted == []
+
+
+def test_changed_mapping_transforms_all_rows(tmp_path):
+    table = pd.DataFrame({"ID": [1, 2], "NAME": ["a", "b"]})
+    with StateStore(tmp_path / "state.sqlite") as store:
+        _run(store, table)
+        mapping = {**MAPPING, "fields": {"id": "%ID%", "name": "%NAME%"}}
+        changed, deleted = _run(store, table, mapping)
+        assert changed["ID"].tolist() == [1, 2]
+        assert deleted == []
+
+
+def test_state_is_kept_across_connections(tmp_path):
+    table = pd.DataFrame({"ID": [1, 2], "NAME": ["a", "b"]})
+    with StateStore(tmp_path / "state.sqlite") as store:
+        _run(store, table)
+    with StateStore(tmp_path / "state.sqlite") as store:
+        changed, deleted = _run(store, table.iloc[:1])
+        assert changed.empty
+        assert deleted == ["2"]
@@ -0,0 +1,78 @@
+import datetime
+import json
+
+import numpy as np
+import pandas as pd
+from fhir.resources import construct_fhir_element
+from processor_registry import ProcessorRegistry
+from transformer import FHIRTransformer
+from validation import ValidationSettings, resource_json
+
+PATIENT = {
+    "id": 500000,
+    "identifier": [{"system": "urn:case", "value": 100000}],
+    "address": [
+        {"city": "Aachen", "postalCode": 52062, "country": "DE"},
+        {"city": "Köln", "postalCode": 50667.0, "line": [3]},
+    ],
+    "birthDate": datetime.date(1983, 6, 10),
+    "managingOrganization": {},
+    "gender": None,
+}
+
+ENCOUNTER = {
+    "id": 100000,
+    "status": "finished",
+    "class": {"system": "http://terminology.hl7.org/CodeSystem/v3-ActCode", "code": "IMP"},
+    "period": {"start": "2017-01-27T12:27:38Z", "end": datetime.datetime(2022, 1, 23, 14, 17)},
+    "subject": {"reference": "Patient/500000"},
+}
+
+
+def _validated(resource_type, fhir_dict):
+    return json.loads(construct_fhir_element(resource_type, dict(fhir_dict)).json())
+
+
+def test_assembled_resource_matches_validated_resource():
+    for resource_type, fhir_dict in (("Patient", PATIENT), ("Encounter", ENCOUNTER)):
+        assembled = json.loads(resource_json(resource_type, fhir_dict))
+        assert assembled == _validated(resource_type, fhir_dict)
+
+
+def test_string_elements_are_strings():
+    assembled = json.loads(resource_json("Patient", PATIENT))
+    assert assembled["id"] == "500000"
+    assert assembled["identifier"][0]["value"] == "100000"
+    assert [address["postalCode"] for address in assembled["address"]] == ["52062", "50667.0"]
+    assert assembled["address"][1]["line"] == ["3"]
+    assert "managingOrganization" not in assembled
+
+
+def test_numpy_numbers_in_string_elements():
+    assembled = json.loads(resource_json("Patient", {"id": np.int64(7), "active": np.bool_(True)}))
+    assert assembled == {"resourceType": "Patient", "id": "7", "active": True}
+
+
+def test_elements_are_ordered_like_the_model():
+    encounter = dict(reversed(list(ENCOUNTER.items())))
+    assembled = resource_json("Encounter", encounter)
+    assert assembled == construct_fhir_element("Encounter", dict(encounter)).json(return_bytes=True)
+
+
+def test_sample_mismatches_are_counted(fhir_server, tmp_path):
+    # The model converts the string to a boolean, the assembled resource keeps it
+    transformer = FHIRTransformer(
+        field_mappings={"fields": {"id": "%ID%", "active": "%ACTIVE%"}},
+        processor_paths=[],
+        output_data_folder_path=str(tmp_path),
+        processor_registry=ProcessorRegistry([]),
+        ndjson_file=str(tmp_path / "Patient.ndjson"),
+        validation=ValidationSettings(mode="sample", sample_rate=2),
+    )
+    table = pd.DataFrame({"ID": [1, 2, 3], "ACTIVE": ["true", "true", "true"]})
+    transformer.transform_table(table, "Patient", fhir_server.base_url, progress=False)
+    assert transformer.sampler.validated == 2
+    assert transformer.sampler.mismatches == 2
+    # The run continues, every assembled resource is emitted
+    with open(tmp_path / "Patient.ndjson") as ndjson:
+        assert [json.loads(line)["active"] for line in ndjson] == ["true"] * 3